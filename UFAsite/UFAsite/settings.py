@@ -154,6 +154,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # LINE BOT CONFIGURATION
 LINE_CHANNEL_ACCESS_TOKEN = os.environ.get('LINE_CHANNEL_ACCESS_TOKEN', 'dX4d0TaVaT+LYdOsf87JxmPVCZwTiFRuF5LLKOiTJlb3xJd726q5vdjchZqfMAdQNVsfuBf/IVL0eLRPcBq1xSAJ/sYuWVvcmrZaS8UKd4dciT9I75juk/W1XLaf6OMDyJLU8RtpONl9YGu7ZIej3gdB04t89/1O/w1cDnyilFU=')
 LINE_CHANNEL_SECRET = os.environ.get('LINE_CHANNEL_SECRET', 'dd13871dbe48900588ea526959bd8525')
+# เปลี่ยนได้เพื่อทดสอบกับ LINE API จำลอง
+LINE_API_HOST = os.environ.get('LINE_API_HOST', 'https://api.line.me')
 
 # Security settings for production
 if not DEBUG:
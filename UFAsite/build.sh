@@ -11,4 +11,7 @@ else
     exit 1
 fi
 python manage.py collectstatic --no-input
-python manage.py migrate
\ No newline at end of file
+python manage.py migrate
+# โมเดลอยู่ใน model_artifacts/ (ไม่อยู่ใน git) train ใหม่ทุก deploy ให้ web worker มีเวอร์ชันใน registry เสมอ
+# (train ไม่สำเร็จ เช่นยังไม่มีข้อมูล = ไม่ทำให้ build ล้ม หน้าเว็บ/แชทแจ้งว่ายังไม่มีโมเดล)
+python manage.py train_model
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WaterStations, WaterLevels, Users
+from .models import WaterStations, WaterLevels, LatestWaterLevel, HourlyWaterLevel, StationAlertState, IngestLock, AlertOutbox, AlertBatch, Users
 
 @admin.register(WaterStations)
 class WaterStationsAdmin(admin.ModelAdmin):
@@ -12,6 +12,38 @@ class WaterLevelsAdmin(admin.ModelAdmin):
     list_filter = ('station', 'risk_level', 'recorded_at')
     ordering = ('-recorded_at',)
 
+@admin.register(LatestWaterLevel)
+class LatestWaterLevelAdmin(admin.ModelAdmin):
+    list_display = ('station', 'water_level', 'risk_level', 'recorded_at', 'updated_at')
+    ordering = ('station',)
+
+@admin.register(HourlyWaterLevel)
+class HourlyWaterLevelAdmin(admin.ModelAdmin):
+    list_display = ('station', 'hour', 'water_level', 'reading_count', 'updated_at')
+    list_filter = ('station',)
+    ordering = ('-hour',)
+
+@admin.register(StationAlertState)
+class StationAlertStateAdmin(admin.ModelAdmin):
+    list_display = ('station', 'state', 'last_level', 'changed_at', 'last_alert_at', 'updated_at')
+
+@admin.register(IngestLock)
+class IngestLockAdmin(admin.ModelAdmin):
+    list_display = ('name', 'cycle_at', 'owner', 'claimed_at')
+
+class AlertBatchInline(admin.TabularInline):
+    model = AlertBatch
+    extra = 0
+    fields = ('batch_index', 'recipient_count', 'status', 'attempts', 'http_status', 'duration_ms', 'sent_at', 'error')
+    readonly_fields = fields
+
+@admin.register(AlertOutbox)
+class AlertOutboxAdmin(admin.ModelAdmin):
+    inlines = [AlertBatchInline]
+    list_display = ('id', 'status', 'attempts', 'recipient_count', 'created_at', 'sent_at', 'next_attempt_at')
+    list_filter = ('status',)
+    ordering = ('-created_at',)
+
 @admin.register(Users)
 class UsersAdmin(admin.ModelAdmin):
     list_display = ('display_name', 'line_user_id', 'is_active', 'last_subscribed_at')
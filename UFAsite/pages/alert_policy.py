@@ -0,0 +1,70 @@
+# pages/alert_policy.py
+
+from datetime import timedelta
+
+from .risk_calculator import STATION_THRESHOLDS, evaluate_flood_risk
+
+# --- Constants ---
+NORMAL, WARNING, CRITICAL = 0, 1, 2
+
+# ระดับน้ำต้องลดต่ำกว่าเกณฑ์เท่านี้ (เมตร) ถึงจะถือว่าลดระดับสถานะ
+# กันน้ำที่แกว่งขึ้นลงรอบ ๆ เกณฑ์ทำให้สถานะสลับไปมา (และแจ้งเตือนซ้ำ) ทุก 15 นาที
+HYSTERESIS_MARGIN = 0.10
+
+# หลังแจ้งเตือนแล้ว ถ้ากลับเข้าวิกฤตอีกภายในช่วงนี้จะไม่แจ้งซ้ำ
+ALERT_COOLDOWN = timedelta(hours=6)
+
+_THRESHOLD_KEYS = {WARNING: 'warn', CRITICAL: 'crit'}
+
+
+class AlertPolicy:
+    """
+    State machine การแจ้งเตือนของ 1 สถานี (ปกติ / เฝ้าระวัง / วิกฤต)
+    ขึ้นสถานะทันทีที่ถึงเกณฑ์ ลดสถานะเมื่อต่ำกว่าเกณฑ์เกิน margin และแจ้งเตือนเฉพาะตอนเข้าสู่วิกฤต
+
+    every_reading=True คือพฤติกรรมเดิม (แจ้งทุกครั้งที่อ่านค่าได้วิกฤต) ใช้เทียบใน replay_alerts
+    """
+
+    def __init__(self, name, margin=HYSTERESIS_MARGIN, cooldown=ALERT_COOLDOWN, every_reading=False):
+        self.name = name
+        self.margin = margin
+        self.cooldown = cooldown
+        self.every_reading = every_reading
+
+    def threshold(self, station_id, state):
+        thresholds = STATION_THRESHOLDS.get(station_id, STATION_THRESHOLDS['TS16'])
+        return thresholds[_THRESHOLD_KEYS[state]]
+
+    def step(self, state, last_alert_at, level, station_id, at, entered_at=None):
+        """
+        Args:
+            state: สถานะปัจจุบันของสถานี
+            last_alert_at: เวลาที่แจ้งเตือนครั้งล่าสุด (None = ยังไม่เคย)
+            level, station_id, at: ค่าระดับน้ำใหม่และเวลาที่วัด
+            entered_at: เวลาที่เข้าสู่สถานะปัจจุบัน (changed_at) ใช้หาการเข้าวิกฤตที่ถูก cooldown กันไว้
+
+        Returns:
+            tuple: (สถานะใหม่, ต้องแจ้งเตือนหรือไม่)
+        """
+        raw_state, _ = evaluate_flood_risk(level, station_id)
+
+        new_state = state
+        if raw_state > state:
+            new_state = raw_state
+        else:
+            # ลดทีละขั้น เฉพาะเมื่อต่ำกว่าเกณฑ์ของสถานะนั้นเกิน margin
+            while new_state > raw_state and level < self.threshold(station_id, new_state) - self.margin:
+                new_state -= 1
+
+        if self.every_reading:
+            return new_state, raw_state == CRITICAL
+
+        in_cooldown = last_alert_at is not None and self.cooldown is not None and at - last_alert_at < self.cooldown
+        if new_state != CRITICAL or in_cooldown:
+            return new_state, False
+        # เพิ่งเข้าวิกฤต หรือเข้าวิกฤตรอบนี้ระหว่าง cooldown (ยังไม่ได้แจ้ง) แล้วยังวิกฤตอยู่หลังพ้น cooldown
+        pending = last_alert_at is None or (entered_at is not None and last_alert_at < entered_at)
+        return new_state, state < CRITICAL or pending
+
+
+DEFAULT_POLICY = AlertPolicy('hysteresis')
@@ -0,0 +1,294 @@
+# pages/alert_queue.py
+
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.db import connection
+from django.db.models import Min, Q, Sum
+from django.utils import timezone
+from linebot.v3.messaging.exceptions import ApiException
+from urllib3.exceptions import HTTPError
+
+from .models import AlertBatch, AlertOutbox, Users
+from .utils import MULTICAST_MAX_RECIPIENTS, send_multicast_batch
+
+# --- Constants ---
+MAX_ATTEMPTS = 5               # ส่งไม่สำเร็จครบเท่านี้ = failed
+RETRY_BACKOFF_SECONDS = 30     # รอ 30, 60, 120, ... วินาที ก่อนลองใหม่ (ถ้า LINE ไม่ได้บอก Retry-After มา)
+SENDING_TIMEOUT = timedelta(minutes=5)  # สถานะ sending ค้างนานกว่านี้ (process ตายกลางทาง) ให้ลองใหม่
+DISPATCH_BATCH_SIZE = 20
+FANOUT_WORKERS = 4             # ส่งพร้อมกันสูงสุดกี่ชุด (ต้องไม่เกิน CONNECTION_POOL_MAXSIZE ของ line_client)
+BACKGROUND_MAX_WAIT = 180      # วินาที: thread เบื้องหลังรอส่งซ้ำได้นานสุดเท่านี้ ที่เหลือให้รอบถัดไปจัดการ
+SKIPPED_NOTE = 'skipped: no active recipients in this range (no request sent)'
+
+_background_lock = threading.Lock()
+
+
+def enqueue_alerts(messages):
+    """
+    เพิ่มข้อความแจ้งเตือนเข้าคิว (INSERT ครั้งเดียว ไม่เรียก LINE API)
+    ควรเรียกภายใน transaction เดียวกับการบันทึกข้อมูลที่ทำให้เกิดการแจ้งเตือน
+    """
+    return AlertOutbox.objects.bulk_create([AlertOutbox(message=message) for message in messages])
+
+
+def is_retryable(error):
+    """429 (rate limit), 5xx และ network error ลองใหม่ได้; 4xx อื่น ๆ (token ผิด, request ผิด) ลองใหม่ก็ไม่ผ่าน"""
+    if isinstance(error, ApiException):
+        return error.status == 429 or (error.status or 0) >= 500
+    return isinstance(error, (HTTPError, OSError))
+
+
+def retry_delay(error, attempts):
+    """ระยะเวลารอก่อนลองใหม่ (ใช้ Retry-After จาก LINE ถ้ามี ไม่งั้นเพิ่มเป็น 2 เท่าทุกครั้ง)"""
+    headers = getattr(error, 'headers', None) or {}
+    retry_after = headers.get('Retry-After') if hasattr(headers, 'get') else None
+    if retry_after is not None:
+        try:
+            return timedelta(seconds=max(0.0, float(retry_after)))
+        except ValueError:
+            pass
+    return timedelta(seconds=RETRY_BACKOFF_SECONDS * (2 ** (attempts - 1)))
+
+
+def _due(now):
+    return AlertOutbox.objects.filter(
+        Q(status=AlertOutbox.PENDING, next_attempt_at__lte=now)
+        | Q(status=AlertOutbox.SENDING, locked_at__lt=now - SENDING_TIMEOUT)
+    )
+
+
+def _claim(alert, now):
+    """จองข้อความด้วย UPDATE แบบมีเงื่อนไข (dispatcher หลายตัวทำงานพร้อมกันได้ ไม่ส่งซ้ำ)"""
+    claimed = AlertOutbox.objects.filter(pk=alert.pk, status=alert.status, attempts=alert.attempts).update(
+        status=AlertOutbox.SENDING, locked_at=now, attempts=alert.attempts + 1
+    )
+    if claimed:
+        alert.status, alert.locked_at, alert.attempts = AlertOutbox.SENDING, now, alert.attempts + 1
+    return bool(claimed)
+
+
+def iter_recipient_batches(after_user_id=None, size=MULTICAST_MAX_RECIPIENTS):
+    """
+    อ่านผู้รับที่ active ทีละชุด (เรียงตาม user_id แบบ keyset: WHERE user_id > ล่าสุด LIMIT size)
+    ไม่ต้องโหลด User ทั้งหมดเข้าหน่วยความจำ และไม่ค้าง cursor ไว้ระหว่างบันทึกผลแต่ละชุด
+
+    Yields:
+        list: [(user_id, line_user_id), ...] ไม่เกิน size คน
+    """
+    active = Users.objects.filter(is_active=1).order_by('user_id').values_list('user_id', 'line_user_id')
+    while True:
+        chunk = list((active.filter(user_id__gt=after_user_id) if after_user_id is not None else active)[:size])
+        if not chunk:
+            return
+        yield chunk
+        after_user_id = chunk[-1][0]
+
+
+def _plan_batches(alert):
+    """
+    ชุดที่ต้องส่งรอบนี้: ชุดเดิมที่รอลองใหม่ (ผู้รับตามช่วง user_id เดิม)
+    แล้วตามด้วยผู้รับที่ยังไม่อยู่ในชุดไหน (ครั้งแรก = ทุกคน, ลองใหม่ = ที่ยังไม่ได้ส่ง/เพิ่งสมัคร)
+
+    Yields:
+        (AlertBatch, [line_user_id, ...])
+    """
+    covered = None
+    next_index = 0
+    for batch in alert.batches.order_by('batch_index'):
+        covered, next_index = batch.last_user_id, batch.batch_index + 1
+        if batch.status != AlertOutbox.PENDING:
+            continue  # ส่งแล้ว หรือ error ที่ลองใหม่ไม่ได้ (เช่น 400)
+        recipients = list(
+            Users.objects.filter(is_active=1, user_id__range=(batch.first_user_id, batch.last_user_id))
+            .order_by('user_id').values_list('line_user_id', flat=True)
+        )
+        yield batch, recipients
+
+    for chunk in iter_recipient_batches(covered):
+        batch = AlertBatch.objects.create(
+            alert=alert, batch_index=next_index,
+            first_user_id=chunk[0][0], last_user_id=chunk[-1][0], recipient_count=len(chunk),
+        )
+        next_index += 1
+        yield batch, [line_user_id for _, line_user_id in chunk]
+
+
+def _send_batch(message, recipients, retry_key):
+    """รันใน thread ของ pool: ส่ง 1 ชุด คืน (error หรือ None, เวลาที่ใช้ ms) ไม่แตะ DB"""
+    started = time.perf_counter()
+    try:
+        send_multicast_batch(recipients, message, retry_key=retry_key)
+        error = None
+    except Exception as e:
+        error = e
+    return error, int((time.perf_counter() - started) * 1000)
+
+
+def _record_batch(batch, error, duration_ms):
+    """บันทึกผลของ 1 ชุด (เรียกจาก thread หลักเท่านั้น)"""
+    batch.attempts += 1
+    batch.duration_ms = duration_ms
+    if error is None:
+        batch.status, batch.http_status, batch.error, batch.sent_at = AlertOutbox.SENT, 200, None, timezone.now()
+    else:
+        batch.status = AlertOutbox.PENDING if is_retryable(error) else AlertOutbox.FAILED
+        batch.http_status = getattr(error, 'status', None)
+        batch.error = _describe(error)
+    batch.save()
+    print(f"📦 Alert #{batch.alert_id} batch {batch.batch_index}: {batch.recipient_count} users -> "
+          f"{batch.status} ({batch.http_status or batch.error}) in {duration_ms} ms")
+
+
+def _skip_batch(batch):
+    """
+    ชุดที่ผู้รับในช่วงนี้ยกเลิกหมดแล้ว: ปิดชุดโดยไม่ได้เรียก LINE API
+    ไม่บันทึก http_status (ไม่มี response จริง) และไม่นับผู้รับ สถิติการส่งจึงไม่มี 200 ที่ไม่ได้เกิดขึ้น
+    """
+    batch.status, batch.http_status, batch.error = AlertOutbox.SENT, None, SKIPPED_NOTE
+    batch.recipient_count, batch.duration_ms, batch.sent_at = 0, None, None
+    batch.save()
+    print(f"📦 Alert #{batch.alert_id} batch {batch.batch_index}: {SKIPPED_NOTE}")
+
+
+def _describe(error):
+    return f'{type(error).__name__}: {getattr(error, "status", "")} {getattr(error, "reason", "") or error}'.strip()
+
+
+def fan_out(alert):
+    """
+    ส่งข้อความ 1 รายการหาผู้รับทุกคน แบ่งชุดละไม่เกิน 500 คน ส่งพร้อมกันไม่เกิน FANOUT_WORKERS ชุด
+    ถ้าโดน rate limit (429) จะหยุดส่งชุดใหม่ทันที ชุดที่เหลือไว้ส่งตอนลองใหม่
+
+    Returns:
+        tuple: (error ที่ลองใหม่ได้, error ที่ลองใหม่ไม่ได้) ทั้งคู่ว่าง = ส่งครบทุกชุด
+    """
+    retryable, failed = [], []
+    in_flight = {}
+
+    def collect(futures):
+        for future in futures:
+            batch = in_flight.pop(future)
+            error, duration_ms = future.result()
+            _record_batch(batch, error, duration_ms)
+            if error is not None:
+                (retryable if batch.status == AlertOutbox.PENDING else failed).append(error)
+
+    with ThreadPoolExecutor(max_workers=FANOUT_WORKERS) as executor:
+        for batch, recipients in _plan_batches(alert):
+            if not recipients:
+                # ผู้รับในช่วงนี้ยกเลิกหมดแล้ว
+                _skip_batch(batch)
+                continue
+
+            retry_key = str(uuid.uuid5(alert.retry_key, str(batch.batch_index)))  # คงที่ต่อชุด
+            in_flight[executor.submit(_send_batch, alert.message, recipients, retry_key)] = batch
+            if len(in_flight) >= FANOUT_WORKERS:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            if any(getattr(e, 'status', None) == 429 for e in retryable):
+                break  # ไม่ยิงเพิ่มระหว่างโดน rate limit
+
+        collect(list(in_flight))
+
+    # ผู้รับที่ยังไม่ได้แบ่งชุดเพราะหยุดกลางทาง รอบลองใหม่จะต่อจาก user_id ล่าสุดเอง
+    return retryable, failed
+
+
+def deliver(alert):
+    """
+    ส่งข้อความ 1 รายการที่จองไว้แล้ว แล้วบันทึกผล (ผลรายชุดอยู่ใน AlertBatch)
+
+    Returns:
+        str: สถานะหลังส่ง (sent / pending = รอลองใหม่ / failed)
+    """
+    try:
+        retryable, failed = fan_out(alert)
+    except Exception as e:
+        retryable, failed = ([e], []) if is_retryable(e) else ([], [e])
+
+    errors = failed + retryable
+    if errors:
+        alert.last_error = _describe(errors[0])
+    alert.recipient_count = alert.batches.filter(status=AlertOutbox.SENT).aggregate(total=Sum('recipient_count'))['total'] or 0
+
+    if retryable and alert.attempts < MAX_ATTEMPTS:
+        alert.status = AlertOutbox.PENDING
+        alert.next_attempt_at = timezone.now() + max(retry_delay(e, alert.attempts) for e in retryable)
+        print(f"⚠️ Alert #{alert.pk} failed ({alert.last_error}), retry at {timezone.localtime(alert.next_attempt_at).strftime('%H:%M:%S')}")
+    elif errors or alert.batches.filter(status=AlertOutbox.FAILED).exists():
+        # บางชุดส่งไม่ได้ถาวร (ชุดอื่นส่งไปแล้ว ดูรายชุดได้ที่ AlertBatch)
+        alert.status = AlertOutbox.FAILED
+        print(f"❌ Alert #{alert.pk} failed after {alert.attempts} attempt(s): {alert.last_error} ({alert.recipient_count} users reached)")
+    else:
+        alert.status = AlertOutbox.SENT
+        alert.sent_at = timezone.now()
+        alert.last_error = None
+        print(f"✅ Sent alert #{alert.pk} to {alert.recipient_count} users.")
+
+    alert.locked_at = None
+    alert.save(update_fields=['status', 'next_attempt_at', 'recipient_count', 'last_error', 'locked_at', 'sent_at'])
+    return alert.status
+
+
+def dispatch_pending(limit=DISPATCH_BATCH_SIZE, now=None):
+    """
+    ส่งข้อความที่ถึงกำหนดส่งแล้ว (เก่าสุดก่อน)
+
+    Returns:
+        dict: จำนวนข้อความตามสถานะหลังส่ง {'sent': .., 'pending': .., 'failed': ..}
+    """
+    now = now or timezone.now()
+    counts = {AlertOutbox.SENT: 0, AlertOutbox.PENDING: 0, AlertOutbox.FAILED: 0}
+    for alert in _due(now).order_by('created_at')[:limit]:
+        if _claim(alert, now):
+            counts[deliver(alert)] += 1
+    return counts
+
+
+def drain(max_wait=0):
+    """
+    ส่งจนคิวว่าง รอส่งซ้ำข้อความที่ถึงกำหนดภายใน max_wait วินาที (ที่เหลือให้ dispatcher รอบถัดไปส่ง)
+
+    Returns:
+        dict: จำนวนข้อความตามสถานะ รวมทุกรอบ
+    """
+    deadline = timezone.now() + timedelta(seconds=max_wait)
+    totals = {AlertOutbox.SENT: 0, AlertOutbox.PENDING: 0, AlertOutbox.FAILED: 0}
+    while True:
+        counts = dispatch_pending()
+        for status, count in counts.items():
+            totals[status] += count
+        if sum(counts.values()) == DISPATCH_BATCH_SIZE:
+            continue  # ยังมีค้างในคิว
+
+        next_at = AlertOutbox.objects.filter(status=AlertOutbox.PENDING).aggregate(next_at=Min('next_attempt_at'))['next_at']
+        if next_at is None or next_at > deadline:
+            return totals
+        time.sleep(max(0.0, (next_at - timezone.now()).total_seconds()))
+
+
+def _drain_in_thread(max_wait):
+    try:
+        drain(max_wait)
+    except Exception as e:
+        print(f"❌ Alert dispatcher error: {e}")
+    finally:
+        _background_lock.release()
+        connection.close()
+
+
+def dispatch_in_background(max_wait=BACKGROUND_MAX_WAIT):
+    """
+    ส่งคิวแจ้งเตือนใน thread แยก (ไม่บล็อกการดึงข้อมูล) ถ้ามี thread ที่ส่งอยู่แล้วจะไม่เริ่มซ้ำ
+    thread ไม่ใช่ daemon: process แบบรันครั้งเดียว (เช่น GitHub Actions) จะรอให้ส่งเสร็จก่อนจบ
+    """
+    if not _background_lock.acquire(blocking=False):
+        return None
+
+    thread = threading.Thread(target=_drain_in_thread, args=(max_wait,), name='alert-dispatcher')
+    thread.start()
+    return thread
@@ -8,9 +8,18 @@ class PagesConfig(AppConfig):
         # เมื่อ Django เริ่มทำงาน ให้ start scheduler ด้วย
         # ต้องเช็คว่าไม่ได้รันอยู่ในโหมด reloader (ป้องกันการรันซ้ำ 2 รอบ)
         import os
+        import sys
         if os.environ.get('RUN_MAIN', None) != 'true' and 'RENDER' not in os.environ:
             return
-            
+
+        # ย้ายงานดึงข้อมูลไป process แยกแล้ว (python manage.py run_ingest) -> web worker ไม่ต้อง start scheduler
+        if os.environ.get('INGEST_IN_WEB', 'true').lower() in ('false', '0', 'no'):
+            return
+
+        # management command อื่น (scrape_data, migrate, run_ingest, ...) ไม่ต้องมี scheduler ของเว็บ
+        if os.path.basename(sys.argv[0]) == 'manage.py' and sys.argv[1:2] != ['runserver']:
+            return
+
         from . import updater
         updater.start()
-        print("🚀 System: Water Scraper Scheduler Started!")
\ No newline at end of file
+        print("🚀 System: Water Scraper Scheduler Started!")
@@ -0,0 +1,115 @@
+# pages/data_loader.py
+
+import numpy as np
+from django.db.models import Max, Min
+
+from .models import HourlyWaterLevel, WaterLevels
+
+# --- Constants ---
+# จำนวนแถวต่อ 1 query (แบ่งหน้าด้วย keyset ทีละสถานี: เวลาของแถวสุดท้ายในหน้าก่อน)
+# ไม่ใช้ .iterator() เพราะ PyMySQL บน MySQL/TiDB ดึงผลทั้งหมดมาเก็บฝั่ง client อยู่ดี
+# หน่วยความจำสูงสุด = ตารางรายชั่วโมง + ข้อมูลดิบแค่หน้าเดียว ไม่ขึ้นกับจำนวนแถวทั้งหมด
+CHUNK_SIZE = 20000
+
+# 'store' = อ่านจากตารางรายชั่วโมง hourly_water_levels (ปกติ), 'raw' = เฉลี่ยจาก water_levels เอง
+SOURCES = ('store', 'raw')
+
+
+def _epoch_hour(value):
+    return int(value.timestamp()) // 3600
+
+
+def _keyset_pages(qs, stations, time_field, fields, chunk_size):
+    """
+    อ่าน qs ทีละสถานี ทีละหน้า (ไม่เกิน chunk_size แถว) เรียงตามเวลา
+    (สถานี, เวลา) เป็น unique และมี index ทั้ง water_levels และ hourly_water_levels
+    แต่ละหน้าจึงเป็นช่วงต่อเนื่องบน index เดียว ไม่ต้อง sort แถวที่เหลือทั้งหมดใหม่ทุกหน้า
+    """
+    for station in stations:
+        page = qs.filter(station_id=station).order_by(time_field).values_list(*fields)
+        chunk = list(page[:chunk_size])
+        while chunk:
+            yield chunk
+            if len(chunk) < chunk_size:
+                break
+            chunk = list(page.filter(**{f'{time_field}__gt': chunk[-1][0]})[:chunk_size])
+
+
+def load_hourly_levels(stations, start=None, end=None, chunk_size=CHUNK_SIZE, source='store'):
+    """
+    อ่านค่ารายชั่วโมงทีละสถานี ทีละหน้า (keyset) ลง NumPy array โดยตรง
+    (ไม่สร้าง dict / DataFrame ของข้อมูลดิบทั้งตาราง)
+
+    Args:
+        stations: รายชื่อ station_id (ลำดับคอลัมน์ของผลลัพธ์)
+        start, end: ช่วงเวลา (end ไม่รวม) None = ไม่จำกัด
+            source='store' นับเป็นชั่วโมง: ชั่วโมงที่เริ่มตั้งแต่ต้นชั่วโมงของ start และเริ่มก่อน end
+        source: 'store' อ่านจาก HourlyWaterLevel, 'raw' เฉลี่ยจาก WaterLevels ระหว่างอ่าน
+
+    Returns:
+        tuple: (hours, levels)
+            hours: datetime64[s] ต้นชั่วโมง (UTC) ต่อเนื่องตั้งแต่ชั่วโมงแรกถึงชั่วโมงสุดท้ายที่มีข้อมูล
+            levels: float64 ขนาด (len(hours), len(stations)) ค่าเฉลี่ยรายชั่วโมง, NaN = ไม่มีค่าวัดในชั่วโมงนั้น
+    """
+    if source not in SOURCES:
+        raise ValueError(f'Unknown source {source!r}, expected one of {SOURCES}')
+
+    if source == 'store':
+        qs = HourlyWaterLevel.objects.all()
+        if start is not None:
+            qs = qs.filter(hour__gte=HourlyWaterLevel.floor_hour(start))
+        if end is not None:
+            qs = qs.filter(hour__lt=end)
+        time_field = 'hour'
+        fields = ('hour', 'station_id', 'level_sum', 'reading_count')
+    else:
+        qs = WaterLevels.objects.filter(water_level__isnull=False, recorded_at__isnull=False)
+        if start is not None:
+            qs = qs.filter(recorded_at__gte=start)
+        if end is not None:
+            qs = qs.filter(recorded_at__lt=end)
+        time_field = 'recorded_at'
+        fields = ('recorded_at', 'station_id', 'water_level')
+
+    # qs ยังไม่กรองสถานี: แต่ละหน้ากรองสถานีเดียวเอง (_keyset_pages)
+    bounds = qs.filter(station_id__in=stations).aggregate(first=Min(time_field), last=Max(time_field))
+    if bounds['first'] is None:
+        return np.empty(0, dtype='datetime64[s]'), np.empty((0, len(stations)))
+
+    first_hour = _epoch_hour(bounds['first'])
+    n_hours = _epoch_hour(bounds['last']) - first_hour + 1
+    n_stations = len(stations)
+    sums = np.zeros(n_hours * n_stations)
+    counts = np.zeros(n_hours * n_stations)
+    station_index = {station: i for i, station in enumerate(stations)}
+
+    for chunk in _keyset_pages(qs, station_index, time_field, fields, chunk_size):
+        hours = np.fromiter((_epoch_hour(r[0]) for r in chunk), dtype=np.int64, count=len(chunk))
+        columns = np.fromiter((station_index[r[1]] for r in chunk), dtype=np.int64, count=len(chunk))
+        values = np.fromiter((r[2] for r in chunk), dtype=np.float64, count=len(chunk))
+        if source == 'store':
+            # แต่ละแถวคือผลรวมของทั้งชั่วโมงแล้ว นับจำนวนตาม reading_count
+            weights = np.fromiter((r[3] for r in chunk), dtype=np.float64, count=len(chunk))
+        else:
+            weights = None
+
+        # ช่องของ (ชั่วโมง, สถานี) ในตารางแบบแบน; หน้าหนึ่งเรียงตามเวลา จึงครอบคลุมช่วงช่องที่ติดกัน
+        cells = (hours - first_hour) * n_stations + columns
+        lo = int(cells.min())
+        chunk_sums = np.bincount(cells - lo, weights=values)
+        sums[lo:lo + chunk_sums.size] += chunk_sums
+        counts[lo:lo + chunk_sums.size] += np.bincount(cells - lo, weights=weights)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        levels = (sums / counts).reshape(n_hours, n_stations)
+    hours = (np.arange(first_hour, first_hour + n_hours, dtype=np.int64) * 3600).astype('datetime64[s]')
+    return hours, levels
+
+
+def load_hourly_frame(stations, start=None, end=None, chunk_size=CHUNK_SIZE, source='store'):
+    """load_hourly_levels ในรูป DataFrame (index = ต้นชั่วโมงแบบ UTC, คอลัมน์ = สถานี) เหมือน pivot_table + resample('h').mean()"""
+    import pandas as pd
+
+    hours, levels = load_hourly_levels(stations, start=start, end=end, chunk_size=chunk_size, source=source)
+    index = pd.DatetimeIndex(hours.astype('datetime64[ns]'), name='recorded_at').tz_localize('UTC')
+    return pd.DataFrame(levels, index=index, columns=list(stations))
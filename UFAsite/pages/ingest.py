@@ -0,0 +1,147 @@
+# pages/ingest.py
+
+import os
+import random
+import socket
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import IngestLock, LatestWaterLevel, WaterLevels
+from .risk_calculator import STATION_THRESHOLDS
+
+# --- Constants ---
+# ต้นทางอัพเดททุก 15 นาที (นาที 00, 15, 30, 45) และเราดึงตอนนาที 02, 17, 32, 47
+# รอบจึงเริ่มที่นาที 02 ของแต่ละช่วง: process ไหนเริ่มก่อนในช่วงเดียวกันก็ได้รอบนั้นไป
+CYCLE_MINUTES = 15
+CYCLE_OFFSET_MINUTES = 2
+SCRAPE_LOCK_NAME = 'scrape_data'
+
+# ความถี่ในการดึงข้อมูลตามสภาพน้ำ (นาที, ต้องเป็นจำนวนเท่าของ CYCLE_MINUTES)
+# ถี่สุดเท่ากับรอบอัพเดทของต้นทาง (15 นาที) ดึงถี่กว่านี้ก็ได้ค่าเดิม
+POLL_FLOOD_MINUTES = 15   # ใกล้ระดับเฝ้าระวัง หรือ TS2 (ต้นน้ำ) ขึ้นเร็ว
+POLL_WATCH_MINUTES = 30   # ปกติ
+POLL_IDLE_MINUTES = 60    # หน้าแล้ง: ทุกสถานีต่ำกว่าระดับเฝ้าระวังมาก
+
+NEAR_WARN_MARGIN = 1.0    # เมตร: ห่างจากระดับเฝ้าระวังไม่ถึงเท่านี้ = ดึงถี่สุด
+IDLE_WARN_MARGIN = 2.0    # เมตร: ทุกสถานีต่ำกว่าระดับเฝ้าระวังอย่างน้อยเท่านี้ = ดึงห่างสุด
+TS2_FAST_RISE = 0.2       # เมตร/ชม.: TS2 ขึ้นเร็วกว่านี้ = ดึงถี่สุด (เตือนก่อนถึงกฎ Flash Flood 0.5 ม./ชม.)
+TS2_IDLE_RISE = 0.05      # เมตร/ชม.: TS2 ขึ้นไม่เกินนี้ถึงจะถือว่าน้ำนิ่ง
+RISE_WINDOW = timedelta(hours=1)
+
+# สุ่มเลื่อนเวลาเริ่ม 0-JITTER_SECONDS วินาที (ไม่ให้ทุก process ยิงพร้อมกันเป๊ะ)
+# เลื่อนไปข้างหน้าเท่านั้น ถ้าเลื่อนถอยหลังจะตกไปอยู่รอบก่อนหน้า
+JITTER_SECONDS = 30
+
+
+def current_cycle(now=None):
+    """
+    จุดเริ่มของรอบที่เวลา now อยู่ (เวลาไทย ปัดลงตามช่วง 15 นาที เริ่มที่นาที 02)
+    เช่น 08:16 -> 08:02, 08:17 -> 08:17, 08:00 -> 07:47
+    """
+    now = timezone.localtime(now or timezone.now())
+    shifted = now - timedelta(minutes=CYCLE_OFFSET_MINUTES)
+    floored = shifted.replace(minute=shifted.minute - shifted.minute % CYCLE_MINUTES, second=0, microsecond=0)
+    return floored + timedelta(minutes=CYCLE_OFFSET_MINUTES)
+
+
+def worker_id():
+    """ชื่อ process ที่ถือล็อก (host:pid) ไว้ดูว่ารอบไหนใครเป็นคนดึง"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def claim_cycle(name=SCRAPE_LOCK_NAME, now=None):
+    """
+    จองรอบปัจจุบันของงาน name ให้ process นี้
+
+    Returns:
+        tuple: (ได้สิทธิ์หรือไม่, จุดเริ่มรอบ)
+    """
+    cycle_at = current_cycle(now)
+    return IngestLock.claim(name, cycle_at, worker_id()), cycle_at
+
+
+def ts2_rise_per_hour(now=None):
+    """
+    อัตราการขึ้นของระดับน้ำ TS2 (เมตร/ชม.) จากข้อมูลช่วง RISE_WINDOW ล่าสุด
+    คืน None ถ้าข้อมูลไม่พอ (น้อยกว่า 2 ค่า หรือห่างกันไม่ถึง 30 นาที)
+    """
+    now = now or timezone.now()
+    points = list(
+        WaterLevels.objects.filter(station_id='TS2', recorded_at__gte=now - RISE_WINDOW, recorded_at__lte=now)
+        .order_by('recorded_at')
+        .values_list('recorded_at', 'water_level')
+    )
+    if len(points) < 2:
+        return None
+
+    (first_at, first_level), (last_at, last_level) = points[0], points[-1]
+    hours = (last_at - first_at).total_seconds() / 3600
+    if hours < 0.5 or first_level is None or last_level is None:
+        return None
+    return (float(last_level) - float(first_level)) / hours
+
+
+def polling_interval(levels, ts2_rise):
+    """
+    เลือกความถี่ในการดึงข้อมูลจากสภาพน้ำ
+
+    Args:
+        levels (dict): station_id -> ระดับน้ำล่าสุด
+        ts2_rise (float | None): อัตราการขึ้นของ TS2 (เมตร/ชม.)
+
+    Returns:
+        tuple: (จำนวนนาที, เหตุผล)
+    """
+    if not levels:
+        return POLL_FLOOD_MINUTES, 'no recent data'
+
+    margins = {
+        station_id: STATION_THRESHOLDS[station_id]['warn'] - level
+        for station_id, level in levels.items() if station_id in STATION_THRESHOLDS
+    }
+    near = sorted(station_id for station_id, margin in margins.items() if margin < NEAR_WARN_MARGIN)
+    if near:
+        return POLL_FLOOD_MINUTES, f"near warning level: {', '.join(near)}"
+    if ts2_rise is not None and ts2_rise >= TS2_FAST_RISE:
+        return POLL_FLOOD_MINUTES, f'TS2 rising {ts2_rise:.2f} m/hr'
+
+    if all(margin >= IDLE_WARN_MARGIN for margin in margins.values()) and (ts2_rise is None or ts2_rise <= TS2_IDLE_RISE):
+        return POLL_IDLE_MINUTES, 'all stations far below warning level'
+    return POLL_WATCH_MINUTES, 'normal'
+
+
+def choose_polling_interval(now=None):
+    """ความถี่ในการดึงข้อมูลรอบถัดไป จาก snapshot ล่าสุด (1 query) และแนวโน้ม TS2 (1 query)"""
+    levels = {
+        station_id: float(level)
+        for station_id, level in LatestWaterLevel.objects.values_list('station_id', 'water_level')
+        if level is not None
+    }
+    return polling_interval(levels, ts2_rise_per_hour(now))
+
+
+def due_time(now=None, name=SCRAPE_LOCK_NAME):
+    """
+    เวลาที่ถึงกำหนดดึงข้อมูลครั้งถัดไป = รอบล่าสุดที่ถูกดึงไปแล้ว (ของทั้งระบบ) + ความถี่ตามสภาพน้ำ
+
+    Returns:
+        tuple: (datetime, จำนวนนาที, เหตุผล)
+    """
+    minutes, reason = choose_polling_interval(now)
+    last_cycle = IngestLock.objects.filter(name=name).values_list('cycle_at', flat=True).first()
+    due = current_cycle(now) if last_cycle is None else last_cycle + timedelta(minutes=minutes)
+    return due, minutes, reason
+
+
+def next_run_time(now=None, name=SCRAPE_LOCK_NAME):
+    """
+    เวลาที่ scheduler ควรรันครั้งถัดไป (due_time + jitter)
+    ถ้าเลยกำหนดมาแล้ว (process เพิ่งเริ่ม / พลาดหลายรอบ) ให้ดึงทันทีครั้งเดียว
+
+    Returns:
+        tuple: (datetime, จำนวนนาที, เหตุผล)
+    """
+    now = now or timezone.now()
+    due, minutes, reason = due_time(now, name)
+    return max(due, now) + timedelta(seconds=random.uniform(0, JITTER_SECONDS)), minutes, reason
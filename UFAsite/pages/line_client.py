@@ -0,0 +1,53 @@
+# pages/line_client.py
+
+import os
+import socket
+import threading
+
+from django.conf import settings
+from linebot.v3.messaging import ApiClient, Configuration, MessagingApi
+from urllib3.connection import HTTPConnection
+
+# --- Constants ---
+# จำนวน connection ที่เปิดค้างไว้กับ LINE API ต่อ process
+# ควร >= จำนวน thread ที่ส่งพร้อมกัน (webhook 4 + fan-out แจ้งเตือน 4) ถ้าเกินจะเปิด connection ชั่วคราวเพิ่มแล้วปิดทิ้ง
+CONNECTION_POOL_MAXSIZE = 10
+
+_state = {'client': None, 'pid': None}
+_lock = threading.Lock()
+
+
+def get_configuration():
+    configuration = Configuration(host=settings.LINE_API_HOST, access_token=settings.LINE_CHANNEL_ACCESS_TOKEN)
+    configuration.connection_pool_maxsize = CONNECTION_POOL_MAXSIZE
+    # TCP keep-alive: connection ที่ว่างอยู่ในช่วงไม่มีข้อความ ไม่ถูก NAT/firewall ตัดทิ้งเงียบ ๆ
+    configuration.socket_options = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    return configuration
+
+
+def get_api_client():
+    """
+    ApiClient ตัวเดียวต่อ process (ใช้ connection pool ร่วมกัน ไม่ต้อง handshake TLS ใหม่ทุกข้อความ)
+    pool ของ urllib3 ใช้พร้อมกันหลาย thread ได้ ถ้า process ถูก fork (gunicorn worker) จะสร้างใหม่ใน process ลูก
+    """
+    pid = os.getpid()
+    if _state['client'] is None or _state['pid'] != pid:
+        with _lock:
+            if _state['client'] is None or _state['pid'] != pid:
+                _state.update(client=ApiClient(get_configuration()), pid=pid)
+    return _state['client']
+
+
+def get_messaging_api():
+    """MessagingApi เป็นแค่ตัวห่อ client (สร้างใหม่ได้ทุกครั้งโดยไม่เปิด connection ใหม่)"""
+    return MessagingApi(get_api_client())
+
+
+def reset_client():
+    """ปิด client เดิม (ใช้ตอนเปลี่ยน settings เช่นในเทส)"""
+    with _lock:
+        client = _state['client']
+        if client is not None and _state['pid'] == os.getpid():
+            client.close()
+            client.rest_client.pool_manager.clear()
+        _state.update(client=None, pid=None)
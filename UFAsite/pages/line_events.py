@@ -0,0 +1,60 @@
+# pages/line_events.py
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+# --- Constants ---
+# จำนวน event ที่ประมวลผลพร้อมกัน (คำขอพยากรณ์ที่ช้า 1 รายการจะไม่ทำให้ event อื่นต้องรอ)
+WEBHOOK_WORKERS = 4
+# จำนวน event ที่รับไว้ได้สูงสุด (กำลังทำ + รอคิว) เกินนี้ webhook ตอบ 503 แทนการต่อคิวไปเรื่อย ๆ
+# คิวของ ThreadPoolExecutor ไม่มีขีดจำกัด ถ้า event เข้ามาเป็นชุดใหญ่หน่วยความจำจะโตไม่หยุด
+MAX_PENDING_EVENTS = 200
+
+_executor = None
+_lock = threading.Lock()
+_pending = {'count': 0}
+
+
+def _get_executor():
+    # สร้างตอนใช้ครั้งแรก (หลัง gunicorn fork worker แล้ว thread จึงอยู่ใน worker ที่ถูกต้อง)
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=WEBHOOK_WORKERS, thread_name_prefix='line-webhook')
+    return _executor
+
+
+def _run(func, args):
+    # thread ของ pool ไม่ได้ผ่าน request/response cycle ของ Django จึงต้องจัดการ connection เอง
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception as e:
+        print(f"❌ An error occurred while handling LINE events: {e}")
+    finally:
+        close_old_connections()
+        with _lock:
+            _pending['count'] -= 1
+
+
+def submit(func, *args):
+    """
+    ส่งงานไปทำใน thread pool แล้วคืนทันที (webhook ตอบ 200 ให้ LINE ได้เลย)
+
+    Returns:
+        Future: ใช้รอผลในเทส หรือ None ถ้างานค้างครบ MAX_PENDING_EVENTS แล้ว (ไม่รับงานนี้)
+    """
+    executor = _get_executor()
+    with _lock:
+        if _pending['count'] >= MAX_PENDING_EVENTS:
+            return None
+        _pending['count'] += 1
+    try:
+        return executor.submit(_run, func, args)
+    except Exception:
+        with _lock:
+            _pending['count'] -= 1
+        raise
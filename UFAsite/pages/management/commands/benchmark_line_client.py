@@ -0,0 +1,84 @@
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from linebot.v3.messaging import ApiClient, MessagingApi, ReplyMessageRequest, TextMessage
+
+from pages import line_client
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 เพื่อให้ client ใช้ connection เดิมต่อได้ (keep-alive) เหมือน api.line.me
+    protocol_version = 'HTTP/1.1'
+    # header กับ body เขียนแยกกัน ถ้าไม่ปิด Nagle จะติด delayed ACK ~40ms ทุก request บน connection เดิม
+    disable_nagle_algorithm = True
+    connect_delay = 0.0
+
+    def setup(self):
+        super().setup()
+        # จำลองค่าใช้จ่ายตอนเปิด connection ใหม่ (TCP + TLS handshake)
+        time.sleep(self.connect_delay)
+        self.server.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'{"sentMessages": [{"id": "1", "quoteToken": "benchmark"}]}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Compares reply latency of a new LINE ApiClient per message vs the shared per-process client, against a local stub API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Number of replies per mode')
+        parser.add_argument('--handshake_ms', type=float, default=30.0,
+                            help='Delay the stub adds to every new connection, standing in for the TLS handshake')
+
+    def handle(self, *args, **kwargs):
+        handler = type('StubHandler', (_StubHandler,), {'connect_delay': kwargs['handshake_ms'] / 1000})
+        server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        server.daemon_threads = True
+        server.connections = 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host = f'http://127.0.0.1:{server.server_address[1]}'
+
+        request = ReplyMessageRequest(reply_token='benchmark', messages=[TextMessage(text='สถานะน้ำ')])
+
+        def per_message():
+            # แบบเดิม: เปิด ApiClient ใหม่ทุกข้อความ (connection ใหม่ทุกครั้ง)
+            with ApiClient(line_client.get_configuration()) as api_client:
+                MessagingApi(api_client).reply_message(request)
+
+        def shared():
+            line_client.get_messaging_api().reply_message(request)
+
+        self.stdout.write(f"📡 Stub LINE API at {host} ({kwargs['handshake_ms']:g} ms per new connection)")
+        try:
+            with override_settings(LINE_API_HOST=host, LINE_CHANNEL_ACCESS_TOKEN='benchmark'):
+                line_client.reset_client()
+                for name, reply in [('new client per message', per_message), ('shared client', shared)]:
+                    server.connections = 0
+                    timings = []
+                    for _ in range(kwargs['requests']):
+                        t0 = time.perf_counter()
+                        reply()
+                        timings.append((time.perf_counter() - t0) * 1000)
+                    p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+                    self.stdout.write(
+                        f"{name:<24} median {statistics.median(timings):7.2f} ms | p95 {p95:7.2f} ms | "
+                        f"{server.connections} connections opened"
+                    )
+        finally:
+            line_client.reset_client()
+            server.shutdown()
+            server.server_close()
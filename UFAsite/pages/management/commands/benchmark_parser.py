@@ -0,0 +1,77 @@
+import json
+import time
+import tracemalloc
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from pages import thaiwater
+from pages.management.commands.scrape_data import STATION_CODE_MAPPING
+
+
+class Command(BaseCommand):
+    help = 'Compares peak memory and parse time of the full vs streaming parser on a recorded ThaiWater waterlevel payload'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payload', type=str, required=True, help='Path of a recorded public/waterlevel JSON payload')
+        parser.add_argument('--record', action='store_true', help='Download the current nationwide payload to --payload first')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs per parser')
+
+    def handle(self, *args, **kwargs):
+        path = kwargs['payload']
+
+        if kwargs['record']:
+            self.stdout.write("🔌 Downloading nationwide payload from ThaiWater API...")
+            try:
+                response = requests.get(f"{thaiwater.API_BASE_URL}/waterlevel", verify=False, timeout=thaiwater.REQUEST_TIMEOUT)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                raise CommandError(f'Could not download payload: {e}')
+            with open(path, 'wb') as f:
+                f.write(response.content)
+
+        try:
+            with open(path, 'rb') as f:
+                size = len(f.read())
+        except FileNotFoundError:
+            raise CommandError(f'Payload file not found: {path} (use --record to download one)')
+
+        codes = set(STATION_CODE_MAPPING)
+
+        def full_parse():
+            # เหมือนเดิม: อ่าน response ทั้งก้อน -> json -> กรองสถานี
+            with open(path, 'rb') as f:
+                data = json.loads(f.read())
+            return [item for item in thaiwater.extract_waterlevel_items(data) if thaiwater.station_code_of(item) in codes]
+
+        def stream_parse():
+            # อ่านทีละก้อนเหมือน response.iter_content()
+            with open(path, 'rb') as f:
+                chunks = iter(lambda: f.read(thaiwater.STREAM_CHUNK_SIZE), b'')
+                return list(thaiwater.iter_waterlevel_items(chunks, codes))
+
+        self.stdout.write(f"📄 Payload: {path} ({size / 1024 / 1024:.2f} MB)")
+
+        results = {}
+        for name, parse in [('full (response.json)', full_parse), ('streaming', stream_parse)]:
+            tracemalloc.start()
+            items = parse()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            timings = []
+            for _ in range(kwargs['repeat']):
+                t0 = time.perf_counter()
+                parse()
+                timings.append(time.perf_counter() - t0)
+
+            results[name] = items
+            self.stdout.write(
+                f"{name:<22} peak {peak / 1024 / 1024:8.2f} MB | best {min(timings) * 1000:8.1f} ms | {len(items)} stations matched"
+            )
+
+        full_items, stream_items = results.values()
+        if full_items == stream_items:
+            self.stdout.write(self.style.SUCCESS("✅ Both parsers returned identical station items."))
+        else:
+            self.stdout.write(self.style.ERROR("❌ Parsers returned different station items!"))
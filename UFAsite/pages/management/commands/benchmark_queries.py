@@ -0,0 +1,215 @@
+import os
+import random
+import re
+import statistics
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from pages import data_loader
+from pages.models import HourlyWaterLevel, LatestWaterLevel, WaterLevels, WaterStations
+
+# สถานีจำลองสำหรับ benchmark (แยกจากข้อมูลจริง และถูก rollback ทิ้งตอนจบ)
+BENCH_STATIONS = {
+    'BENCH_TS2': 115.0,
+    'BENCH_TS16': 108.0,
+    'BENCH_TS5': 106.0,
+}
+
+
+def is_production_database():
+    """
+    DB ที่ตั้งค่าไว้เป็นฐานข้อมูลจริงหรือไม่ (settings บน Render = TiDB ที่ใช้งานจริง)
+    การ insert ข้อมูลจำลองจำนวนมากใน transaction เดียวจะชนขนาด transaction ของ TiDB และล็อกตารางจริงไว้ตลอดการรัน
+    """
+    if 'RENDER' in os.environ:
+        return True
+    tidb_host = os.environ.get('TIDB_HOST')
+    return bool(tidb_host) and settings.DATABASES['default'].get('HOST') == tidb_host
+
+
+# รูปแบบใน EXPLAIN ที่แปลว่าอ่านทั้งตาราง (ไม่ใช้ index)
+FULL_SCAN_PATTERNS = [
+    re.compile(r'\bSCAN \w+\s*$', re.MULTILINE),  # SQLite: SCAN <table> ที่ไม่มี USING INDEX
+    re.compile(r'\bALL\b'),                        # MySQL: type = ALL
+    re.compile(r'TableFullScan'),                   # TiDB
+]
+# ชื่อ index ใน plan (SQLite: USING [COVERING] INDEX <name>, MySQL/TiDB: ชื่อ index ในคอลัมน์ key / operator info)
+INDEX_NAME_PATTERN = re.compile(r'\b(\w+_idx|uniq_\w+|sqlite_autoindex_\w+|PRIMARY)\b')
+
+
+def describe_index_usage(plan):
+    """สรุปจากผล EXPLAIN ว่าใช้ index ไหน หรืออ่านทั้งตาราง"""
+    if any(pattern.search(plan) for pattern in FULL_SCAN_PATTERNS):
+        return False, 'full table scan'
+    names = sorted(set(INDEX_NAME_PATTERN.findall(plan)))
+    return True, ', '.join(names) or 'index'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmarks the hot water_levels queries (query plan + latency) on a synthetic multi-year table, '
+        'plus the derived snapshot/hourly tables. Refuses to run against the production database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--years', type=int, default=3, help='Years of synthetic 15-minute data per station')
+        parser.add_argument('--repeat', type=int, default=50, help='Number of timed runs per query')
+        parser.add_argument('--batch_size', type=int, default=5000, help='bulk_create batch size for synthetic rows')
+
+    def handle(self, *args, **kwargs):
+        if is_production_database():
+            raise CommandError(
+                '❌ benchmark_queries inserts synthetic rows and must not run against the production database. '
+                'Run it with local settings (see README).'
+            )
+
+        years = kwargs['years']
+        repeat = kwargs['repeat']
+        batch_size = kwargs['batch_size']
+        if years < 1 or repeat < 1 or batch_size < 1:
+            raise CommandError('❌ --years, --repeat and --batch_size must be at least 1.')
+
+        # ทำทุกอย่างใน transaction แล้ว rollback ตอนจบ ข้อมูลจริงจะไม่ถูกแตะ
+        with transaction.atomic():
+            self._populate(years, batch_size)
+
+            station_ids = list(BENCH_STATIONS)
+            now = timezone.now()
+            window_start = now - timedelta(hours=12)
+
+            # --- water_levels (ตารางข้อมูลดิบ) ---
+            def latest_per_station():
+                # ค่าล่าสุดของแต่ละสถานี (ORDER BY recorded_at DESC LIMIT 1 ต่อสถานี)
+                return [
+                    WaterLevels.objects.filter(station_id=sid).order_by('-recorded_at').first()
+                    for sid in station_ids
+                ]
+
+            def recent_range():
+                # ช่วงเวลาล่าสุด 12 ชม. ของทั้ง 3 สถานี
+                return list(WaterLevels.objects.filter(
+                    station_id__in=station_ids,
+                    recorded_at__gte=window_start,
+                ).values_list('recorded_at', 'station_id', 'water_level'))
+
+            def history_scan():
+                # ประวัติทั้งหมดของ 1 สถานีเรียงตามเวลา (ข้อมูลหลายปี)
+                return list(WaterLevels.objects.filter(station_id=station_ids[1])
+                            .order_by('recorded_at').values_list('recorded_at', 'water_level'))
+
+            # --- ตารางที่โค้ดปัจจุบันอ่านจริง (สร้างจาก water_levels) ---
+            def latest_snapshot():
+                # home_page_view / status_cache: snapshot ค่าล่าสุด (รวมชื่อสถานี)
+                return list(LatestWaterLevel.objects.select_related('station').filter(station_id__in=station_ids))
+
+            def hourly_window():
+                # predictor._predict: ค่ารายชั่วโมงย้อนหลัง 12 ชม.
+                return list(HourlyWaterLevel.objects.filter(
+                    station_id__in=station_ids,
+                    hour__gte=HourlyWaterLevel.floor_hour(window_start),
+                ).values_list('hour', 'station_id', 'level_sum', 'reading_count'))
+
+            def hourly_history():
+                # train_model / simulation: ค่ารายชั่วโมงทั้งหมด อ่านทีละสถานีทีละหน้าลง NumPy
+                return data_loader.load_hourly_levels(station_ids)
+
+            benchmarks = [
+                ('water_levels: latest per station',
+                 WaterLevels.objects.filter(station_id=station_ids[0]).order_by('-recorded_at')[:1],
+                 latest_per_station),
+                ('water_levels: recent range (12h)',
+                 WaterLevels.objects.filter(station_id__in=station_ids, recorded_at__gte=window_start)
+                 .values_list('recorded_at', 'station_id', 'water_level'),
+                 recent_range),
+                ('water_levels: history scan (1 station)',
+                 WaterLevels.objects.filter(station_id=station_ids[1]).order_by('recorded_at')
+                 .values_list('recorded_at', 'water_level'),
+                 history_scan),
+                ('latest_water_levels: home_page_view / status_cache snapshot',
+                 LatestWaterLevel.objects.select_related('station').filter(station_id__in=station_ids),
+                 latest_snapshot),
+                ('hourly_water_levels: load_forecasts 12h window',
+                 HourlyWaterLevel.objects.filter(
+                     station_id__in=station_ids, hour__gte=HourlyWaterLevel.floor_hour(window_start),
+                 ).values_list('hour', 'station_id', 'level_sum', 'reading_count'),
+                 hourly_window),
+                ('hourly_water_levels: train_model full history (1 page)',
+                 HourlyWaterLevel.objects.filter(station_id=station_ids[0]).order_by('hour')
+                 .values_list('hour', 'station_id', 'level_sum', 'reading_count')[:data_loader.CHUNK_SIZE],
+                 hourly_history),
+            ]
+
+            for name, qs, runner in benchmarks:
+                self.stdout.write(self.style.MIGRATE_HEADING(f"\n📋 {name}"))
+                plan = qs.explain()
+                self.stdout.write(plan)
+                uses_index, summary = describe_index_usage(plan)
+                if uses_index:
+                    self.stdout.write(f"🔎 index: {summary}")
+                else:
+                    self.stdout.write(self.style.WARNING(f"⚠️ {summary}"))
+
+                timings = []
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    runner()
+                    timings.append((time.perf_counter() - t0) * 1000)
+
+                timings.sort()
+                p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                self.stdout.write(self.style.SUCCESS(
+                    f"⏱️ median {statistics.median(timings):.2f} ms | p95 {p95:.2f} ms | max {timings[-1]:.2f} ms ({repeat} runs)"
+                ))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(self.style.WARNING('🧹 Synthetic data rolled back.'))
+
+    def _populate(self, years, batch_size):
+        end = timezone.now().replace(second=0, microsecond=0)
+        start = end - timedelta(days=365 * years)
+        step = timedelta(minutes=15)
+
+        self.stdout.write(f"🔧 Generating {years} year(s) of 15-minute data for {len(BENCH_STATIONS)} stations...")
+        t0 = time.perf_counter()
+        total = 0
+
+        for station_id, base_level in BENCH_STATIONS.items():
+            station, _ = WaterStations.objects.get_or_create(
+                station_id=station_id,
+                defaults={'station_name': f'Benchmark {station_id}'}
+            )
+
+            batch = []
+            current = start
+            last = None
+            while current <= end:
+                last = WaterLevels(
+                    station=station,
+                    water_level=round(base_level + random.uniform(-1.5, 1.5), 2),
+                    risk_level=0,
+                    recorded_at=current,
+                    data_source='benchmark',
+                )
+                batch.append(last)
+                if len(batch) >= batch_size:
+                    WaterLevels.objects.bulk_create(batch)
+                    total += len(batch)
+                    batch = []
+                current += step
+
+            if batch:
+                WaterLevels.objects.bulk_create(batch)
+                total += len(batch)
+
+            # ตารางที่หน้าเว็บ/แชทบอท/การทำนายอ่านจริง (เหมือน scrape_data ทำหลัง insert)
+            if last is not None:
+                LatestWaterLevel.upsert(station, last.water_level, 0, last.recorded_at)
+
+        HourlyWaterLevel.refresh(list(BENCH_STATIONS), start, end, batch_size=batch_size)
+        self.stdout.write(f"✅ Inserted {total} rows in {time.perf_counter() - t0:.1f}s")
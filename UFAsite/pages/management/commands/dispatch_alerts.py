@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from pages import alert_queue
+from pages.models import AlertOutbox
+
+class Command(BaseCommand):
+    help = 'Sends queued LINE alerts (retries ones that hit rate limits or server errors)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wait', type=int, default=0, help='Seconds to keep waiting for scheduled retries before exiting')
+
+    def handle(self, *args, **kwargs):
+        totals = alert_queue.drain(max_wait=kwargs['wait'])
+        remaining = AlertOutbox.objects.filter(status=AlertOutbox.PENDING).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Alerts sent={totals[AlertOutbox.SENT]} failed={totals[AlertOutbox.FAILED]} "
+            f"(still queued for retry: {remaining})"
+        ))
@@ -1,90 +1,236 @@
-from django.core.management.base import BaseCommand
-import requests
-from pages.models import WaterStations, WaterLevels
-from django.utils.timezone import make_aware, get_current_timezone
-from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pages import thaiwater
+from pages.models import WaterStations, WaterLevels, LatestWaterLevel, HourlyWaterLevel
+from pages.risk_calculator import evaluate_flood_risk
+from django.db import transaction
+from django.utils import timezone
+from django.utils.timezone import get_current_timezone
+from datetime import datetime
 import json
+import os
+import time
+
+# จำนวนแถวต่อ 1 คำสั่ง INSERT ของ bulk_create
+BULK_BATCH_SIZE = 1000
+
+# ไฟล์เก็บความคืบหน้า (เดือนที่ import สำเร็จแล้ว) สำหรับรันต่อจากจุดที่ค้าง
+DEFAULT_PROGRESS_FILE = os.path.join(settings.BASE_DIR, 'import_progress.json')
 
 class Command(BaseCommand):
     help = 'Imports historical water level data from ThaiWater API'
 
     def add_arguments(self, parser):
-        parser.add_argument('--station_id', type=str, required=True, help='Internal Station ID (e.g., TS16)')
-        parser.add_argument('--api_id', type=str, required=True, help='ThaiWater API Station ID (e.g., 2752)')
+        parser.add_argument('--station_id', type=str, help='Internal Station ID (e.g., TS16)')
+        parser.add_argument('--api_id', type=str, help='ThaiWater API Station ID (e.g., 2752)')
+        parser.add_argument('--station', type=str, action='append', default=[], metavar='STATION_ID:API_ID',
+                            help='Station pair to import, repeatable (e.g., --station TS16:2752 --station TS2:2751)')
         parser.add_argument('--start', type=str, required=True, help='Start date (YYYY-MM-DD)')
         parser.add_argument('--end', type=str, required=True, help='End date (YYYY-MM-DD)')
+        parser.add_argument('--workers', type=int, default=4, help='Number of months fetched in parallel')
+        parser.add_argument('--base_url', type=str, default=thaiwater.API_BASE_URL, help='ThaiWater API base URL')
+        parser.add_argument('--progress_file', type=str, default=DEFAULT_PROGRESS_FILE, help='Where finished months are recorded')
+        parser.add_argument('--restart', action='store_true', help='Ignore saved progress and fetch every month again')
+
+    def parse_station_pairs(self, kwargs):
+        """รวมสถานีจาก --station_id/--api_id (แบบเดิม) และ --station (หลายสถานี) เป็น [(station_id, api_id), ...]"""
+        pairs = []
+        if kwargs['station_id'] or kwargs['api_id']:
+            if not (kwargs['station_id'] and kwargs['api_id']):
+                raise CommandError('--station_id and --api_id must be given together')
+            pairs.append((kwargs['station_id'], kwargs['api_id']))
+
+        for value in kwargs['station']:
+            station_id, sep, api_id = value.partition(':')
+            if not sep or not station_id or not api_id:
+                raise CommandError(f'Invalid --station value "{value}" (expected STATION_ID:API_ID)')
+            pairs.append((station_id, api_id))
+
+        if not pairs:
+            raise CommandError('Give at least one station (--station STATION_ID:API_ID or --station_id/--api_id)')
+
+        api_ids = [api_id for _, api_id in pairs]
+        if len(set(api_ids)) != len(api_ids):
+            raise CommandError('Each API station ID can only be imported once per run')
+        return pairs
 
     def handle(self, *args, **kwargs):
-        station_id = kwargs['station_id']
-        api_id = kwargs['api_id']
+        pairs = self.parse_station_pairs(kwargs)
         start_date_str = kwargs['start']
         end_date_str = kwargs['end']
-
-        # Ensure station exists
-        station, created = WaterStations.objects.get_or_create(
-            station_id=station_id,
-            defaults={'station_name': f'Imported Station {api_id}'}
-        )
-        if created:
-            self.stdout.write(self.style.WARNING(f'Created new station: {station_id}'))
+        workers = max(1, kwargs['workers'])
+        progress_file = kwargs['progress_file']
 
         # Prepare date chunks (Monthly)
         start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
         end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
-        
-        current_date = start_date
-        total_count = 0
+        chunks = thaiwater.month_chunks(start_date, end_date)
+
+        progress = {} if kwargs['restart'] else self.load_progress(progress_file)
+        stations = {}   # api_id -> WaterStations
+        done = {}       # api_id -> set ของเดือนที่ import แล้ว
+        totals = {}     # station_id -> [inserted, skipped]
+        jobs = []
+
+        for station_id, api_id in pairs:
+            # Ensure station exists
+            station, created = WaterStations.objects.get_or_create(
+                station_id=station_id,
+                defaults={'station_name': f'Imported Station {api_id}'}
+            )
+            if created:
+                self.stdout.write(self.style.WARNING(f'Created new station: {station_id}'))
+            stations[api_id] = station
+            totals[station_id] = [0, 0]
+
+            # ข้ามเดือนที่ import สำเร็จไปแล้วในรอบก่อน
+            done[api_id] = set(progress.get(f'{station_id}:{api_id}', []))
+            pending = [(s, e) for s, e in chunks if s.strftime('%Y-%m-%d') not in done[api_id]]
+            if len(pending) < len(chunks):
+                resume_from = pending[0][0].strftime('%Y-%m-%d') if pending else '-'
+                self.stdout.write(self.style.WARNING(
+                    f'⏩ {station_id}: {len(chunks) - len(pending)} month(s) already imported, starting at {resume_from}'
+                ))
+            jobs.extend((api_id, s, e) for s, e in pending)
+
+        # สลับเดือนของแต่ละสถานี (TS2 ม.ค., TS16 ม.ค., TS5 ม.ค., TS2 ก.พ., ...)
+        # ทุกสถานีจึงเดินหน้าไปพร้อมกัน เวลารวมขึ้นกับสถานีที่ช้าที่สุด ไม่ใช่ผลรวม
+        order = {api_id: i for i, (_, api_id) in enumerate(pairs)}
+        jobs.sort(key=lambda job: (job[1], order[job[0]]))
+
+        failed = []
         tz = get_current_timezone()
+        today = timezone.localdate()
+        started = time.perf_counter()
 
-        while current_date <= end_date:
-            # Calculate next month start
-            if current_date.month == 12:
-                next_month = current_date.replace(year=current_date.year + 1, month=1, day=1)
-            else:
-                next_month = current_date.replace(month=current_date.month + 1, day=1)
-            
-            # Determine chunk end date (either end of month or global end date)
-            chunk_end_date = next_month - timedelta(days=1)
-            if chunk_end_date > end_date:
-                chunk_end_date = end_date
-
-            s_str = current_date.strftime('%Y-%m-%d')
-            e_str = chunk_end_date.strftime('%Y-%m-%d')
-            
-            url = f"https://api-v3.thaiwater.net/api/v1/thaiwater30/public/waterlevel_graph?station_type=tele_waterlevel&station_id={api_id}&start_date={s_str}&end_date={e_str}%2023:59"
-            self.stdout.write(f"Fetching: {s_str} to {e_str}")
+        # ดึงทุกสถานีผ่าน session/thread pool เดียวกัน แต่เขียน DB ที่ thread หลักทีละก้อน
+        session = thaiwater.create_session(pool_size=workers)
+        for (api_id, chunk_start, chunk_end), data, error in thaiwater.fetch_chunks_concurrently(
+            session, jobs, workers=workers, base_url=kwargs['base_url']
+        ):
+            station = stations[api_id]
+            station_id = station.station_id
+            s_str = chunk_start.strftime('%Y-%m-%d')
+            e_str = chunk_end.strftime('%Y-%m-%d')
+
+            if error is not None:
+                failed.append(f'{station_id} {s_str}')
+                self.stdout.write(self.style.ERROR(f'Error fetching {station_id} {s_str}: {error}'))
+                continue
 
             try:
-                response = requests.get(url, verify=False)
-                response.raise_for_status()
-                data = response.json()
-
-                if 'data' in data and 'graph_data' in data['data']:
-                    graph_data = data['data']['graph_data']
-                    for item in graph_data:
-                        datetime_str = item['datetime']
-                        value = item['value']
-
-                        if value is None:
-                            continue
-
-                        try:
-                            dt_naive = datetime.strptime(datetime_str, '%Y-%m-%d %H:%M:%S')
-                        except ValueError:
-                            dt_naive = datetime.strptime(datetime_str, '%Y-%m-%d %H:%M')
-                        
-                        dt_aware = make_aware(dt_naive, timezone=tz)
-
-                        WaterLevels.objects.update_or_create(
-                            station=station,
-                            recorded_at=dt_aware,
-                            defaults={'water_level': value}
-                        )
-                        total_count += 1
+                points = self.parse_graph_data(data, tz)
+                inserted = self.write_batch(station, points)
             except Exception as e:
-                self.stdout.write(self.style.ERROR(f'Error fetching {s_str}: {e}'))
-            
-            # Move to next chunk
-            current_date = next_month
+                failed.append(f'{station_id} {s_str}')
+                self.stdout.write(self.style.ERROR(f'Error saving {station_id} {s_str}: {e}'))
+                continue
+
+            totals[station_id][0] += inserted
+            totals[station_id][1] += len(points) - inserted
+            self.stdout.write(
+                f"Imported {station_id} {s_str} to {e_str}: {inserted} new / {len(points) - inserted} already stored"
+            )
+
+            # เดือนที่ยังไม่จบ (ข้อมูลยังเพิ่มได้) ไม่บันทึกว่าเสร็จ
+            if chunk_end.date() < today:
+                done[api_id].add(s_str)
+                progress[f'{station_id}:{api_id}'] = sorted(done[api_id])
+                self.save_progress(progress_file, progress)
+
+        session.close()
+
+        elapsed = time.perf_counter() - started
+        total_count = sum(inserted for inserted, _ in totals.values())
+        rate = total_count / elapsed if elapsed > 0 else 0
+        for station_id, (inserted, skipped) in totals.items():
+            self.stdout.write(self.style.SUCCESS(
+                f'Successfully imported {inserted} records for {station_id} ({skipped} duplicates skipped)'
+            ))
+        self.stdout.write(self.style.SUCCESS(f'Total: {total_count} records in {elapsed:.1f}s ({rate:.0f} rows/s)'))
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f'⚠️ {len(failed)} chunk(s) failed: {", ".join(sorted(failed))} (run again to retry them)'
+            ))
+
+    def load_progress(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def save_progress(self, path, progress):
+        # เขียนไฟล์ชั่วคราวก่อน แล้วค่อยแทนที่ (ไฟล์ไม่เสียถ้าโดน kill กลางทาง)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(progress, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def parse_graph_data(self, data, tz):
+        """
+        แปลง response ของ waterlevel_graph เป็น dict {recorded_at: water_level}
+        (เวลาซ้ำในเดือนเดียวกันจะเหลือค่าสุดท้าย)
+        """
+        points = {}
+        if 'data' not in data or 'graph_data' not in data['data']:
+            return points
+
+        for item in data['data']['graph_data']:
+            value = item['value']
+            if value is None:
+                continue
+
+            recorded_at = thaiwater.parse_observation_time(item['datetime'], tz)
+            if recorded_at is None:
+                raise ValueError(f"Invalid datetime: {item['datetime']}")
+            points[recorded_at] = float(value)
+        return points
+
+    def write_batch(self, station, points):
+        """
+        บันทึกข้อมูล 1 ก้อน (1 เดือน) ด้วย bulk_create ใน transaction เดียว
+        ข้ามเวลาที่มีอยู่แล้วในฐานข้อมูล (เช็คด้วย query เดียว) รันซ้ำกี่รอบก็ได้ผลเหมือนเดิม
+
+        Returns:
+            int: จำนวนแถวที่เพิ่มใหม่
+        """
+        if not points:
+            return 0
+
+        times = sorted(points)
+
+        with transaction.atomic():
+            existing = set(
+                WaterLevels.objects.filter(
+                    station=station,
+                    recorded_at__gte=times[0],
+                    recorded_at__lte=times[-1],
+                ).values_list('recorded_at', flat=True)
+            )
+
+            new_rows = []
+            for recorded_at in times:
+                if recorded_at in existing:
+                    continue
+                level = points[recorded_at]
+                risk_level, _ = evaluate_flood_risk(level, station.station_id)
+                new_rows.append(WaterLevels(
+                    station=station,
+                    water_level=level,
+                    risk_level=risk_level,
+                    recorded_at=recorded_at,
+                ))
+
+            # ignore_conflicts กันกรณีมี process อื่นเขียนเวลาเดียวกันเข้ามาพร้อมกัน (unique station+recorded_at)
+            WaterLevels.objects.bulk_create(new_rows, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+            if new_rows:
+                HourlyWaterLevel.refresh([station.station_id], new_rows[0].recorded_at, new_rows[-1].recorded_at)
+
+            # snapshot ค่าล่าสุด (upsert จะไม่ทับถ้าข้อมูลที่ import เก่ากว่าค่าปัจจุบัน)
+            latest_at = times[-1]
+            latest_level = points[latest_at]
+            risk_level, _ = evaluate_flood_risk(latest_level, station.station_id)
+            LatestWaterLevel.upsert(station, latest_level, risk_level, latest_at)
 
-        self.stdout.write(self.style.SUCCESS(f'Successfully imported {total_count} records for {station_id}'))
+        return len(new_rows)
@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import get_current_timezone, make_aware
+from pages.models import HourlyWaterLevel
+
+class Command(BaseCommand):
+    help = 'Rebuilds the hourly_water_levels aggregate table from raw water_levels (all history, or a station/date range)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--station', type=str, action='append', default=[], help='Station ID to rebuild, repeatable (default: all)')
+        parser.add_argument('--start', type=str, help='Start date (YYYY-MM-DD)')
+        parser.add_argument('--end', type=str, help='End date (YYYY-MM-DD, inclusive)')
+
+    def handle(self, *args, **kwargs):
+        tz = get_current_timezone()
+        try:
+            start = make_aware(datetime.strptime(kwargs['start'], '%Y-%m-%d'), tz) if kwargs['start'] else None
+            end = make_aware(datetime.strptime(kwargs['end'], '%Y-%m-%d'), tz) + timedelta(days=1) if kwargs['end'] else None
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        self.stdout.write("🔄 Rebuilding hourly water levels from raw readings...")
+        count = HourlyWaterLevel.rebuild(station_ids=kwargs['station'] or None, start=start, end=end)
+        self.stdout.write(self.style.SUCCESS(f"✅ Rebuilt {count} station-hours."))
@@ -0,0 +1,80 @@
+from datetime import datetime, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.timezone import get_current_timezone, make_aware
+from pages.alert_policy import ALERT_COOLDOWN, HYSTERESIS_MARGIN, NORMAL, AlertPolicy
+from pages.models import WaterLevels
+
+class Command(BaseCommand):
+    help = 'Replays historical water levels through the alert state machine and compares how many alerts each policy would have sent'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--station', type=str, action='append', default=[], help='Station ID to replay, repeatable (default: all)')
+        parser.add_argument('--start', type=str, help='Start date (YYYY-MM-DD)')
+        parser.add_argument('--end', type=str, help='End date (YYYY-MM-DD, inclusive)')
+        parser.add_argument('--margin', type=float, default=HYSTERESIS_MARGIN, help='Hysteresis margin in metres')
+        parser.add_argument('--cooldown_hours', type=float, default=ALERT_COOLDOWN.total_seconds() / 3600,
+                            help='Hours before the same station may alert again')
+
+    def handle(self, *args, **kwargs):
+        policies = [
+            AlertPolicy('every critical reading (old)', every_reading=True),
+            AlertPolicy('transitions only', margin=0.0, cooldown=None),
+            AlertPolicy(f"hysteresis {kwargs['margin']:.2f}m + cooldown {kwargs['cooldown_hours']:g}h",
+                        margin=kwargs['margin'], cooldown=timedelta(hours=kwargs['cooldown_hours'])),
+        ]
+
+        qs = WaterLevels.objects.filter(water_level__isnull=False, recorded_at__isnull=False)
+        if kwargs['station']:
+            qs = qs.filter(station_id__in=kwargs['station'])
+        tz = get_current_timezone()
+        try:
+            if kwargs['start']:
+                qs = qs.filter(recorded_at__gte=make_aware(datetime.strptime(kwargs['start'], '%Y-%m-%d'), tz))
+            if kwargs['end']:
+                end = make_aware(datetime.strptime(kwargs['end'], '%Y-%m-%d'), tz) + timedelta(days=1)
+                qs = qs.filter(recorded_at__lt=end)
+        except ValueError as e:
+            raise CommandError(f'Invalid date: {e}')
+
+        # อ่านทีละก้อนเรียงตามสถานี/เวลา (ไม่โหลดข้อมูลทั้งตารางเข้าหน่วยความจำ)
+        rows = qs.order_by('station_id', 'recorded_at').values_list('station_id', 'water_level', 'recorded_at')
+
+        counts = {}   # station_id -> [จำนวนแจ้งเตือนของแต่ละ policy]
+        readings = {}
+        states = None
+        current_station = None
+        for station_id, level, recorded_at in rows.iterator(chunk_size=5000):
+            if station_id != current_station:
+                current_station = station_id
+                states = [(NORMAL, None, None) for _ in policies]
+                counts[station_id] = [0] * len(policies)
+                readings[station_id] = 0
+
+            readings[station_id] += 1
+            level = float(level)
+            for i, policy in enumerate(policies):
+                state, last_alert_at, entered_at = states[i]
+                new_state, should_alert = policy.step(
+                    state, last_alert_at, level, station_id, recorded_at, entered_at=entered_at
+                )
+                if new_state != state:
+                    entered_at = recorded_at
+                if should_alert:
+                    counts[station_id][i] += 1
+                    last_alert_at = recorded_at
+                states[i] = (new_state, last_alert_at, entered_at)
+
+        if not counts:
+            self.stdout.write(self.style.WARNING('No water level data found for the given filters.'))
+            return
+
+        self.stdout.write(f"{'Station':<10}{'Readings':>10}" + ''.join(f" | {p.name}" for p in policies))
+        for station_id, station_counts in counts.items():
+            self.stdout.write(
+                f"{station_id:<10}{readings[station_id]:>10}"
+                + ''.join(f" | {count:>{len(p.name)}}" for p, count in zip(policies, station_counts))
+            )
+        totals = [sum(c[i] for c in counts.values()) for i in range(len(policies))]
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Total':<10}{sum(readings.values()):>10}" + ''.join(f" | {t:>{len(p.name)}}" for p, t in zip(policies, totals))
+        ))
@@ -0,0 +1,19 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from pages import updater
+
+class Command(BaseCommand):
+    help = 'Runs the water data scheduler as a standalone ingest process (instead of inside the web workers)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', action='store_true', help='Scrape the current cycle once before waiting for the schedule')
+
+    def handle(self, *args, **kwargs):
+        if kwargs['now']:
+            call_command('scrape_data', once_per_cycle=True)
+
+        self.stdout.write(self.style.SUCCESS("🚀 Ingest process started (Ctrl+C to stop)"))
+        try:
+            updater.run_forever()
+        except (KeyboardInterrupt, SystemExit):
+            self.stdout.write("🛑 Ingest process stopped")
@@ -1,61 +1,99 @@
-import requests
-from bs4 import BeautifulSoup
-import urllib3
-
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 from django.core.management.base import BaseCommand
-from pages.models import WaterStations, WaterLevels
-from datetime import datetime
+from pages import alert_queue, ingest, status_cache, thaiwater
+from pages.models import WaterStations, WaterLevels, LatestWaterLevel, HourlyWaterLevel, ScraperState, StationAlertState
+from django.db import IntegrityError, transaction
 from pages.risk_calculator import evaluate_flood_risk
-from django.utils.timezone import make_aware
-from pages.utils import send_multicast_alert
-import re
+from pages.alert_policy import DEFAULT_POLICY
+from pages.predictor import refresh_forecasts
 from django.utils import timezone
 
+# Mapping: ThaiWater Station Code -> Internal Station ID
+# Using Station Code (M.7, M.5, ...) is more stable than numeric IDs which change often
+STATION_CODE_MAPPING = {
+    'M.7': 'TS16',
+    'M.5': 'TS2',
+    'M.11B': 'TS5',
+}
+
+# key ของ ScraperState ที่เก็บ ETag / Last-Modified ของ public/waterlevel
+SCRAPER_STATE_SOURCE = 'thaiwater:waterlevel'
+
+# จำนวนครั้งที่บันทึกรอบเดียวกันได้ ถ้าชน unique (station, recorded_at) กับ process อื่น (รอบใหม่จะเห็นแถวนั้นแล้วข้ามไป)
+SAVE_ATTEMPTS = 2
+
 class Command(BaseCommand):
     help = 'Fetches water level data from ThaiWater API and saves to database'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reset_counters()
+
+    def reset_counters(self):
+        # ตัวนับต่อรอบ: fetched = ค่าที่ได้จาก API, unchanged = เวลาที่วัดซ้ำกับที่มีอยู่, stored = บันทึกใหม่
+        self.counters = {'fetched': 0, 'unchanged': 0, 'stored': 0}
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full_parse', action='store_true',
+                            help='Load the whole nationwide payload with response.json() instead of streaming it')
+        parser.add_argument('--base_url', type=str, default=thaiwater.API_BASE_URL, help='ThaiWater API base URL')
+        parser.add_argument('--once_per_cycle', action='store_true',
+                            help='Skip the run if another process already scraped the current 15-minute cycle')
+        parser.add_argument('--adaptive', action='store_true',
+                            help='Skip the run if the river-state polling interval since the last scraped cycle has not passed yet '
+                                 '(implies --once_per_cycle, so the scraped cycle is recorded for the next check)')
+
     def handle(self, *args, **kwargs):
         self.stdout.write(timezone.now().strftime('%Y-%m-%d %H:%M:%S'))
-        
-        # Mapping: ThaiWater Station Code -> Internal Station ID
-        # Using Station Code (M.7, M.5, ...) is more stable than numeric IDs which change often
-        STATION_CODE_MAPPING = {
-            'M.7': 'TS16',
-            'M.5': 'TS2',
-            'M.11B': 'TS5',
-        }
-
-        api_url = "https://api-v3.thaiwater.net/api/v1/thaiwater30/public/waterlevel"
-        
+        self.reset_counters()
+
+        if kwargs.get('adaptive'):
+            # ใช้กับตัวตั้งเวลาที่รันทุก 15 นาทีตายตัว (GitHub Actions) ให้ความถี่จริงตามสภาพน้ำเหมือน run_ingest
+            due, minutes, reason = ingest.due_time()
+            if due > timezone.now():
+                self.stdout.write(f"💤 Not due until {timezone.localtime(due).strftime('%H:%M')} (every {minutes} min: {reason}), skipping.")
+                return
+
+        # --adaptive นับเวลาจากรอบล่าสุดใน IngestLock: ถ้าไม่จองรอบด้วย รอบที่ดึงไปจะไม่ถูกบันทึก
+        # (due_time ไม่ขยับ ทุกรอบจะถึงกำหนดเสมอ) จึงต้องจองรอบทุกครั้ง
+        if kwargs.get('once_per_cycle') or kwargs.get('adaptive'):
+            # หลาย process (web worker / run_ingest / GitHub Actions) อาจถูกตั้งเวลาไว้พร้อมกัน ให้รอบละครั้งเดียวทั้งระบบ
+            claimed, cycle_at = ingest.claim_cycle()
+            if not claimed:
+                self.stdout.write(f"⏭️ Cycle {timezone.localtime(cycle_at).strftime('%H:%M')} already scraped by another process, skipping.")
+                return
+
         try:
             self.stdout.write("🔌 Connecting to ThaiWater API...")
-            response = requests.get(api_url, verify=False, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            
-            # The API returns a list of stations in 'data' or directly as a list
-            stations_data = []
-            if 'data' in data:
-                if isinstance(data['data'], list):
-                    stations_data = data['data']
-                elif 'waterlevel_data' in data['data']:
-                    stations_data = data['data']['waterlevel_data']
-            elif isinstance(data, list):
-                stations_data = data
-
-            found_count = 0
-            
+
+            # ส่ง ETag / Last-Modified ของรอบก่อนไปด้วย ถ้ายังไม่มีข้อมูลใหม่ server จะตอบ 304 (ไม่ต้องโหลด payload)
+            state, _ = ScraperState.objects.get_or_create(source=SCRAPER_STATE_SOURCE)
+
+            # payload เป็นข้อมูลทุกสถานีทั่วประเทศ: อ่านแบบ stream แล้วเก็บไว้เฉพาะสถานีที่สนใจ
+            stations_data, etag, last_modified = thaiwater.fetch_waterlevel_items(
+                set(STATION_CODE_MAPPING),
+                base_url=kwargs.get('base_url') or thaiwater.API_BASE_URL,
+                stream=not kwargs.get('full_parse', False),
+                etag=state.etag,
+                last_modified=state.last_modified,
+            )
+
+            if stations_data is None:
+                self.counters['unchanged'] = len(STATION_CODE_MAPPING)
+                self.stdout.write("💤 ThaiWater data not modified since last cycle (304).")
+                self.report_counters()
+                return
+
+            # 1. Parse: เก็บค่าของสถานีที่สนใจทั้งหมดก่อน
+            readings = []
+
             for item in stations_data:
                 # Extract station info
                 # Code location: item['station']['tele_station_oldcode']
-                station_info = item.get('station', {})
-                station_code = station_info.get('tele_station_oldcode', '')
+                station_code = thaiwater.station_code_of(item)
                 
                 # If code matches our target list
                 if station_code in STATION_CODE_MAPPING:
                     internal_station_id = STATION_CODE_MAPPING[station_code]
-                    current_api_id = str(item.get('id', '')) # For logging
                     
                     water_level_msl = item.get('waterlevel_msl')
                     
@@ -69,41 +107,164 @@ class Command(BaseCommand):
                         self.stdout.write(self.style.ERROR(f"❌ Invalid float value for {internal_station_id}: {water_level_msl}"))
                         continue
 
-                    self.save_data(internal_station_id, level)
-                    found_count += 1
-            
-            if found_count > 0:
-                 self.stdout.write(self.style.SUCCESS(f"✅ Successfully updated {found_count} stations."))
-            else:
-                 self.stdout.write(self.style.WARNING("⚠️ No target stations found in API response."))
+                    # ใช้เวลาที่สถานีวัดจริง (ไม่ใช่เวลาที่ดึงข้อมูล) รอบที่ยังไม่มีค่าใหม่จะได้เวลาเดิม -> ไม่บันทึกซ้ำ
+                    observed_at = thaiwater.parse_observation_time(item.get('waterlevel_datetime'))
+                    if observed_at is None:
+                        self.stdout.write(self.style.WARNING(
+                            f"⚠️ No observation time for {internal_station_id}, using current time"
+                        ))
+                        observed_at = timezone.now()
+
+                    readings.append((internal_station_id, level, observed_at))
+
+            self.counters['fetched'] = len(readings)
+            if not readings:
+                self.stdout.write(self.style.WARNING("⚠️ No target stations found in API response."))
+                return
+
+            # 2. Store: บันทึกทุกสถานีในรอบเดียว (ETag ใหม่บันทึกพร้อมข้อมูล ถ้าบันทึกไม่สำเร็จรอบหน้าจะดึงใหม่ทั้งหมด)
+            state.etag = etag
+            state.last_modified = last_modified
+            alerts = self.save_data(readings, state=state)
+            self.report_counters()
+
+            # 3. Dispatch: ส่งแจ้งเตือนหลังบันทึกเสร็จแล้วเท่านั้น
+            self.dispatch_alerts(alerts)
 
         except Exception as e:
             self.stdout.write(self.style.ERROR(f'❌ API Error: {e}'))
 
-    def save_data(self, station_id, level):
+    def save_data(self, readings, state=None):
+        """
+        บันทึกค่าระดับน้ำของทุกสถานีในรอบนี้ด้วยจำนวน query คงที่
+        (ล็อกสถานี + สถานะแจ้งเตือน, เช็คเวลาที่มีอยู่แล้ว แล้ว bulk insert / snapshot / สถานะ ใน transaction เดียว)
+        ค่าที่ (สถานี, เวลาที่วัด) มีอยู่แล้วจะถูกข้าม ไม่บันทึกซ้ำและไม่แจ้งเตือนซ้ำ
+        แจ้งเตือนตาม alert_policy: เฉพาะตอนเข้าสู่วิกฤต (มี hysteresis และ cooldown)
+
+        Args:
+            readings: list ของ (station_id, level, observed_at)
+            state: ScraperState ที่จะบันทึกใน transaction เดียวกับข้อมูล (ถ้ามี)
+
+        Returns:
+            list: ข้อความแจ้งเตือนที่เข้าคิวไว้แล้ว (สถานีที่อยู่ในระดับวิกฤต)
+        """
+        for attempt in range(1, SAVE_ATTEMPTS + 1):
+            try:
+                with transaction.atomic():
+                    plan = self._plan_rows(readings)
+                    rows = plan['rows']
+                    if rows:
+                        # ไม่ใช้ ignore_conflicts: ถ้ามีแถวชน ทั้งรอบจะ rollback แล้ววางแผนใหม่
+                        # snapshot / สถานะแจ้งเตือน / คิวแจ้งเตือน / ตัวนับ จึงมาจากแถวที่ insert ได้จริงเท่านั้น
+                        WaterLevels.objects.bulk_create(rows)
+                        LatestWaterLevel.upsert_many(plan['snapshots'])
+                        times = [row.recorded_at for row in rows]
+                        HourlyWaterLevel.refresh({row.station_id for row in rows}, min(times), max(times))
+                        StationAlertState.save_many(plan['changed_states'])
+                    if plan['alerts']:
+                        alert_queue.enqueue_alerts(plan['alerts'])
+                    if state is not None:
+                        state.save()
+                break
+            except IntegrityError as e:
+                if attempt == SAVE_ATTEMPTS:
+                    self.stdout.write(self.style.ERROR(f'Error saving data: {e}'))
+                    return []
+                self.stdout.write(self.style.WARNING('⚠️ Another process saved the same observation, re-checking...'))
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Error saving data: {e}'))
+                return []
+
+        for message in plan['messages']:
+            self.stdout.write(message)
+        self.counters['unchanged'] += plan['unchanged']
+
+        if not rows:
+            return []
+        self.counters['stored'] += len(rows)
+
+        # มีข้อมูลใหม่ -> ทำนายใหม่ไว้ให้หน้าเว็บ (ForecastSnapshot) และสร้างข้อความสถานะของแชทบอทไว้ล่วงหน้า
         try:
-            station = WaterStations.objects.get(station_id=station_id)
-            
+            refresh_forecasts()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'❌ Forecast refresh failed: {e}'))
+        status_cache.refresh()
+
+        for row in rows:
+            self.stdout.write(self.style.SUCCESS(f'Saved: {row.water_level}m for {row.station.station_name}'))
+        self.stdout.write(self.style.SUCCESS(f"✅ Successfully updated {len(rows)} stations."))
+        return plan['alerts']
+
+    def _plan_rows(self, readings):
+        """
+        เลือกค่าที่ต้องบันทึก + คำนวณสถานะแจ้งเตือน (เรียกใน transaction ของ save_data)
+        ล็อกแถวสถานีและสถานะแจ้งเตือนไว้ (select_for_update) process อื่นที่บันทึกสถานีเดียวกันจะรอจนรอบนี้ commit
+        การเช็คแถวที่มีอยู่แล้วเป็น locking read จึงเห็นข้อมูลที่ commit ล่าสุดเสมอ
+        """
+        stations = WaterStations.objects.select_for_update().in_bulk([station_id for station_id, _, _ in readings])
+        alert_states = StationAlertState.objects.select_for_update().in_bulk(stations.keys())
+        existing = set(
+            WaterLevels.objects.select_for_update().filter(
+                station_id__in=stations.keys(),
+                recorded_at__in={observed_at for _, _, observed_at in readings},
+            ).values_list('station_id', 'recorded_at')
+        )
+
+        plan = {'rows': [], 'snapshots': [], 'changed_states': [], 'alerts': [], 'messages': [], 'unchanged': 0}
+        changed_states = {}
+        for station_id, level, recorded_at in sorted(readings, key=lambda r: r[2]):
+            station = stations.get(station_id)
+            if station is None:
+                plan['messages'].append(self.style.ERROR(f'Station ID {station_id} not found in database'))
+                continue
+
+            if (station_id, recorded_at) in existing:
+                plan['unchanged'] += 1
+                plan['messages'].append(
+                    f"⏸️ {station_id}: no new observation since {timezone.localtime(recorded_at).strftime('%H:%M')}"
+                )
+                continue
+
             # Risk Calculation
             risk_level, risk_text = evaluate_flood_risk(level, station_id)
-            self.stdout.write(f"Analyzed Risk for {station_id}: {risk_text} (Level: {level}m)")
+            plan['messages'].append(f"Analyzed Risk for {station_id}: {risk_text} (Level: {level}m)")
 
-            # Save to DB
-            WaterLevels.objects.create(
+            plan['rows'].append(WaterLevels(
                 station=station,
                 water_level=level,
                 risk_level=risk_level,
-                recorded_at=timezone.now(),
+                recorded_at=recorded_at,
                 data_source='ThaiWater API'
+            ))
+            plan['snapshots'].append((station, level, risk_level, recorded_at))
+
+            # LINE Alert เฉพาะตอนเข้าสู่วิกฤต (ค่าวิกฤตต่อเนื่องไม่แจ้งซ้ำ) เข้าคิวพร้อมข้อมูล แล้วส่งทีหลัง
+            alert_state = alert_states.setdefault(station_id, StationAlertState(station=station))
+            new_state, should_alert = DEFAULT_POLICY.step(
+                alert_state.state, alert_state.last_alert_at, level, station_id, recorded_at,
+                entered_at=alert_state.changed_at,
             )
-            self.stdout.write(self.style.SUCCESS(f'Saved: {level}m ({risk_text}) for {station.station_name}'))
-            
-            # Send LINE Alert if Critical
-            if risk_level == 2:
-                msg = f"🚨 แจ้งเตือนน้ำท่วม!\n📍 สถานี: {station.station_name}\n🌊 ระดับน้ำ: {level} ม.รทก.\n🔥 สถานะ: {risk_text}\n🕒 เวลา: {timezone.now().strftime('%H:%M น.')}"
-                send_multicast_alert(msg)
-
-        except WaterStations.DoesNotExist:
-            self.stdout.write(self.style.ERROR(f'Station ID {station_id} not found in database'))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Error saving data for {station_id}: {e}'))
\ No newline at end of file
+            if new_state != alert_state.state:
+                alert_state.changed_at = recorded_at
+            alert_state.state = new_state
+            alert_state.last_level = level
+            changed_states[station_id] = alert_state
+
+            if should_alert:
+                alert_state.last_alert_at = recorded_at
+                plan['alerts'].append(
+                    f"🚨 แจ้งเตือนน้ำท่วม!\n📍 สถานี: {station.station_name}\n🌊 ระดับน้ำ: {level} ม.รทก.\n🔥 สถานะ: {risk_text}\n🕒 เวลา: {timezone.localtime(recorded_at).strftime('%H:%M น.')}"
+                )
+
+        plan['changed_states'] = list(changed_states.values())
+        return plan
+
+    def report_counters(self):
+        c = self.counters
+        self.stdout.write(f"📊 Cycle summary: fetched={c['fetched']} unchanged={c['unchanged']} stored={c['stored']}")
+
+    def dispatch_alerts(self, alerts):
+        """เริ่มส่งคิวแจ้งเตือน LINE ใน thread แยก (ไม่รอให้ส่งเสร็จ ส่งไม่สำเร็จจะถูกลองใหม่จากคิว)"""
+        if alerts:
+            alert_queue.dispatch_in_background()
+            self.stdout.write(f"📨 Queued {len(alerts)} alert(s) for LINE dispatch")
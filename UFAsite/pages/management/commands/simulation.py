@@ -1,4 +1,3 @@
-import pandas as pd
 import numpy as np
 import sys
 import os
@@ -7,7 +6,7 @@ from sklearn.model_selection import train_test_split, KFold
 from sklearn.linear_model import LinearRegression
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 import matplotlib.pyplot as plt
-from pages.models import WaterLevels
+from pages.data_loader import load_hourly_frame
 
 # Import risk calculator
 try:
@@ -26,17 +25,14 @@ class Command(BaseCommand):
         # 1. ดึงข้อมูลจริง (Real Data Fetching)
         # ==========================================
         print("🔄 กำลังดึงข้อมูลจาก Database...")
-        qs = WaterLevels.objects.all().values('recorded_at', 'station__station_id', 'water_level')
-        df_raw = pd.DataFrame(qs)
+        # อ่านตารางรายชั่วโมง (hourly_water_levels) ทีละก้อน ไม่ต้อง pivot ข้อมูลดิบทั้งตาราง
+        df = load_hourly_frame(['TS2', 'TS16', 'TS5'])
 
-        if df_raw.empty:
+        if df.empty:
             self.stdout.write(self.style.ERROR("❌ ไม่พบข้อมูลในฐานข้อมูล กรุณารันคำสั่ง scrape_data ก่อน"))
             return
 
-        # Clean & Pivot Data
-        df_raw['water_level'] = pd.to_numeric(df_raw['water_level'], errors='coerce')
-        df = df_raw.pivot_table(index='recorded_at', columns='station__station_id', values='water_level')
-        df = df.resample('h').mean().interpolate(method='linear')
+        df = df.interpolate(method='linear')
         df.dropna(inplace=True)
         print(f"✅ เตรียมข้อมูลพื้นฐานเสร็จสิ้น: {len(df)} แถว")
 
@@ -90,30 +86,32 @@ class Command(BaseCommand):
         best_score = -999
         best_horizon = 6
 
-        for h in horizons:
-            df_temp = df_features.copy()
-            df_temp['Target'] = df_temp['TS16'].shift(-h)
-            df_temp.dropna(inplace=True)
-            
-            if len(df_temp) < 50:
-                continue
+        # target ทุกระยะเป็นคอลัมน์ของ matrix เดียว -> fit ครั้งเดียวได้ทุกระยะ (ไม่ต้อง fit ใหม่ทีละระยะ)
+        df_temp = df_features.copy()
+        target_cols = [f'Target_{h}h' for h in horizons]
+        for h, col in zip(horizons, target_cols):
+            df_temp[col] = df_temp['TS16'].shift(-h)
+        df_temp.dropna(inplace=True)
 
+        if len(df_temp) >= 50:
             X_exp = df_temp[feature_cols]
-            y_exp = df_temp['Target']
-            
-            X_tr, X_te, y_tr, y_te = train_test_split(X_exp, y_exp, test_size=0.2, shuffle=False)
-            
+            Y_exp = df_temp[target_cols]
+
+            X_tr, X_te, Y_tr, Y_te = train_test_split(X_exp, Y_exp, test_size=0.2, shuffle=False)
+
             model_exp = LinearRegression()
-            model_exp.fit(X_tr, y_tr)
-            
-            score = model_exp.score(X_te, y_te)
-            mae = mean_absolute_error(y_te, model_exp.predict(X_te))
-            
-            print(f"   ⏳ พยากรณ์ล่วงหน้า {h:02d} ชม. -> R² = {score:.4f} | MAE = {mae:.4f} ม.")
+            model_exp.fit(X_tr, Y_tr)
+
+            Y_pred = model_exp.predict(X_te)
+            scores = r2_score(Y_te, Y_pred, multioutput='raw_values')
+            maes = mean_absolute_error(Y_te, Y_pred, multioutput='raw_values')
+
+            for h, score, mae in zip(horizons, scores, maes):
+                print(f"   ⏳ พยากรณ์ล่วงหน้า {h:02d} ชม. -> R² = {score:.4f} | MAE = {mae:.4f} ม.")
 
-            if score > best_score:
-                best_score = score
-                best_horizon = h
+                if score > best_score:
+                    best_score = score
+                    best_horizon = h
 
         best_horizon = 6 
         print(f"\n✅ เลือกใช้ระยะเวลาพยากรณ์: {best_horizon} ชั่วโมง")
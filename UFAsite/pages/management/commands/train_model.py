@@ -1,17 +1,61 @@
 from django.core.management.base import BaseCommand
-from pages.predictor import train_and_save_model
+from pages import model_registry
+from pages.predictor import refresh_forecasts, train_and_save_model, train_incremental
 
 class Command(BaseCommand):
     help = 'Fetches all historical data, trains a new prediction model, and saves it.'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--list', action='store_true', help='List saved model versions with their metadata')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Fold only new hourly rows into the saved least-squares state instead of refitting on all history')
+        parser.add_argument('--rollback', type=str, metavar='VERSION', help='Activate an existing model version instead of training')
+
     def handle(self, *args, **kwargs):
+        if kwargs['list']:
+            self.list_versions()
+            return
+
+        if kwargs['rollback']:
+            try:
+                model_registry.activate(kwargs['rollback'])
+                self.stdout.write(self.style.SUCCESS(f"Activated model version {kwargs['rollback']}"))
+                self.refresh_forecasts()
+            except FileNotFoundError as e:
+                self.stderr.write(self.style.ERROR(str(e)))
+            return
+
         self.stdout.write(self.style.SUCCESS('Starting model training...'))
-        
+
         try:
-            model_path = train_and_save_model()
-            if model_path:
-                self.stdout.write(self.style.SUCCESS(f'Successfully trained and saved model to {model_path}'))
+            version = train_incremental() if kwargs['incremental'] else train_and_save_model()
+            if version:
+                self.stdout.write(self.style.SUCCESS(f'Successfully trained and saved model version {version}'))
+                self.refresh_forecasts()
+            elif kwargs['incremental']:
+                self.stdout.write(self.style.WARNING('No new hourly data to train on. The active model is unchanged.'))
             else:
                 self.stdout.write(self.style.WARNING('Model training did not complete. See console for details.'))
         except Exception as e:
             self.stderr.write(self.style.ERROR(f'An error occurred during model training: {e}'))
+
+    def refresh_forecasts(self):
+        # โมเดลเปลี่ยน -> ทำนายใหม่ไว้ให้หน้าเว็บทันที ไม่ต้องรอข้อมูลรอบถัดไป
+        try:
+            refresh_forecasts()
+        except Exception as e:
+            self.stderr.write(self.style.ERROR(f'Forecast refresh failed: {e}'))
+
+    def list_versions(self):
+        versions = model_registry.list_versions()
+        if not versions:
+            self.stdout.write(self.style.WARNING('No model versions found.'))
+            return
+
+        for meta in versions:
+            marker = '*' if meta['active'] else ' '
+            mae = f"{meta['mae']:.4f}" if meta.get('mae') is not None else '-'
+            self.stdout.write(
+                f"{marker} {meta['version']} | {meta.get('train_start')} -> {meta.get('train_end')} "
+                f"| rows={meta.get('row_count')} | {meta.get('training', 'full')} | MAE={mae}"
+            )
@@ -0,0 +1,46 @@
+from django.db import migrations, models
+from django.db.models import Count, Max
+
+
+def remove_duplicate_readings(apps, schema_editor):
+    """
+    ลบข้อมูลซ้ำ (station, recorded_at) ก่อนสร้าง Unique Constraint
+    เก็บแถวล่าสุด (water_level_id มากที่สุด) ไว้ เหมือนผลของ update_or_create
+    """
+    WaterLevels = apps.get_model('pages', 'WaterLevels')
+
+    duplicates = (
+        WaterLevels.objects.filter(recorded_at__isnull=False)
+        .values('station_id', 'recorded_at')
+        .annotate(n=Count('water_level_id'), keep_id=Max('water_level_id'))
+        .filter(n__gt=1)
+    )
+    for dup in duplicates.iterator():
+        WaterLevels.objects.filter(
+            station_id=dup['station_id'],
+            recorded_at=dup['recorded_at'],
+        ).exclude(water_level_id=dup['keep_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0002_fix_water_level_id'),
+    ]
+
+    operations = [
+        # 1. เคลียร์ข้อมูลซ้ำจากการ backfill ก่อน (ไม่งั้นสร้าง unique ไม่ได้)
+        migrations.RunPython(remove_duplicate_readings, migrations.RunPython.noop),
+
+        # 2. Index หลักสำหรับ query ค่าล่าสุด / ช่วงเวลา ของแต่ละสถานี
+        migrations.AddIndex(
+            model_name='waterlevels',
+            index=models.Index(fields=['station', '-recorded_at', 'water_level', 'risk_level'], name='wl_station_recorded_idx'),
+        ),
+
+        # 3. 1 สถานี มีได้ 1 ค่าต่อเวลา
+        migrations.AddConstraint(
+            model_name='waterlevels',
+            constraint=models.UniqueConstraint(fields=('station', 'recorded_at'), name='uniq_station_recorded_at'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def fill_latest_water_levels(apps, schema_editor):
+    """เติม snapshot ค่าล่าสุดจากข้อมูลที่มีอยู่แล้วใน water_levels"""
+    WaterStations = apps.get_model('pages', 'WaterStations')
+    WaterLevels = apps.get_model('pages', 'WaterLevels')
+    LatestWaterLevel = apps.get_model('pages', 'LatestWaterLevel')
+
+    for station_id in WaterStations.objects.values_list('station_id', flat=True):
+        latest = WaterLevels.objects.filter(
+            station_id=station_id, recorded_at__isnull=False
+        ).order_by('-recorded_at').first()
+        if latest is None:
+            continue
+
+        LatestWaterLevel.objects.update_or_create(
+            station_id=station_id,
+            defaults={
+                'water_level': latest.water_level,
+                'risk_level': latest.risk_level,
+                'recorded_at': latest.recorded_at,
+            }
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0003_water_levels_station_recorded_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LatestWaterLevel',
+            fields=[
+                ('station', models.OneToOneField(db_column='station_id', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, serialize=False, to='pages.waterstations')),
+                ('water_level', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('risk_level', models.IntegerField(blank=True, default=0, null=True)),
+                ('recorded_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+            ],
+            options={
+                'db_table': 'latest_water_levels',
+            },
+        ),
+        migrations.RunPython(fill_latest_water_levels, migrations.RunPython.noop),
+    ]
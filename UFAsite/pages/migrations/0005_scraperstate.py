@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0004_latestwaterlevel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScraperState',
+            fields=[
+                ('source', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('etag', models.CharField(blank=True, max_length=255, null=True)),
+                ('last_modified', models.CharField(blank=True, max_length=255, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+            ],
+            options={
+                'db_table': 'scraper_state',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0005_scraperstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestLock',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('cycle_at', models.DateTimeField(blank=True, null=True)),
+                ('owner', models.CharField(blank=True, max_length=255, null=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'ingest_locks',
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:57
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0006_ingestlock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.TextField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('retry_key', models.UUIDField(default=uuid.uuid4)),
+                ('recipient_count', models.IntegerField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('locked_at', models.DateTimeField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'alert_outbox',
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='alert_outbox_due_idx')],
+            },
+        ),
+    ]
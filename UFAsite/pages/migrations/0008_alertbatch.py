@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-17 20:58
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0007_alertoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_index', models.IntegerField()),
+                ('first_user_id', models.IntegerField()),
+                ('last_user_id', models.IntegerField()),
+                ('recipient_count', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.IntegerField(default=0)),
+                ('http_status', models.IntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('duration_ms', models.IntegerField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('alert', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='pages.alertoutbox')),
+            ],
+            options={
+                'db_table': 'alert_batches',
+                'constraints': [models.UniqueConstraint(fields=('alert', 'batch_index'), name='uniq_alert_batch_index')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-17 21:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0008_alertbatch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StationAlertState',
+            fields=[
+                ('station', models.OneToOneField(db_column='station_id', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, serialize=False, to='pages.waterstations')),
+                ('state', models.IntegerField(default=0)),
+                ('changed_at', models.DateTimeField(blank=True, null=True)),
+                ('last_alert_at', models.DateTimeField(blank=True, null=True)),
+                ('last_level', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+            ],
+            options={
+                'db_table': 'station_alert_states',
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.6 on 2026-10-17 21:15
+
+from datetime import timedelta, timezone
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncHour
+
+# ชั่วโมงต่อ query (ได้ไม่เกินเท่านี้กลุ่มต่อ query)
+BATCH_HOURS = 5000
+
+
+def fill_hourly_water_levels(apps, schema_editor):
+    """
+    สร้างค่ารายชั่วโมงจากข้อมูลที่มีอยู่แล้วใน water_levels (GROUP BY ใน DB ทีละสถานี ทีละ 5000 ชั่วโมง)
+    แต่ละ query เป็นช่วงบน index (station, recorded_at) ไม่ใช้ .iterator() เพราะ PyMySQL ดึงผลทั้งหมดมาเก็บฝั่ง client อยู่ดี
+    """
+    WaterLevels = apps.get_model('pages', 'WaterLevels')
+    HourlyWaterLevel = apps.get_model('pages', 'HourlyWaterLevel')
+
+    readings = WaterLevels.objects.filter(water_level__isnull=False, recorded_at__isnull=False)
+    bounds = list(
+        readings.order_by().values('station_id').annotate(first=Min('recorded_at'), last=Max('recorded_at'))
+    )
+    window = timedelta(hours=BATCH_HOURS)
+    for b in bounds:
+        t = b['first'].astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+        while t <= b['last']:
+            groups = (
+                readings.filter(station_id=b['station_id'], recorded_at__gte=t, recorded_at__lt=t + window)
+                .annotate(hour=TruncHour('recorded_at', tzinfo=timezone.utc))
+                .values('station_id', 'hour')
+                .annotate(level_sum=Sum('water_level'), reading_count=Count('water_level_id'))
+                .order_by()
+            )
+            HourlyWaterLevel.objects.bulk_create([HourlyWaterLevel(**g) for g in groups])
+            t += window
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0009_stationalertstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HourlyWaterLevel',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('level_sum', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('reading_count', models.IntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True, null=True)),
+                ('station', models.ForeignKey(db_column='station_id', on_delete=django.db.models.deletion.DO_NOTHING, to='pages.waterstations')),
+            ],
+            options={
+                'db_table': 'hourly_water_levels',
+                'indexes': [models.Index(fields=['hour', 'station'], name='hwl_hour_station_idx')],
+                'constraints': [models.UniqueConstraint(fields=('station', 'hour'), name='uniq_station_hour')],
+            },
+        ),
+        migrations.RunPython(fill_hourly_water_levels, migrations.RunPython.noop),
+    ]
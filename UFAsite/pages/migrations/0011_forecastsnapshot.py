@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 21:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pages', '0010_hourlywaterlevel'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastSnapshot',
+            fields=[
+                ('station', models.OneToOneField(db_column='station_id', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, serialize=False, to='pages.waterstations')),
+                ('predicted_level', models.FloatField()),
+                ('risk_level', models.IntegerField(blank=True, null=True)),
+                ('risk_text', models.CharField(blank=True, max_length=255, null=True)),
+                ('trajectory', models.JSONField()),
+                ('model_version', models.CharField(blank=True, max_length=100, null=True)),
+                ('computed_at', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'forecast_snapshots',
+            },
+        ),
+    ]
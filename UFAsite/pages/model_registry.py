@@ -0,0 +1,235 @@
+# pages/model_registry.py
+
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+# --- Constants ---
+# เก็บโมเดลแบบมีเวอร์ชัน: <version>.joblib (sklearn เต็ม) + <version>.json (metadata + coef/intercept)
+# ตอนใช้งานจริงอ่านแค่ .json แล้วคำนวณด้วย dot product (ไม่ต้อง import sklearn/pandas ใน web worker)
+# ไฟล์ CURRENT เก็บชื่อเวอร์ชันที่ใช้งานอยู่ (เปลี่ยนไฟล์นี้ = สลับโมเดล / rollback)
+ARTIFACTS_DIR = os.path.join(settings.BASE_DIR, 'model_artifacts')
+CURRENT_POINTER = os.path.join(ARTIFACTS_DIR, 'CURRENT')
+
+# สถานะของการ train แบบ incremental (XᵀX, Xᵀy, จำนวนแถว ฯลฯ) เก็บแยกต่อเวอร์ชัน: <version>.state.json
+# train ต่อจากสถานะของเวอร์ชันใน CURRENT เสมอ หลัง rollback จึงไม่ไปต่อจากเวอร์ชันที่ถูกถอยออก
+TRAINING_STATE_EXT = 'state.json'
+# ไฟล์สถานะรวมไฟล์เดียวแบบเดิม (ไม่ใช้แล้ว ไม่รู้ว่าเป็นของเวอร์ชันไหน) ข้ามไปตอนแสดงรายการเวอร์ชัน
+LEGACY_TRAINING_STATE_NAME = 'training_state.json'
+
+# ระยะห่างขั้นต่ำในการเช็คว่ามีโมเดลใหม่หรือไม่ (วินาที)
+RELOAD_CHECK_SECONDS = 30
+
+class LinearModel:
+    """
+    Linear model แบบเบา สำหรับใช้ทำนายใน web worker (coef + intercept + ลำดับ feature)
+    ให้ผลเท่ากับ LinearRegression.predict ของ sklearn
+
+    coef เป็น 1 มิติ (ทำนายค่าเดียว เช่นโมเดลรุ่นเก่า) หรือ 2 มิติ (1 แถวต่อ output เช่นทุกชั่วโมงล่วงหน้า)
+    """
+
+    def __init__(self, features, coef, intercept):
+        self.features = list(features)
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = np.asarray(intercept, dtype=np.float64)
+
+    @classmethod
+    def from_estimator(cls, estimator, features):
+        return cls(features, estimator.coef_, estimator.intercept_)
+
+    @property
+    def n_outputs(self):
+        return 1 if self.coef.ndim == 1 else self.coef.shape[0]
+
+    def to_dict(self):
+        return {'features': self.features, 'coef': self.coef.tolist(), 'intercept': self.intercept.tolist()}
+
+    def predict_all(self, feature):
+        """
+        Args:
+            feature (dict): ชื่อ feature -> ค่า (ต้องมีครบทุกตัวใน self.features)
+
+        Returns:
+            np.ndarray: ค่าที่ทำนายได้ของทุก output (คูณ matrix ครั้งเดียว)
+        """
+        x = np.fromiter((feature[name] for name in self.features), dtype=np.float64, count=len(self.features))
+        return np.atleast_1d(self.coef @ x + self.intercept)
+
+    def predict(self, feature):
+        """ค่าที่ทำนายได้ของ output แรก (โมเดล output เดียว = ค่าเดียวที่มี)"""
+        return float(self.predict_all(feature)[0])
+
+
+# loaded = (LinearModel, metadata) เก็บเป็น tuple เดียว: อ่านครั้งเดียวได้คู่ที่ตรงกันเสมอ แม้ thread อื่นกำลังสลับเวอร์ชัน
+_state = {'loaded': None, 'pointer_mtime': None, 'checked_at': 0.0}
+_lock = threading.Lock()
+
+
+def _artifact_path(version, ext):
+    return os.path.join(ARTIFACTS_DIR, f'{version}.{ext}')
+
+
+def _write_atomic(path, write_func, mode='w'):
+    """เขียนลงไฟล์ชั่วคราวก่อน แล้วค่อย os.replace (worker อื่นจะไม่เห็นไฟล์ที่เขียนไม่เสร็จ)"""
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, mode, encoding=None if 'b' in mode else 'utf-8') as f:
+        write_func(f)
+    os.replace(tmp_path, path)
+
+
+def save_model(model, metadata, training_state=None):
+    """
+    บันทึกโมเดลเป็นเวอร์ชันใหม่ แล้วตั้งเป็นเวอร์ชันที่ใช้งาน
+    metadata ควรมี 'features' และ model ควรมี coef_/intercept_ เพื่อ export รูปแบบ serving
+    training_state (ถ้ามี) บันทึกคู่กับเวอร์ชันนี้ก่อนสลับ CURRENT
+
+    Returns:
+        str: ชื่อเวอร์ชัน เช่น 'v20260117-083000'
+    """
+    os.makedirs(ARTIFACTS_DIR, exist_ok=True)
+
+    version = base_version = timezone.localtime().strftime('v%Y%m%d-%H%M%S')
+    suffix = 1
+    while os.path.exists(_artifact_path(version, 'json')):
+        suffix += 1
+        version = f'{base_version}-{suffix}'
+    metadata = dict(metadata, version=version, created_at=timezone.now().isoformat())
+    if hasattr(model, 'coef_') and 'features' in metadata:
+        metadata['serving'] = LinearModel.from_estimator(model, metadata['features']).to_dict()
+
+    import joblib
+    _write_atomic(_artifact_path(version, 'joblib'), lambda f: joblib.dump(model, f), mode='wb')
+    _write_atomic(_artifact_path(version, 'json'), lambda f: json.dump(metadata, f, ensure_ascii=False, indent=2))
+    if training_state is not None:
+        state = dict(training_state, version=version)
+        _write_atomic(_artifact_path(version, TRAINING_STATE_EXT), lambda f: json.dump(state, f, indent=2))
+
+    activate(version)
+    return version
+
+
+def activate(version):
+    """ตั้งเวอร์ชันที่ใช้งาน (ใช้ทั้งตอน train เสร็จ และตอน rollback)"""
+    if not os.path.exists(_artifact_path(version, 'joblib')):
+        raise FileNotFoundError(f"ไม่พบโมเดลเวอร์ชัน {version} ใน {ARTIFACTS_DIR}")
+
+    _write_atomic(CURRENT_POINTER, lambda f: f.write(version))
+
+
+def load_training_state():
+    """
+    สถานะ incremental training ของเวอร์ชันที่ใช้งาน (อ่าน CURRENT ตรง ๆ ไม่ผ่าน cache ของ get_model)
+    None ถ้ายังไม่มีโมเดล หรือเวอร์ชันนั้นไม่มีสถานะ (เช่นเวอร์ชันที่สร้างก่อนเก็บสถานะแยกต่อเวอร์ชัน)
+    """
+    version = _read_pointer()
+    if not version:
+        return None
+    try:
+        with open(_artifact_path(version, TRAINING_STATE_EXT), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def list_versions():
+    """รายการโมเดลทุกเวอร์ชัน (เก่า -> ใหม่) พร้อม metadata และสถานะ active"""
+    if not os.path.isdir(ARTIFACTS_DIR):
+        return []
+
+    active = _read_pointer()
+    versions = []
+    for name in os.listdir(ARTIFACTS_DIR):
+        if not name.endswith('.json') or name.endswith(f'.{TRAINING_STATE_EXT}') or name == LEGACY_TRAINING_STATE_NAME:
+            continue
+        with open(os.path.join(ARTIFACTS_DIR, name), encoding='utf-8') as f:
+            metadata = json.load(f)
+        metadata['active'] = metadata.get('version') == active
+        versions.append(metadata)
+    return sorted(versions, key=lambda m: m.get('created_at', ''))
+
+
+def _read_pointer():
+    try:
+        with open(CURRENT_POINTER, encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _pointer_mtime():
+    try:
+        return os.stat(CURRENT_POINTER).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def _load_current():
+    """
+    โหลดโมเดลตาม CURRENT
+    ปกติอ่านแค่ JSON; จะ unpickle .joblib (ซึ่งดึง sklearn มาด้วย) เฉพาะไฟล์รุ่นเก่าที่ยังไม่มี coef ใน JSON
+
+    Raises:
+        FileNotFoundError: ถ้ายังไม่มี CURRENT
+            ไม่ถอยไปใช้ trained_model.joblib แบบเดิม: unpickle ต้อง import sklearn ใน web worker
+            และเป็นโมเดล output เดียว (build.sh รัน train_model ให้ทุก deploy มีเวอร์ชันใน registry)
+    """
+    version = _read_pointer()
+    if not version:
+        raise FileNotFoundError(f"ยังไม่มีโมเดลใน {ARTIFACTS_DIR} (กรุณารันคำสั่ง train_model)")
+
+    with open(_artifact_path(version, 'json'), encoding='utf-8') as f:
+        metadata = json.load(f)
+    serving = metadata.get('serving')
+    if serving:
+        return LinearModel(serving['features'], serving['coef'], serving['intercept']), metadata
+
+    import joblib
+    estimator = joblib.load(_artifact_path(version, 'joblib'))
+    return LinearModel.from_estimator(estimator, metadata['features']), metadata
+
+
+def _refresh():
+    """
+    โหลดโมเดลครั้งแรก หรือโหลดใหม่ถ้า CURRENT เปลี่ยน (เช็คไม่บ่อยกว่า RELOAD_CHECK_SECONDS)
+    โมเดลเก่ายังใช้งานได้จนกว่าโมเดลใหม่จะโหลดเสร็จ แล้วค่อยสลับทีเดียว
+    """
+    now = time.monotonic()
+    if _state['loaded'] is not None and now - _state['checked_at'] < RELOAD_CHECK_SECONDS:
+        return
+
+    with _lock:
+        if _state['loaded'] is not None and now - _state['checked_at'] < RELOAD_CHECK_SECONDS:
+            return
+
+        mtime = _pointer_mtime()
+        if _state['loaded'] is None or mtime != _state['pointer_mtime']:
+            model, metadata = _load_current()
+            _state.update(loaded=(model, metadata), pointer_mtime=mtime)
+            print(f"📦 Model loaded: {metadata.get('version')}")
+
+        _state['checked_at'] = now
+
+
+def get_model():
+    """
+    คืนค่า (LinearModel, metadata) ของเวอร์ชันที่ใช้งาน โหลดครั้งเดียวต่อ worker
+
+    Raises:
+        FileNotFoundError: ถ้ายังไม่มีไฟล์โมเดลเลย
+    """
+    _refresh()
+    return _state['loaded']
+
+
+def current_version():
+    """ชื่อเวอร์ชันโมเดลที่ใช้งานอยู่ (None ถ้ายังไม่มีโมเดล)"""
+    try:
+        _refresh()
+    except FileNotFoundError:
+        return None
+    return _state['loaded'][1].get('version')
@@ -1,4 +1,11 @@
-from django.db import models
+import uuid
+from datetime import timedelta, timezone as dt_timezone
+from itertools import islice
+
+from django.db import connection, models, transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
 
 class WaterStations(models.Model):
     station_id = models.CharField(primary_key=True, max_length=255)
@@ -33,10 +40,394 @@ class WaterLevels(models.Model):
 
     class Meta:
         db_table = 'water_levels'
+        constraints = [
+            # กันข้อมูลซ้ำจากการ backfill (1 สถานี มีได้ 1 ค่าต่อเวลา)
+            models.UniqueConstraint(fields=['station', 'recorded_at'], name='uniq_station_recorded_at'),
+        ]
+        indexes = [
+            # ใช้กับ query "ค่าล่าสุดของสถานี" และช่วงเวลา 12 ชม. ของ predictor
+            # ใส่ water_level/risk_level ไว้ใน index ด้วย เพื่อให้อ่านจาก index ได้เลย (covering)
+            models.Index(
+                fields=['station', '-recorded_at', 'water_level', 'risk_level'],
+                name='wl_station_recorded_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.station.station_name} - {self.water_level}m"
 
+class LatestWaterLevel(models.Model):
+    """
+    Snapshot ค่าล่าสุดของแต่ละสถานี (1 แถวต่อ 1 สถานี)
+    อัปเดตใน transaction เดียวกับการบันทึก WaterLevels เพื่อให้หน้าเว็บ/แชทบอท อ่านได้ใน query เดียว
+    """
+    station = models.OneToOneField(WaterStations, models.DO_NOTHING, primary_key=True, db_column='station_id')
+    water_level = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    risk_level = models.IntegerField(default=0, null=True, blank=True)
+    recorded_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        db_table = 'latest_water_levels'
+
+    def __str__(self):
+        return f"{self.station_id} - {self.water_level}m @ {self.recorded_at}"
+
+    @classmethod
+    def upsert(cls, station, water_level, risk_level, recorded_at):
+        """
+        บันทึกค่าล่าสุดของสถานี (ถ้า recorded_at ใหม่กว่าค่าเดิมเท่านั้น)
+        ควรเรียกภายใน transaction เดียวกับการ insert WaterLevels
+        """
+        values = {'water_level': water_level, 'risk_level': risk_level, 'recorded_at': recorded_at}
+
+        updated = cls.objects.filter(station=station).filter(
+            models.Q(recorded_at__lt=recorded_at) | models.Q(recorded_at__isnull=True)
+        ).update(updated_at=timezone.now(), **values)
+
+        if not updated:
+            cls.objects.get_or_create(station=station, defaults=values)
+
+    @classmethod
+    def upsert_many(cls, readings):
+        """
+        บันทึกค่าล่าสุดของหลายสถานีพร้อมกัน (2 query ไม่ว่าจะมีกี่สถานี)
+        ข้ามสถานีที่ snapshot เดิมใหม่กว่าค่าที่ส่งเข้ามา
+
+        Args:
+            readings: list ของ (station, water_level, risk_level, recorded_at)
+        """
+        current = cls.objects.in_bulk([station.pk for station, _, _, _ in readings])
+
+        rows = []
+        for station, water_level, risk_level, recorded_at in readings:
+            existing = current.get(station.pk)
+            if existing and existing.recorded_at and existing.recorded_at >= recorded_at:
+                continue
+            rows.append(cls(station=station, water_level=water_level, risk_level=risk_level, recorded_at=recorded_at))
+
+        if not rows:
+            return
+
+        # MySQL ใช้ ON DUPLICATE KEY UPDATE (ไม่ต้องระบุ unique_fields) ส่วน DB อื่นต้องระบุ
+        conflict_target = {'unique_fields': ['station']} if connection.features.supports_update_conflicts_with_target else {}
+        cls.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            update_fields=['water_level', 'risk_level', 'recorded_at', 'updated_at'],
+            **conflict_target,
+        )
+
+class HourlyWaterLevel(models.Model):
+    """
+    ผลรวม/จำนวนค่าวัดรายชั่วโมงของแต่ละสถานี (ชั่วโมงแบบ UTC) ใช้เป็นข้อมูลตั้งต้นของ train / simulation / ทำนาย
+    อัปเดตใน transaction เดียวกับการบันทึก WaterLevels (refresh ชั่วโมงที่มีค่าใหม่เข้ามา)
+    เก็บผลรวมแบบ Decimal + จำนวน แทนค่าเฉลี่ย เพื่อให้ค่าเฉลี่ยตรงกับที่คำนวณจากข้อมูลดิบทุกหลัก
+    """
+    station = models.ForeignKey(WaterStations, models.DO_NOTHING, db_column='station_id')
+    hour = models.DateTimeField()
+    level_sum = models.DecimalField(max_digits=14, decimal_places=2)
+    reading_count = models.IntegerField()
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        db_table = 'hourly_water_levels'
+        constraints = [
+            models.UniqueConstraint(fields=['station', 'hour'], name='uniq_station_hour'),
+        ]
+        indexes = [
+            # อ่านทุกสถานีเรียงตามเวลา (train / simulation / หน้าต่าง 12 ชม. ของ predictor)
+            models.Index(fields=['hour', 'station'], name='hwl_hour_station_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.station_id} @ {self.hour}: {self.water_level:.2f}m ({self.reading_count} readings)"
+
+    @property
+    def water_level(self):
+        return float(self.level_sum) / self.reading_count
+
+    @staticmethod
+    def aggregate(readings):
+        """GROUP BY (สถานี, ชั่วโมง UTC) ของ queryset WaterLevels -> dict ของ station_id, hour, level_sum, reading_count"""
+        return (
+            readings.filter(water_level__isnull=False, recorded_at__isnull=False)
+            .annotate(hour=TruncHour('recorded_at', tzinfo=dt_timezone.utc))
+            .values('station_id', 'hour')
+            .annotate(level_sum=Sum('water_level'), reading_count=Count('water_level_id'))
+            .order_by()
+        )
+
+    @staticmethod
+    def floor_hour(value):
+        """ต้นชั่วโมงแบบ UTC ของเวลา (ชั่วโมงเดียวกับ TruncHour ใน aggregate)"""
+        return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+    @classmethod
+    def refresh(cls, station_ids, start, end, batch_size=5000):
+        """
+        คำนวณทุกชั่วโมงที่คาบเกี่ยวช่วง [start, end] ของสถานีที่ระบุใหม่จาก WaterLevels แล้ว upsert
+        (1 query อ่าน + 1 query เขียนต่อ batch_size ชั่วโมง) ควรเรียกใน transaction เดียวกับการ insert WaterLevels
+
+        Returns:
+            int: จำนวนชั่วโมงที่อัปเดต
+        """
+        groups = cls.aggregate(WaterLevels.objects.filter(
+            station_id__in=station_ids,
+            recorded_at__gte=cls.floor_hour(start),
+            recorded_at__lt=cls.floor_hour(end) + timedelta(hours=1),
+        ))
+        # ช่วงละ batch_size ชั่วโมงรวมทุกสถานี = ไม่เกิน batch_size กลุ่มต่อ query (รอบ scrape ปกติ = query เดียว)
+        window_hours = max(1, batch_size // max(1, len(station_ids)))
+        return cls._upsert(cls._aggregate_windows(groups, start, end, window_hours), batch_size)
+
+    @classmethod
+    def rebuild(cls, station_ids=None, start=None, end=None, batch_size=5000):
+        """
+        สร้างตารางรายชั่วโมงใหม่จากข้อมูลดิบทั้งหมด (หรือเฉพาะสถานี / ชั่วโมงตั้งแต่ start ถึงก่อน end)
+        ใช้เมื่อข้อมูลดิบถูกแก้หรือลบนอกเส้นทาง ingest ปกติ
+        """
+        readings = WaterLevels.objects.all()
+        hours = cls.objects.all()
+        if station_ids:
+            readings = readings.filter(station_id__in=station_ids)
+            hours = hours.filter(station_id__in=station_ids)
+        if start is not None:
+            readings = readings.filter(recorded_at__gte=cls.floor_hour(start))
+            hours = hours.filter(hour__gte=cls.floor_hour(start))
+        if end is not None:
+            readings = readings.filter(recorded_at__lt=cls.floor_hour(end))
+            hours = hours.filter(hour__lt=cls.floor_hour(end))
+
+        # ลบชั่วโมงเดิมในช่วงก่อน (ชั่วโมงที่ข้อมูลดิบถูกลบไปแล้วจะได้ไม่ค้าง)
+        with transaction.atomic():
+            hours.delete()
+            # ทีละสถานี เริ่มจากค่าแรกถึงค่าสุดท้ายของสถานีนั้น (ข้ามช่วงก่อน/หลังที่ไม่มีข้อมูล)
+            bounds = list(
+                readings.filter(recorded_at__isnull=False).order_by().values('station_id')
+                .annotate(first=Min('recorded_at'), last=Max('recorded_at'))
+            )
+            groups = (
+                group
+                for b in bounds
+                for group in cls._aggregate_windows(
+                    cls.aggregate(readings.filter(station_id=b['station_id'])), b['first'], b['last'], batch_size
+                )
+            )
+            return cls._upsert(groups, batch_size)
+
+    @classmethod
+    def _aggregate_windows(cls, groups, first, last, window_hours):
+        """
+        อ่านผลของ aggregate() ทีละช่วง window_hours ชั่วโมง ตั้งแต่ชั่วโมงของ first ถึง last
+        แต่ละ query เป็นช่วงเวลาบน index (station, recorded_at) และได้จำนวนกลุ่มจำกัด
+        ไม่ใช้ .iterator() เพราะ PyMySQL ดึงผลทั้งหมดมาเก็บฝั่ง client อยู่ดี
+        """
+        window = timedelta(hours=window_hours)
+        t = cls.floor_hour(first)
+        while t <= last:
+            yield from groups.filter(recorded_at__gte=t, recorded_at__lt=t + window)
+            t += window
+
+    @classmethod
+    def _upsert(cls, groups, batch_size):
+        conflict_target = {'unique_fields': ['station', 'hour']} if connection.features.supports_update_conflicts_with_target else {}
+        total = 0
+        while True:
+            rows = [
+                cls(station_id=g['station_id'], hour=g['hour'], level_sum=g['level_sum'], reading_count=g['reading_count'])
+                for g in islice(groups, batch_size)
+            ]
+            if not rows:
+                return total
+            cls.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                update_fields=['level_sum', 'reading_count', 'updated_at'],
+                **conflict_target,
+            )
+            total += len(rows)
+
+class StationAlertState(models.Model):
+    """
+    สถานะการแจ้งเตือนของแต่ละสถานี (0=ปกติ, 1=เฝ้าระวัง, 2=วิกฤต) สำหรับ alert_policy
+    ใช้ตัดสินว่าค่าใหม่เป็นการเปลี่ยนสถานะที่ต้องแจ้งเตือน หรือเป็นค่าวิกฤตเดิมที่แจ้งไปแล้ว
+    """
+    station = models.OneToOneField(WaterStations, models.DO_NOTHING, primary_key=True, db_column='station_id')
+    state = models.IntegerField(default=0)
+    changed_at = models.DateTimeField(blank=True, null=True)
+    last_alert_at = models.DateTimeField(blank=True, null=True)
+    last_level = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        db_table = 'station_alert_states'
+
+    def __str__(self):
+        return f"{self.station_id}: state {self.state} (last alert {self.last_alert_at})"
+
+    @classmethod
+    def save_many(cls, states):
+        """บันทึกสถานะหลายสถานีใน query เดียว (insert หรือ update ตาม station)"""
+        if not states:
+            return
+        conflict_target = {'unique_fields': ['station']} if connection.features.supports_update_conflicts_with_target else {}
+        cls.objects.bulk_create(
+            states,
+            update_conflicts=True,
+            update_fields=['state', 'changed_at', 'last_alert_at', 'last_level', 'updated_at'],
+            **conflict_target,
+        )
+
+class ForecastSnapshot(models.Model):
+    """
+    ผลคาดการณ์ล่าสุดของแต่ละสถานี (1 แถวต่อ 1 สถานี) คำนวณหลัง scrape_data บันทึกข้อมูลใหม่ หรือหลัง train/rollback
+    เก็บใน DB เพราะ ingest อาจรันคนละ process กับ web worker หน้าเว็บอ่านใน query เดียวโดยไม่ต้องทำนายเอง
+    """
+    station = models.OneToOneField(WaterStations, models.DO_NOTHING, primary_key=True, db_column='station_id')
+    predicted_level = models.FloatField()
+    risk_level = models.IntegerField(blank=True, null=True)
+    risk_text = models.CharField(max_length=255, blank=True, null=True)
+    trajectory = models.JSONField()  # [[ชั่วโมงล่วงหน้า, ระดับน้ำ], ...]
+    model_version = models.CharField(max_length=100, blank=True, null=True)
+    computed_at = models.DateTimeField()
+
+    class Meta:
+        db_table = 'forecast_snapshots'
+
+    def __str__(self):
+        return f"{self.station_id}: {self.predicted_level:.2f}m ({self.model_version} @ {self.computed_at})"
+
+    def as_forecast(self):
+        """(predicted_level, risk_level, risk_text, trajectory) แบบเดียวกับ predictor.load_forecasts"""
+        return self.predicted_level, self.risk_level, self.risk_text, [tuple(point) for point in self.trajectory]
+
+    @classmethod
+    def replace_all(cls, forecasts, model_version):
+        """
+        แทน snapshot ทั้งชุดด้วยผลใหม่ (สถานีที่ทำนายไม่ได้ในรอบนี้ถูกลบ ไม่แสดงผลเก่าค้างไว้)
+
+        Args:
+            forecasts: dict ของ station_id -> (predicted_level, risk_level, risk_text, trajectory)
+        """
+        now = timezone.now()
+        rows = [
+            cls(station_id=station_id, predicted_level=level, risk_level=risk_level, risk_text=risk_text,
+                trajectory=[list(point) for point in trajectory], model_version=model_version, computed_at=now)
+            for station_id, (level, risk_level, risk_text, trajectory) in forecasts.items()
+            if level is not None and trajectory
+        ]
+        conflict_target = {'unique_fields': ['station']} if connection.features.supports_update_conflicts_with_target else {}
+        with transaction.atomic():
+            cls.objects.exclude(station_id__in=[row.station_id for row in rows]).delete()
+            if rows:
+                cls.objects.bulk_create(
+                    rows,
+                    update_conflicts=True,
+                    update_fields=['predicted_level', 'risk_level', 'risk_text', 'trajectory', 'model_version', 'computed_at'],
+                    **conflict_target,
+                )
+
+class ScraperState(models.Model):
+    """
+    สถานะการดึงข้อมูลของแต่ละแหล่ง (ETag / Last-Modified ล่าสุด) สำหรับขอข้อมูลแบบมีเงื่อนไขในรอบถัดไป
+    เก็บใน DB เพราะ scrape_data อาจรันคนละ process ในแต่ละรอบ (เช่น GitHub Actions)
+    """
+    source = models.CharField(primary_key=True, max_length=255)
+    etag = models.CharField(max_length=255, blank=True, null=True)
+    last_modified = models.CharField(max_length=255, blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, null=True)
+
+    class Meta:
+        db_table = 'scraper_state'
+
+    def __str__(self):
+        return f"{self.source} (ETag: {self.etag}, Last-Modified: {self.last_modified})"
+
+class IngestLock(models.Model):
+    """
+    แถวล็อกของงานดึงข้อมูล ใช้รับประกันว่าแต่ละรอบ (cycle) มีแค่ process เดียวที่ได้ทำงาน
+    แม้จะมีหลาย web worker / ingest process / GitHub Actions รันพร้อมกัน
+    """
+    name = models.CharField(primary_key=True, max_length=100)
+    cycle_at = models.DateTimeField(blank=True, null=True)  # จุดเริ่มรอบล่าสุดที่ถูกจองแล้ว
+    owner = models.CharField(max_length=255, blank=True, null=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'ingest_locks'
+
+    def __str__(self):
+        return f"{self.name} @ {self.cycle_at} ({self.owner})"
+
+    @classmethod
+    def claim(cls, name, cycle_at, owner):
+        """
+        จองรอบ cycle_at ด้วย UPDATE แบบมีเงื่อนไข (atomic ในระดับแถว)
+        process แรกที่ UPDATE สำเร็จเป็นเจ้าของรอบนั้น process อื่นจะได้ 0 แถว
+
+        Returns:
+            bool: True ถ้าได้สิทธิ์ทำงานรอบนี้
+        """
+        cls.objects.get_or_create(name=name)
+        updated = cls.objects.filter(name=name).filter(
+            models.Q(cycle_at__lt=cycle_at) | models.Q(cycle_at__isnull=True)
+        ).update(cycle_at=cycle_at, owner=owner, claimed_at=timezone.now())
+        return updated == 1
+
+class AlertOutbox(models.Model):
+    """
+    คิวแจ้งเตือน LINE ที่รอส่ง (บันทึกใน transaction เดียวกับข้อมูลระดับน้ำ แล้วค่อยส่งทีหลัง)
+    การส่งจึงไม่ทำให้การดึงข้อมูลช้าลง และข้อความที่ส่งไม่สำเร็จยังอยู่ในตารางให้ลองใหม่ได้
+    """
+    PENDING = 'pending'
+    SENDING = 'sending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENDING, 'Sending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    message = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    retry_key = models.UUIDField(default=uuid.uuid4)  # X-Line-Retry-Key: ส่งซ้ำด้วย key เดิม LINE จะไม่ส่งซ้ำให้ผู้ใช้
+    recipient_count = models.IntegerField(blank=True, null=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'alert_outbox'
+        indexes = [models.Index(fields=['status', 'next_attempt_at'], name='alert_outbox_due_idx')]
+
+    def __str__(self):
+        return f"#{self.pk} {self.status} ({self.attempts} attempts)"
+
+class AlertBatch(models.Model):
+    """
+    ผลการส่งแจ้งเตือน 1 ชุด (ผู้รับไม่เกิน 500 คนตามข้อจำกัดของ LINE Multicast)
+    ชุดกำหนดด้วยช่วง user_id ส่งซ้ำเฉพาะชุดที่ยังไม่สำเร็จได้ โดยผู้รับชุดอื่นไม่ได้ข้อความซ้ำ
+    """
+    alert = models.ForeignKey(AlertOutbox, models.CASCADE, related_name='batches')
+    batch_index = models.IntegerField()
+    first_user_id = models.IntegerField()
+    last_user_id = models.IntegerField()
+    recipient_count = models.IntegerField(default=0)
+    status = models.CharField(max_length=10, choices=AlertOutbox.STATUS_CHOICES, default=AlertOutbox.PENDING)
+    attempts = models.IntegerField(default=0)
+    http_status = models.IntegerField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+    duration_ms = models.IntegerField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        db_table = 'alert_batches'
+        constraints = [models.UniqueConstraint(fields=['alert', 'batch_index'], name='uniq_alert_batch_index')]
+
+    def __str__(self):
+        return f"Alert #{self.alert_id} batch {self.batch_index}: {self.status} ({self.recipient_count} users)"
+
 class Users(models.Model):
     user_id = models.AutoField(primary_key=True)
     line_user_id = models.CharField(max_length=255, unique=True)
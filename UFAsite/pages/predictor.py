@@ -1,19 +1,31 @@
-import pandas as pd
+import threading
+import time
 import numpy as np
-import joblib
 from datetime import timedelta
 from django.utils import timezone
 
-from .models import WaterLevels
+from . import data_loader, model_registry
+from .models import ForecastSnapshot, HourlyWaterLevel, LatestWaterLevel
 from .risk_calculator import evaluate_flood_risk
-from sklearn.linear_model import LinearRegression
+
+# หมายเหตุ: pandas / sklearn import เฉพาะตอน train (ฝั่งทำนายใช้ NumPy + coef ใน JSON)
+# เพื่อไม่ให้ทุก web worker ต้องโหลด library หนัก ๆ ตั้งแต่ start
 
 # --- Constants ---
-MODEL_PATH = 'trained_model.joblib' 
+# โมเดลเดียวทำนายทุกชั่วโมงล่วงหน้า 1-24 ชม. (1 output ต่อชั่วโมง) จาก feature vector เดียวกัน
+FORECAST_HORIZONS = list(range(1, 25))
+# ชั่วโมงล่วงหน้าที่ใช้ประเมินความเสี่ยงและแสดงเป็นค่าหลัก (ต้องอยู่ใน FORECAST_HORIZONS)
 PREDICT_HOURS = 6
 STATIONS_FOR_FEATURES = ['TS2', 'TS16', 'TS5']
+# ทุกสถานีมีชุด output ของตัวเอง (1 แถว coef ต่อสถานีต่อชั่วโมง) ใช้ feature vector ชุดเดียวกัน
+TARGET_STATIONS = ['TS2', 'TS16', 'TS5']
+# สถานีหลัก (M.7): ใช้กับกฎ Hybrid, load_and_predict และข้อความคาดการณ์ในแชท
 TARGET_STATION = 'TS16'
 
+# Cache ผลทำนาย: ใช้ซ้ำได้จนกว่าจะมีข้อมูลใหม่เข้ามา หรือเปลี่ยนเวอร์ชันโมเดล
+# (กันไว้ไม่ให้ค้างเกินรอบการดึงข้อมูล 15 นาที เพราะหน้าต่างข้อมูล 12 ชม. เลื่อนตามเวลา)
+PREDICTION_CACHE_MAX_AGE = 15 * 60
+
 # Threshold ความผิดปกติ
 ANOMALY_RISE_THRESHOLD = 0.5    # น้ำขึ้นเร็ว (Flash Flood)
 BACKWATER_DIFF_THRESHOLD = 1.5  # ส่วนต่างหัวท้ายที่เริ่มน่าห่วง (ลดจาก 2.5)
@@ -26,21 +38,32 @@ FEATURES_TO_USE = [
     'TS5_lag1h', 'TS5_lag2h', 'TS5_lag3h',
 ]
 
+# OLSState แก้ normal equations (XᵀX) ซึ่ง condition number เป็นกำลังสองของ X (lag 1-3 ชม. เกือบเป็นเส้นตรงเดียวกัน)
+# ความคลาดเคลื่อนของ coef ~ cond × 1e-16 ถ้าเกินค่านี้ (คลาดเกิน ~1e-6) ให้ train ใหม่ทั้งหมดด้วย sklearn แทน
+MAX_NORMAL_EQUATIONS_COND = 1e10
+
 def _prepare_dataframe(df_raw):
-    """Takes raw dataframe from DB and processes it for training or prediction."""
+    """Takes raw dataframe from DB and processes it for training."""
+    import pandas as pd
+
     df_raw['water_level'] = pd.to_numeric(df_raw['water_level'], errors='coerce')
     df_raw.dropna(subset=['water_level'], inplace=True)
 
     df = df_raw.pivot_table(index='recorded_at', columns='station__station_id', values='water_level')
+    return _prepare_hourly(df.resample('h').mean())
 
+def _prepare_hourly(df):
+    """
+    ตารางค่าเฉลี่ยรายชั่วโมง (NaN = ชั่วโมงที่ไม่มีค่าวัด) -> interpolate + lag features
+    รับได้ทั้งผลจาก resample ของ pandas และจาก data_loader.load_hourly_frame
+    """
+    df = df.copy()
     for station in STATIONS_FOR_FEATURES:
         if station not in df.columns:
             df[station] = np.nan
 
-    df = df.resample('h').mean()
     df = df.interpolate(method='linear', limit_direction='both')
-    df.fillna(method='bfill', inplace=True)
-    df.fillna(method='ffill', inplace=True)
+    df = df.bfill().ffill()
 
     # Create lagged features
     for station in STATIONS_FOR_FEATURES:
@@ -50,66 +73,486 @@ def _prepare_dataframe(df_raw):
     df.dropna(inplace=True)
     return df
 
-def train_and_save_model():
-    """Fetches data, trains a new model, and saves it."""
-    print("🔄 Starting model training process...")
-    qs = WaterLevels.objects.all().values('recorded_at', 'station__station_id', 'water_level')
-    if not qs.exists(): return None
+def _build_feature_vector(records):
+    """
+    สร้าง feature vector สำหรับทำนาย (แถวสุดท้ายของ _prepare_dataframe) ด้วย NumPy ล้วน
 
-    df_raw = pd.DataFrame(qs)
-    df = _prepare_dataframe(df_raw)
+    ให้ผลเหมือน pandas path ทุกขั้น: เฉลี่ยรายชั่วโมง -> interpolate แบบ linear
+    (ค่าที่ขอบใช้ค่าใกล้สุด) -> lag 1-3 ชม. แต่ไม่ต้องสร้าง DataFrame ทั้งก้อน
 
-    if df.empty: return None
+    Args:
+        records: iterable ของ (recorded_at, station_id, water_level)
 
-    df['target'] = df[TARGET_STATION].shift(-PREDICT_HOURS)
-    df.dropna(inplace=True)
+    Returns:
+        np.ndarray เรียงตาม FEATURES_TO_USE หรือ None ถ้าข้อมูลไม่พอ
+    """
+    station_index = {station: i for i, station in enumerate(STATIONS_FOR_FEATURES)}
+    hours, stations, levels = [], [], []
+    for recorded_at, station_id, water_level in records:
+        if water_level is None or station_id not in station_index:
+            continue
+        hours.append(int(recorded_at.timestamp()) // 3600)
+        stations.append(station_index[station_id])
+        levels.append(float(water_level))
+
+    if not hours:
+        return None
+
+    hours = np.array(hours, dtype=np.int64)
+    stations = np.array(stations, dtype=np.int64)
+    levels = np.array(levels, dtype=np.float64)
+
+    # ต้องมีอย่างน้อย 4 ชั่วโมง (ปัจจุบัน + lag 3 ชม.) เหมือน dropna ใน pandas path
+    first_hour = hours.min()
+    n_hours = int(hours.max() - first_hour) + 1
+    if n_hours < 4:
+        return None
+
+    bins = hours - first_hour
+    last4 = np.arange(n_hours - 4, n_hours)
+    current, lags = [], []
+    for i in range(len(STATIONS_FOR_FEATURES)):
+        mask = stations == i
+        sums = np.bincount(bins[mask], weights=levels[mask], minlength=n_hours)
+        counts = np.bincount(bins[mask], minlength=n_hours)
+        valid = np.flatnonzero(counts)
+        if valid.size == 0:
+            return None
+
+        # np.interp ใช้ค่าใกล้สุดที่ขอบ = interpolate(limit_direction='both') + bfill/ffill
+        series = np.interp(last4, valid, sums[valid] / counts[valid])
+        current.append(series[3])
+        lags.extend(series[2::-1])  # lag1h, lag2h, lag3h
+
+    return np.array(current + lags, dtype=np.float64)
+
+def _complete_until(hourly):
+    """
+    ชั่วโมงสุดท้ายที่ค่ารายชั่วโมงของทุกสถานีนิ่งแล้ว (ข้อมูลที่เข้ามาทีหลังจะไม่ทำให้เปลี่ยน)
+
+    ชั่วโมงที่มีค่าวัดล่าสุดของแต่ละสถานียังอาจได้ค่าเพิ่มในชั่วโมงเดียวกัน และชั่วโมงหลังจากนั้นเป็นแค่การเติมค่า (ffill)
+    จึงนับถึงชั่วโมงที่มีค่าวัดก่อนหน้านั้น ค่าที่ interpolate ก่อนหน้าชั่วโมงนี้ใช้แค่ค่าวัดที่นิ่งแล้ว
+
+    Args:
+        hourly: ตารางค่าเฉลี่ยรายชั่วโมง (ก่อน interpolate)
+
+    Returns:
+        pd.Timestamp หรือ None ถ้ามีสถานีที่ข้อมูลไม่ถึง 2 ชั่วโมง
+    """
+    cutoff = None
+    for station in STATIONS_FOR_FEATURES:
+        if station not in hourly.columns:
+            return None
+        observed = hourly.index[hourly[station].notna()]
+        if len(observed) < 2:
+            return None
+        cutoff = observed[-2] if cutoff is None else min(cutoff, observed[-2])
+    return cutoff
+
+def _target_columns():
+    """คอลัมน์ target เรียงตามลำดับ output ของโมเดล: ทีละสถานี แต่ละสถานีเรียงตามชั่วโมงล่วงหน้า"""
+    return [f'{station}_target_{hours}h' for station in TARGET_STATIONS for hours in FORECAST_HORIZONS]
+
+def _mae_by_station(errors):
+    """MAE ต่อ output (เรียงตาม _target_columns) -> {สถานี: [MAE ของแต่ละชั่วโมงล่วงหน้า]}"""
+    errors = np.asarray(errors).reshape(len(TARGET_STATIONS), len(FORECAST_HORIZONS))
+    return {station: row.tolist() for station, row in zip(TARGET_STATIONS, errors)}
+
+def _training_rows(hourly):
+    """
+    แถว train (feature + target ทุกสถานี ทุกชั่วโมงใน FORECAST_HORIZONS) จากตารางรายชั่วโมง
+    เฉพาะแถวที่ target ไกลสุดไม่เกิน _complete_until
+    แถวท้าย ๆ ที่ยังเป็นค่าเติมจะไม่ถูกใช้ ทำให้ train แบบ incremental ได้แถวเดียวกับการ train ใหม่ทั้งหมด
+    """
+    import pandas as pd
+
+    df = _prepare_hourly(hourly)
+    cutoff = _complete_until(hourly)
+    if df.empty or cutoff is None:
+        return df.iloc[0:0]
+
+    for station in TARGET_STATIONS:
+        for hours in FORECAST_HORIZONS:
+            df[f'{station}_target_{hours}h'] = df[station].shift(-hours)
+    df = df[df.index <= cutoff - pd.Timedelta(hours=max(FORECAST_HORIZONS))]
+    return df.dropna()
+
+class OLSState:
+    """
+    Sufficient statistics ของ linear regression (Σx, Σy, XᵀX, XᵀY, จำนวนแถว)
+    เพิ่มข้อมูลทีละชุดได้ แล้วแก้สมการได้ค่าเดียวกับ fit ใหม่ทั้งหมด ขนาดคงที่ไม่ว่าข้อมูลจะสะสมมากแค่ไหน
+    รองรับหลาย output (Y เป็น matrix 1 คอลัมน์ต่อ output): XᵀX ใช้ร่วมกัน แก้สมการครั้งเดียวได้ทุก output
+
+    เก็บค่าที่ลบ origin (แถวแรก) ออกแล้ว: ระดับน้ำ ~110 ม. แต่แกว่งแค่หลักเซนติเมตร
+    ถ้าสะสมค่าดิบ การลบค่าเฉลี่ยตอนแก้สมการจะเสียความละเอียดไปหลายหลัก
+    """
+
+    def __init__(self, n_features, n_outputs=1):
+        self.n = 0
+        self.x0 = np.zeros(n_features)
+        self.y0 = np.zeros(n_outputs)
+        self.sum_x = np.zeros(n_features)
+        self.sum_y = np.zeros(n_outputs)
+        self.xtx = np.zeros((n_features, n_features))
+        self.xty = np.zeros((n_features, n_outputs))
+
+    def update(self, X, Y):
+        X = np.asarray(X, dtype=np.float64)
+        Y = np.asarray(Y, dtype=np.float64).reshape(len(X), -1)
+        if len(Y) == 0:
+            return
+        if self.n == 0:
+            self.x0 = X[0].copy()
+            self.y0 = Y[0].copy()
+        Xs = X - self.x0
+        Ys = Y - self.y0
+        self.n += len(Ys)
+        self.sum_x += Xs.sum(axis=0)
+        self.sum_y += Ys.sum(axis=0)
+        self.xtx += Xs.T @ Xs
+        self.xty += Xs.T @ Ys
+
+    def solve(self):
+        """
+        แก้ normal equations ด้วย Cholesky หลังปรับสเกลแต่ละ feature ให้ diagonal เป็น 1
+
+        Returns:
+            tuple: (coef, intercept) เท่ากับ LinearRegression().fit(X, Y) กับข้อมูลทั้งหมดที่เคย update
+                coef ขนาด (n_outputs, n_features), intercept ขนาด (n_outputs,)
+
+        Raises:
+            np.linalg.LinAlgError: ถ้า XᵀX ill-conditioned (cond เกิน MAX_NORMAL_EQUATIONS_COND) หรือ singular
+        """
+        from scipy.linalg import cho_factor, cho_solve
+
+        mean_x = self.sum_x / self.n
+        mean_y = self.sum_y / self.n
+        cxx = self.xtx - self.n * np.outer(mean_x, mean_x)
+        cxy = self.xty - self.n * np.outer(mean_x, mean_y)
+
+        diag = np.diag(cxx)
+        if np.any(diag <= 0):
+            raise np.linalg.LinAlgError('A feature is constant over the training rows')
+        scale = 1.0 / np.sqrt(diag)
+        scaled = cxx * np.outer(scale, scale)
+        cond = np.linalg.cond(scaled)
+        if not cond < MAX_NORMAL_EQUATIONS_COND:
+            raise np.linalg.LinAlgError(f'Normal equations are ill-conditioned (cond={cond:.3g})')
+        coef = (scale[:, None] * cho_solve(cho_factor(scaled), scale[:, None] * cxy)).T
+        intercept = mean_y + self.y0 - coef @ (mean_x + self.x0)
+        return coef, intercept
+
+    def to_dict(self):
+        return {
+            'n': self.n, 'x0': self.x0.tolist(), 'y0': self.y0.tolist(), 'sum_x': self.sum_x.tolist(),
+            'sum_y': self.sum_y.tolist(), 'xtx': self.xtx.tolist(), 'xty': self.xty.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls(len(data['x0']), len(data['y0']))
+        state.n = data['n']
+        state.x0 = np.array(data['x0'])
+        state.y0 = np.array(data['y0'])
+        state.sum_x = np.array(data['sum_x'])
+        state.sum_y = np.array(data['sum_y'])
+        state.xtx = np.array(data['xtx'])
+        state.xty = np.array(data['xty'])
+        return state
+
+def _estimator(coef, intercept):
+    """LinearRegression ที่ตั้ง coef/intercept เอง (ไฟล์ .joblib ยังเป็น estimator ของ sklearn เหมือนเดิม)"""
+    from sklearn.linear_model import LinearRegression
+
+    model = LinearRegression()
+    model.coef_ = np.asarray(coef, dtype=np.float64)
+    model.intercept_ = np.asarray(intercept, dtype=np.float64)
+    model.n_features_in_ = len(FEATURES_TO_USE)
+    return model
+
+def _training_state(ols, first_hour, last_hour):
+    """สถานะ incremental ที่บันทึกคู่กับเวอร์ชันที่ train ได้ (ดู model_registry.save_model)"""
+    return {
+        'features': FEATURES_TO_USE,
+        'target_stations': TARGET_STATIONS,
+        'horizons': FORECAST_HORIZONS,
+        'first_hour': first_hour.isoformat(),
+        'last_hour': last_hour.isoformat(),
+        'ols': ols.to_dict(),
+    }
+
+def train_and_save_model():
+    """Fetches data, trains a new model, and saves it as a new registry version."""
+    from sklearn.linear_model import LinearRegression
+
+    print("🔄 Starting model training process...")
+    # อ่านค่ารายชั่วโมงจาก hourly_water_levels ทีละก้อน (ไม่โหลดข้อมูลดิบทั้งตารางเข้าหน่วยความจำ)
+    hourly = data_loader.load_hourly_frame(STATIONS_FOR_FEATURES)
+    if hourly.empty: return None
+
+    df = _training_rows(hourly)
 
     if df.empty: return None
 
     X = df[FEATURES_TO_USE]
-    y = df['target']
+    Y = df[_target_columns()]
+
+    # วัด MAE จากข้อมูล 20% ล่าสุด (ไม่สุ่ม เพราะเป็น time series) ก่อน train จริงด้วยข้อมูลทั้งหมด
+    mae = mae_by_station = None
+    split = int(len(df) * 0.8)
+    if split > 0 and split < len(df):
+        holdout_model = LinearRegression()
+        holdout_model.fit(X.iloc[:split], Y.iloc[:split])
+        errors = np.abs(holdout_model.predict(X.iloc[split:]) - Y.iloc[split:].to_numpy())
+        mae_by_station = _mae_by_station(errors.mean(axis=0))
+        mae = mae_by_station[TARGET_STATION][FORECAST_HORIZONS.index(PREDICT_HOURS)]
 
+    # fit ครั้งเดียวได้ทุกสถานีทุกชั่วโมงล่วงหน้า (XᵀX ชุดเดียว แก้สมการพร้อมกันทุก output)
     model = LinearRegression()
-    model.fit(X, y)
-    joblib.dump(model, MODEL_PATH)
-    print("✅ Model training complete.")
-    return MODEL_PATH
+    model.fit(X, Y)
+
+    metadata = {
+        'model_type': type(model).__name__,
+        'training': 'full',
+        'target_station': TARGET_STATION,
+        'target_stations': TARGET_STATIONS,
+        'predict_hours': PREDICT_HOURS,
+        'horizons': FORECAST_HORIZONS,
+        'features': FEATURES_TO_USE,
+        'train_start': df.index[0].isoformat(),
+        'train_end': df.index[-1].isoformat(),
+        'row_count': len(df),
+        'mae': mae,
+        'mae_by_station': mae_by_station,
+    }
+    # เริ่มสถานะ incremental ใหม่จากข้อมูลชุดนี้ (train_incremental จะต่อจากแถวสุดท้าย)
+    ols = OLSState(len(FEATURES_TO_USE), len(TARGET_STATIONS) * len(FORECAST_HORIZONS))
+    ols.update(X.to_numpy(), Y.to_numpy())
+    version = model_registry.save_model(model, metadata, training_state=_training_state(ols, df.index[0], df.index[-1]))
+
+    print(f"✅ Model training complete. (version {version}, MAE={mae})")
+    return version
+
+def _incremental_window_start(last_hour):
+    """
+    ชั่วโมงแรกที่ต้องอ่าน เพื่อให้แถวหลัง last_hour คำนวณได้เหมือนอ่านทั้งตาราง:
+    lag 3 ชม. ต้องใช้ชั่วโมง last_hour-2 และการ interpolate ต้องมีค่าวัดก่อนหน้านั้นของทุกสถานี
+
+    Returns:
+        datetime ต้นชั่วโมง หรือ None ถ้าต้องอ่านตั้งแต่ต้น
+    """
+    first_needed = last_hour - timedelta(hours=2)
+    starts = []
+    for station in STATIONS_FOR_FEATURES:
+        previous = (
+            HourlyWaterLevel.objects.filter(station_id=station, hour__lte=first_needed)
+            .order_by('-hour').values_list('hour', flat=True).first()
+        )
+        if previous is None:
+            return None
+        starts.append(previous)
+    return min(starts)
+
+def train_incremental():
+    """
+    เพิ่มเฉพาะแถวรายชั่วโมงใหม่ (หลังแถวสุดท้ายที่ train ไปแล้ว) เข้าไปใน OLSState แล้วแก้สมการใหม่
+    ได้ coef เท่ากับ train_and_save_model() กับข้อมูลทั้งหมด แต่อ่านแค่ช่วงใหม่
+    ต่อจากสถานะของเวอร์ชันที่ใช้งานอยู่ (หลัง rollback = ต่อจากเวอร์ชันที่ถอยกลับไป)
+    ถ้าเวอร์ชันนั้นไม่มีสถานะ (หรือ feature/target เปลี่ยน) จะ train แบบเต็มแทน
+
+    Returns:
+        str: เวอร์ชันใหม่ หรือ None ถ้าไม่มีแถวใหม่ที่ข้อมูลครบ
+    """
+    import pandas as pd
+
+    state = model_registry.load_training_state()
+    if (
+        state is None or state['features'] != FEATURES_TO_USE or state.get('target_stations') != TARGET_STATIONS
+        or state.get('horizons') != FORECAST_HORIZONS
+    ):
+        print("ℹ️ No compatible incremental state, running a full retrain.")
+        return train_and_save_model()
+
+    last_hour = pd.Timestamp(state['last_hour'])
+    window_start = _incremental_window_start(last_hour.to_pydatetime())
+    hourly = data_loader.load_hourly_frame(STATIONS_FOR_FEATURES, start=window_start)
+    if hourly.empty:
+        return None
+
+    df = _training_rows(hourly)
+    df = df[df.index > last_hour]
+    if df.empty:
+        print("ℹ️ No new complete hourly rows since the last training run.")
+        return None
+
+    X = df[FEATURES_TO_USE].to_numpy()
+    Y = df[_target_columns()].to_numpy()
+
+    # MAE ของโมเดลก่อนหน้า กับแถวใหม่ที่ยังไม่เคยเห็น (วัดก่อนเอาแถวเหล่านี้ไป train)
+    ols = OLSState.from_dict(state['ols'])
+    try:
+        coef, intercept = ols.solve()
+        mae_by_station = _mae_by_station(np.abs(X @ coef.T + intercept - Y).mean(axis=0))
+        mae = mae_by_station[TARGET_STATION][FORECAST_HORIZONS.index(PREDICT_HOURS)]
+
+        ols.update(X, Y)
+        coef, intercept = ols.solve()
+    except np.linalg.LinAlgError as e:
+        print(f"⚠️ {e}, running a full retrain instead.")
+        return train_and_save_model()
+
+    metadata = {
+        'model_type': 'LinearRegression',
+        'training': 'incremental',
+        'target_station': TARGET_STATION,
+        'target_stations': TARGET_STATIONS,
+        'predict_hours': PREDICT_HOURS,
+        'horizons': FORECAST_HORIZONS,
+        'features': FEATURES_TO_USE,
+        'train_start': state['first_hour'],
+        'train_end': df.index[-1].isoformat(),
+        'row_count': ols.n,
+        'new_rows': len(df),
+        'mae': mae,
+        'mae_by_station': mae_by_station,
+    }
+    version = model_registry.save_model(
+        _estimator(coef, intercept), metadata,
+        training_state=_training_state(ols, pd.Timestamp(state['first_hour']), df.index[-1]),
+    )
+
+    print(f"✅ Incremental training complete. (version {version}, +{len(df)} rows, MAE={mae})")
+    return version
+
+_prediction_cache = {'key': None, 'result': None, 'cached_at': 0.0}
+_prediction_lock = threading.Lock()
+
+def _prediction_cache_key():
+    """Key ของผลทำนาย = เวลาข้อมูลล่าสุดของ TS2/TS16/TS5 + เวอร์ชันโมเดล"""
+    latest = dict(
+        LatestWaterLevel.objects.filter(station_id__in=STATIONS_FOR_FEATURES)
+        .values_list('station_id', 'recorded_at')
+    )
+    return tuple(latest.get(s) for s in STATIONS_FOR_FEATURES), model_registry.current_version()
+
+def invalidate_prediction_cache():
+    """ล้าง cache ผลทำนาย (เรียกหลัง scrape_data บันทึกข้อมูลใหม่)"""
+    with _prediction_lock:
+        _prediction_cache['key'] = None
+        _prediction_cache['result'] = None
+
+def refresh_forecasts():
+    """
+    ทำนายใหม่แล้วบันทึกเป็น ForecastSnapshot (เรียกหลัง scrape_data บันทึกข้อมูลใหม่ และหลัง train/rollback)
+    หน้าเว็บอ่านแค่ snapshot นี้ ไม่ต้องอ่านประวัติหรือคำนวณโมเดลระหว่าง render
+
+    Returns:
+        dict: ผลเดียวกับ load_forecasts
+    """
+    invalidate_prediction_cache()
+    forecasts = load_forecasts()
+    ForecastSnapshot.replace_all(forecasts, model_registry.current_version())
+    return forecasts
 
 def load_and_predict():
+    """ระดับน้ำอีก PREDICT_HOURS ชม. + ความเสี่ยง (ค่าหลักจากผลเดียวกับ load_forecast)"""
+    return load_forecast()[:3]
+
+def load_forecast(station_id=TARGET_STATION):
     """
-    โหลดโมเดลและทำนายระดับน้ำ พร้อมระบบ Hybrid 2 ชั้น:
+    ผลคาดการณ์ทุกชั่วโมงล่วงหน้าของ 1 สถานี (จากผลเดียวกับ load_forecasts)
+
+    Returns:
+        tuple: (predicted_level, risk_level, risk_text, trajectory)
+            predicted_level: ระดับน้ำอีก PREDICT_HOURS ชม. (None ถ้าทำนายไม่ได้)
+            risk_level, risk_text: ประเมินจาก predicted_level ด้วยเกณฑ์ของสถานีนั้น
+            trajectory: list ของ (ชั่วโมงล่วงหน้า, ระดับน้ำ) หรือ None
+    """
+    return load_forecasts()[station_id]
+
+def load_forecasts():
+    """
+    ทำนายระดับน้ำทุกสถานีใน TARGET_STATIONS ทุกชั่วโมงล่วงหน้า โดยใช้ผลจาก cache ถ้าข้อมูลล่าสุดและโมเดลยังไม่เปลี่ยน
+    (ผู้ใช้หลายร้อยคนถามพร้อมกัน = คำนวณจริงแค่ครั้งเดียว)
+
+    Returns:
+        dict: station_id -> (predicted_level, risk_level, risk_text, trajectory) แบบเดียวกับ load_forecast
+    """
+    key = _prediction_cache_key()
+
+    # ถือ lock ระหว่างคำนวณ: request ที่เข้ามาพร้อมกันจะรอผลเดียวกัน ไม่คำนวณซ้ำ
+    with _prediction_lock:
+        age = time.monotonic() - _prediction_cache['cached_at']
+        if _prediction_cache['key'] == key and age < PREDICTION_CACHE_MAX_AGE:
+            return _prediction_cache['result']
+
+        result = _predict()
+
+        # เก็บเฉพาะผลที่ทำนายสำเร็จ (ข้อความ error อาจเปลี่ยนตามเวลา)
+        if result[TARGET_STATION][0] is not None:
+            _prediction_cache.update(key=key, result=result, cached_at=time.monotonic())
+        return result
+
+def _failed(message):
+    """ผลของทุกสถานีเมื่อทำนายไม่ได้ (risk_text = ข้อความ error)"""
+    return {station: (None, None, message, None) for station in TARGET_STATIONS}
+
+def _supports_all_outputs(model, metadata):
+    """โมเดลให้ผลครบ TARGET_STATIONS x FORECAST_HORIZONS เรียงตามลำดับเดียวกันหรือไม่"""
+    return (
+        metadata.get('target_stations') == TARGET_STATIONS
+        and metadata.get('horizons') == FORECAST_HORIZONS
+        and model.n_outputs == len(TARGET_STATIONS) * len(FORECAST_HORIZONS)
+    )
+
+def _predict():
+    """
+    โหลดโมเดลและทำนายระดับน้ำทุกสถานี (query เดียว + คูณ matrix ครั้งเดียว)
+    พร้อมระบบ Hybrid 2 ชั้นของสถานีหลัก (TARGET_STATION):
     1. Anomaly Detection (Flash Flood)
     2. Backwater Effect (น้ำหนุน)
+
+    Returns:
+        dict: station_id -> (predicted_level, risk_level, risk_text, trajectory)
     """
-    # 1. Load Model
+    # 1. Load Model (โหลดครั้งเดียวต่อ worker ผ่าน registry)
     try:
-        model = joblib.load(MODEL_PATH)
+        model, metadata = model_registry.get_model()
     except FileNotFoundError:
-        return None, None, f"ไม่พบไฟล์โมเดล ({MODEL_PATH})"
+        return _failed("ไม่พบไฟล์โมเดล (กรุณารันคำสั่ง train_model)")
+
+    # ต้องเป็นโมเดลที่ทำนายครบทุกสถานีทุกชั่วโมงล่วงหน้าตามลำดับเดียวกับ _target_columns
+    # (โมเดลรุ่นเก่าที่มี output เดียว จะให้ผลแค่ชั่วโมงเดียวหรือ reshape ไม่ได้) ไม่ใช้แทนแบบเงียบ ๆ
+    if not _supports_all_outputs(model, metadata):
+        print(f"⚠️ Model {metadata.get('version')} has {model.n_outputs} output(s), "
+              f"expected {len(TARGET_STATIONS) * len(FORECAST_HORIZONS)}. Run train_model.")
+        return _failed("โมเดลปัจจุบันไม่รองรับการคาดการณ์ทุกสถานีทุกชั่วโมง (กรุณารันคำสั่ง train_model)")
 
     # 2. Fetch Data
     now = timezone.now()
     start_time = now - timedelta(hours=12)
     
-    qs = WaterLevels.objects.filter(
-        station__station_id__in=STATIONS_FOR_FEATURES,
-        recorded_at__gte=start_time
-    ).values('recorded_at', 'station__station_id', 'water_level')
-
-    if not qs.exists():
-        return None, None, "ไม่พบข้อมูลล่าสุด"
+    # อ่านค่ารายชั่วโมงที่รวมไว้แล้ว (ไม่เกิน 13 แถวต่อสถานี) แทนข้อมูลดิบทุก 10-15 นาที
+    records = [
+        (hour, station_id, level_sum / reading_count)
+        for hour, station_id, level_sum, reading_count in HourlyWaterLevel.objects.filter(
+            station_id__in=STATIONS_FOR_FEATURES,
+            hour__gte=HourlyWaterLevel.floor_hour(start_time)
+        ).values_list('hour', 'station_id', 'level_sum', 'reading_count')
+    ]
 
-    # 3. Prepare Data
-    df_raw = pd.DataFrame(qs)
-    df_processed = _prepare_dataframe(df_raw)
+    if not records:
+        return _failed("ไม่พบข้อมูลล่าสุด")
 
-    if df_processed.empty or not all(f in df_processed.columns for f in FEATURES_TO_USE):
-         return None, None, "ข้อมูลไม่เพียงพอสำหรับทำนาย"
+    # 3. Prepare Data (NumPy fast path)
+    features = _build_feature_vector(records)
 
-    input_vector = df_processed[FEATURES_TO_USE].tail(1)
+    if features is None:
+         return _failed("ข้อมูลไม่เพียงพอสำหรับทำนาย")
 
-    ts16_now = input_vector['TS16'].values[0]
-    ts5_now = input_vector['TS5'].values[0]
+    feature = dict(zip(FEATURES_TO_USE, features))
+    ts16_now = feature['TS16']
+    ts5_now = feature['TS5']
 
     # ====================================================
     # HYBRID SYSTEM: RULE-BASED CHECKS (UPDATED)
@@ -119,8 +562,8 @@ def load_and_predict():
     is_critical_logic = False
 
     # Check 1: Flash Flood (น้ำเหนือหลากเร็ว)
-    ts2_now = input_vector['TS2'].values[0]
-    ts2_prev = input_vector['TS2_lag1h'].values[0]
+    ts2_now = feature['TS2']
+    ts2_prev = feature['TS2_lag1h']
     ts2_rise = ts2_now - ts2_prev
     
     if ts2_rise > ANOMALY_RISE_THRESHOLD:
@@ -134,22 +577,29 @@ def load_and_predict():
     if ts16_now > BACKWATER_LEVEL_TRIGGER and diff < BACKWATER_DIFF_THRESHOLD:
         warnings.append(f"ภาวะน้ำหนุนระบายยาก (Diff {diff:.2f}ม.)")
         is_critical_logic = True
-    
-    # (Optional Debug: ปริ้นดูว่าปัจจุบันรอดเพราะอะไร)
-    print(f"DEBUG: TS16={ts16_now}, Diff={diff}, TriggerLevel={BACKWATER_LEVEL_TRIGGER}")
+
 
     # ====================================================
     # AI PREDICTION
     # ====================================================
     
-    predicted_level = model.predict(input_vector)[0]
-    risk_level, risk_text = evaluate_flood_risk(predicted_level, station_id=TARGET_STATION)
+    # คูณ matrix ครั้งเดียวได้ทุกสถานีทุกชั่วโมงล่วงหน้า
+    levels = model.predict_all(feature).reshape(len(TARGET_STATIONS), len(FORECAST_HORIZONS))
+
+    forecasts = {}
+    for station_id, station_levels in zip(TARGET_STATIONS, levels.tolist()):
+        trajectory = list(zip(FORECAST_HORIZONS, station_levels))
+        predicted_level = dict(trajectory)[PREDICT_HOURS]
+        # แต่ละสถานีใช้เกณฑ์เตือนภัยของตัวเอง
+        risk_level, risk_text = evaluate_flood_risk(predicted_level, station_id=station_id)
+        forecasts[station_id] = (predicted_level, risk_level, risk_text, trajectory)
 
     # ====================================================
     # 🏁 FINAL DECISION
     # ====================================================
     
-    if is_critical_logic:
+    predicted_level, risk_level, risk_text, trajectory = forecasts[TARGET_STATION]
+    if is_critical_logic and predicted_level is not None:
         # ถ้าเจอกฎพิเศษ ให้ Override ข้อความแจ้งเตือน
         warning_msg = " และ ".join(warnings)
         risk_text = f"🟠 เฝ้าระวังพิเศษ! ({warning_msg})"
@@ -157,5 +607,6 @@ def load_and_predict():
         # บังคับยกระดับความเสี่ยงเป็นอย่างน้อย Level 1
         if risk_level == 0:
             risk_level = 1
+        forecasts[TARGET_STATION] = (predicted_level, risk_level, risk_text, trajectory)
             
-    return predicted_level, risk_level, risk_text
\ No newline at end of file
+    return forecasts
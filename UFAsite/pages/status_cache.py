@@ -0,0 +1,102 @@
+# pages/status_cache.py
+
+import threading
+import time
+from functools import lru_cache
+
+from django.utils import timezone
+from linebot.v3.messaging import FlexContainer, FlexMessage
+
+from .models import LatestWaterLevel
+from .risk_calculator import STATION_THRESHOLDS
+from .utils import get_emergency_flex_message
+
+# --- Constants ---
+# ข้อความสถานะเปลี่ยนเฉพาะตอนมีข้อมูลใหม่ (scrape_data สั่ง refresh ทันทีหลังบันทึก)
+# อายุนี้มีไว้สำหรับ web process ที่ไม่ได้รัน ingest เอง (INGEST_IN_WEB=0 / GitHub Actions) ให้ตามข้อมูลใหม่ทันภายใน 1 นาที
+STATUS_CACHE_MAX_AGE = 60
+
+# ปุ่มที่ผู้ใช้กด -> Station ID ใน Database (เช็คตามลำดับ ไม่เจอใช้ TS16)
+# M.5 = TS2 (ศรีสะเกษ), M.7 = TS16 (เมืองอุบล), M.11B = TS5 (ท้ายแก่งสะพือ)
+STATION_ALIASES = [('M.5', 'TS2'), ('M.7', 'TS16'), ('M.11B', 'TS5')]
+DEFAULT_STATION = 'TS16'
+
+RISK_LABELS = {
+    0: "🟢 ปกติ",
+    1: "🟡 เฝ้าระวัง",
+    2: "🔴 วิกฤต"
+}
+
+_cache = {'messages': {}, 'built_at': None}
+_lock = threading.Lock()
+
+
+def resolve_station(station_code):
+    for alias, station_id in STATION_ALIASES:
+        if alias in station_code:
+            return station_id
+    return DEFAULT_STATION
+
+
+def render_status(latest_data):
+    """สร้างข้อความรายงานสถานการณ์น้ำจาก snapshot ค่าล่าสุดของ 1 สถานี"""
+    # ถ้าหาเกณฑ์ไม่เจอ ให้ใช้ของ TS16 เป็นค่า Default
+    thresholds = STATION_THRESHOLDS.get(latest_data.station_id, STATION_THRESHOLDS['TS16'])
+    current_risk = RISK_LABELS.get(latest_data.risk_level, "ไม่ระบุ")
+    time_str = timezone.localtime(latest_data.recorded_at).strftime('%d/%m/%Y %H:%M')
+
+    return (
+        f"🌊 รายงานสถานการณ์น้ำ\n📍 {latest_data.station.station_name}\n"
+        f"🕒 ข้อมูล ณ: {time_str}\n"
+        f"------------------------------\n"
+        f"💧 ระดับน้ำ: {latest_data.water_level} ม.(รทก.)\n"
+        f"⚠️ อยู่ในสถานะ: {current_risk}\n"
+        f"------------------------------\n"
+        f"📢 เกณฑ์การแจ้งเตือน:\n"
+        f"🟡 เฝ้าระวัง: > {thresholds['warn']} ม.\n"
+        f"🔴 วิกฤต: > {thresholds['crit']} ม.\n"
+        f"------------------------------\n"
+        f"ติดตามสถานการณ์อย่างใกล้ชิดนะครับ ☔"
+    )
+
+
+def refresh():
+    """สร้างข้อความของทุกสถานีใหม่ใน query เดียว (เรียกหลัง scrape_data บันทึกข้อมูลใหม่)"""
+    messages = {
+        latest.station_id: render_status(latest)
+        for latest in LatestWaterLevel.objects.select_related('station')
+    }
+    # แทนทั้ง dict ทีเดียว: thread ที่กำลังอ่านจะเห็นชุดเก่าหรือชุดใหม่ทั้งชุด ไม่เห็นครึ่ง ๆ
+    _cache.update(messages=messages, built_at=time.monotonic())
+    return messages
+
+
+def get_status_message(station_code):
+    """
+    ข้อความสถานะน้ำของปุ่มที่ผู้ใช้กด (เช่น "ดู M.7") จาก cache
+    ปกติเป็นแค่การเปิด dict ถ้า cache หมดอายุจะสร้างใหม่ครั้งเดียว (request ที่เข้ามาพร้อมกันรอผลเดียวกัน)
+    """
+    built_at = _cache['built_at']
+    if built_at is None or time.monotonic() - built_at > STATUS_CACHE_MAX_AGE:
+        with _lock:
+            built_at = _cache['built_at']
+            if built_at is None or time.monotonic() - built_at > STATUS_CACHE_MAX_AGE:
+                refresh()
+
+    message = _cache['messages'].get(resolve_station(station_code))
+    if message is None:
+        return f"❌ ขออภัย ยังไม่มีข้อมูลของสถานี {station_code} ในระบบครับ"
+    return message
+
+
+def invalidate():
+    _cache.update(messages={}, built_at=None)
+
+
+@lru_cache(maxsize=None)
+def get_emergency_reply():
+    """Flex Message เบอร์โทรฉุกเฉิน (เนื้อหาคงที่ สร้างและ validate ครั้งเดียวต่อ process)"""
+    return FlexMessage(
+        alt_text="เบอร์โทรฉุกเฉิน",  # ข้อความที่จะขึ้นแจ้งเตือน (Notification)
+        contents=FlexContainer.from_dict(get_emergency_flex_message())
+    )
@@ -1,5 +1,34 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone as datetime_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pages.models import WaterStations, WaterLevels, LatestWaterLevel, HourlyWaterLevel, ForecastSnapshot, ScraperState, IngestLock, AlertOutbox, Users, StationAlertState
 from pages.risk_calculator import evaluate_flood_risk
+from pages import alert_policy, alert_queue, data_loader, ingest, line_client, predictor, model_registry, status_cache, thaiwater, views
+from pages.management.commands import import_historical_data, scrape_data
 
 class RiskCalculatorTest(TestCase):
     """
@@ -87,3 +116,1298 @@ class RiskCalculatorTest(TestCase):
         
         # ต้องใช้เกณฑ์ TS16 ตัดสิน คือเป็น "เฝ้าระวัง"
         self.assertEqual(level, 1, "Unknown Station ต้องใช้เกณฑ์ Default (TS16)")
+
+
+class LatestWaterLevelTest(TestCase):
+    """
+    Test Case สำหรับ snapshot ค่าล่าสุด (LatestWaterLevel.upsert)
+    ค่าใหม่กว่าต้องทับค่าเดิม ส่วนค่าเก่ากว่า (เช่นจากการ backfill) ต้องไม่ทับ
+    """
+
+    def setUp(self):
+        self.station = WaterStations.objects.create(station_id='TS16', station_name='M.7')
+        self.now = timezone.now()
+
+    def test_newer_reading_replaces_snapshot(self):
+        LatestWaterLevel.upsert(self.station, 108.50, 0, self.now - timedelta(hours=1))
+        LatestWaterLevel.upsert(self.station, 110.20, 1, self.now)
+
+        latest = LatestWaterLevel.objects.get(station=self.station)
+        self.assertEqual(float(latest.water_level), 110.20)
+        self.assertEqual(latest.risk_level, 1)
+        self.assertEqual(latest.recorded_at, self.now)
+
+    def test_older_reading_is_ignored(self):
+        LatestWaterLevel.upsert(self.station, 110.20, 1, self.now)
+        LatestWaterLevel.upsert(self.station, 105.00, 0, self.now - timedelta(days=30))
+
+        latest = LatestWaterLevel.objects.get(station=self.station)
+        self.assertEqual(float(latest.water_level), 110.20)
+        self.assertEqual(LatestWaterLevel.objects.count(), 1)
+
+
+class PredictionCacheTest(TestCase):
+    """
+    Test Case สำหรับ cache ผลทำนาย
+    ถามซ้ำโดยข้อมูลไม่เปลี่ยน ต้องคำนวณครั้งเดียว และต้องคำนวณใหม่เมื่อมีข้อมูลเข้ามาใหม่
+    """
+
+    def setUp(self):
+        predictor.invalidate_prediction_cache()
+        self.station = WaterStations.objects.create(station_id='TS16', station_name='M.7')
+        LatestWaterLevel.upsert(self.station, 108.00, 0, timezone.now() - timedelta(minutes=15))
+
+    def test_repeat_requests_served_from_cache(self):
+        with mock.patch.object(predictor, '_predict', return_value={'TS16': (108.5, 0, "ปกติ", [(6, 108.5)])}) as fake_predict:
+            for _ in range(20):
+                self.assertEqual(predictor.load_and_predict(), (108.5, 0, "ปกติ"))
+                self.assertEqual(predictor.load_forecast()[3], [(6, 108.5)])
+        self.assertEqual(fake_predict.call_count, 1)
+
+    def test_new_reading_invalidates_cache(self):
+        with mock.patch.object(predictor, '_predict', return_value={'TS16': (108.5, 0, "ปกติ", [(6, 108.5)])}) as fake_predict:
+            predictor.load_and_predict()
+            LatestWaterLevel.upsert(self.station, 108.20, 0, timezone.now())
+            predictor.load_and_predict()
+        self.assertEqual(fake_predict.call_count, 2)
+
+    def test_failed_prediction_is_not_cached(self):
+        with mock.patch.object(predictor, '_predict', return_value=predictor._failed("ไม่พบข้อมูลล่าสุด")) as fake_predict:
+            predictor.load_and_predict()
+            predictor.load_and_predict()
+        self.assertEqual(fake_predict.call_count, 2)
+
+
+class StatusCacheTest(TestCase):
+    """
+    Test Case สำหรับข้อความสถานะน้ำที่สร้างไว้ล่วงหน้า
+    กดดูซ้ำต้องไม่ query DB และต้องได้ข้อความใหม่ทันทีหลัง scrape_data บันทึกข้อมูล
+    """
+
+    def setUp(self):
+        status_cache.invalidate()
+        self.addCleanup(status_cache.invalidate)
+        for station_id, name in [('TS2', 'M.5'), ('TS16', 'M.7'), ('TS5', 'M.11B')]:
+            WaterStations.objects.create(station_id=station_id, station_name=name)
+        LatestWaterLevel.upsert(WaterStations.objects.get(station_id='TS16'), 108.00, 0, timezone.now() - timedelta(minutes=15))
+
+    def test_repeat_taps_are_served_from_cache(self):
+        first = views.get_latest_water_status('ดู M.7')
+        self.assertIn('108.00', first)
+        self.assertIn('🟢 ปกติ', first)
+        with self.assertNumQueries(0):
+            for _ in range(20):
+                self.assertEqual(views.get_latest_water_status('ดู M.7'), first)
+            self.assertIn('ยังไม่มีข้อมูลของสถานี ดู M.5', views.get_latest_water_status('ดู M.5'))
+
+    def test_ingest_refreshes_messages(self):
+        views.get_latest_water_status('ดู M.7')
+        command = scrape_data.Command(stdout=io.StringIO())
+        command.save_data([('TS16', 110.30, timezone.now()), ('TS2', 115.00, timezone.now())])
+
+        with self.assertNumQueries(0):
+            self.assertIn('110.30', views.get_latest_water_status('ดู M.7'))
+            self.assertIn('115.00', views.get_latest_water_status('ดู M.5'))
+
+    def test_cache_expires_for_processes_without_ingest(self):
+        views.get_latest_water_status('ดู M.7')
+        LatestWaterLevel.upsert(WaterStations.objects.get(station_id='TS16'), 109.50, 1, timezone.now())
+        self.assertIn('108.00', views.get_latest_water_status('ดู M.7'))
+
+        later = time.monotonic() + status_cache.STATUS_CACHE_MAX_AGE + 1
+        with mock.patch('pages.status_cache.time.monotonic', return_value=later):
+            self.assertIn('109.50', views.get_latest_water_status('ดู M.7'))
+
+    def test_emergency_flex_is_built_once(self):
+        self.assertIs(status_cache.get_emergency_reply(), status_cache.get_emergency_reply())
+        self.assertEqual(status_cache.get_emergency_reply().alt_text, "เบอร์โทรฉุกเฉิน")
+
+
+def isolated_model_registry(test):
+    """
+    ให้ model_registry ใช้โฟลเดอร์ชั่วคราวตลอดเทสนี้ (ไม่แตะ model_artifacts จริง) และล้างโมเดลที่โหลดค้างไว้
+    """
+    tmp_dir = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+    for name, value in {
+        'ARTIFACTS_DIR': tmp_dir,
+        'CURRENT_POINTER': os.path.join(tmp_dir, 'CURRENT'),
+        'RELOAD_CHECK_SECONDS': 0,
+    }.items():
+        patcher = mock.patch.object(model_registry, name, value)
+        patcher.start()
+        test.addCleanup(patcher.stop)
+    model_registry._state.update(loaded=None, pointer_mtime=None, checked_at=0.0)
+
+
+class ModelRegistryTest(TestCase):
+    """
+    Test Case สำหรับ model registry: บันทึกหลายเวอร์ชัน, สลับโมเดลอัตโนมัติ และ rollback
+    """
+
+    def setUp(self):
+        isolated_model_registry(self)
+
+    def test_missing_model_raises(self):
+        # ไม่มี CURRENT = แจ้งให้ train ทันที ไม่ unpickle trained_model.joblib แบบเดิม (ต้องใช้ sklearn) ใน web worker
+        with mock.patch('joblib.load', side_effect=AssertionError('must not unpickle')), \
+                self.assertRaisesRegex(FileNotFoundError, 'train_model'):
+            model_registry.get_model()
+        self.assertIsNone(model_registry.current_version())
+
+    def fake_model(self, intercept):
+        return SimpleNamespace(coef_=np.array([1.0, 2.0]), intercept_=intercept)
+
+    def test_new_version_is_swapped_in_and_can_roll_back(self):
+        features = {'a': 1.0, 'b': 1.0}
+        metadata = {'features': ['a', 'b']}
+
+        v1 = model_registry.save_model(self.fake_model(10.0), dict(metadata, row_count=10))
+        self.assertEqual(model_registry.get_model()[0].predict(features), 13.0)
+
+        v2 = model_registry.save_model(self.fake_model(20.0), dict(metadata, row_count=20))
+        self.assertNotEqual(v1, v2)
+        self.assertEqual(model_registry.get_model()[0].predict(features), 23.0)
+
+        model_registry.activate(v1)
+        model, metadata = model_registry.get_model()
+        self.assertEqual(model.predict(features), 13.0)
+        self.assertEqual(metadata['row_count'], 10)
+        self.assertEqual([m['active'] for m in model_registry.list_versions()], [True, False])
+
+    def test_serving_model_matches_sklearn(self):
+        from sklearn.linear_model import LinearRegression
+
+        rng = np.random.default_rng(0)
+        X = rng.normal(110, 2, size=(200, len(predictor.FEATURES_TO_USE)))
+        y = X @ rng.normal(size=X.shape[1]) + 3.0
+
+        estimator = LinearRegression().fit(X, y)
+        model_registry.save_model(estimator, {'features': predictor.FEATURES_TO_USE})
+        model, _ = model_registry.get_model()
+
+        for row in X[:10]:
+            expected = estimator.predict(row.reshape(1, -1))[0]
+            self.assertAlmostEqual(model.predict(dict(zip(predictor.FEATURES_TO_USE, row))), expected, places=9)
+
+    def test_multi_output_model_and_old_single_output_versions(self):
+        from sklearn.linear_model import LinearRegression
+
+        rng = np.random.default_rng(1)
+        X = rng.normal(110, 2, size=(200, 3))
+        Y = X @ rng.normal(size=(3, 4)) + [1.0, 2.0, 3.0, 4.0]
+        features = ['a', 'b', 'c']
+
+        model_registry.save_model(LinearRegression().fit(X, Y[:, 0]), {'features': features})
+        old_model = model_registry.get_model()[0]
+        self.assertEqual(old_model.n_outputs, 1)
+        self.assertEqual(old_model.predict_all(dict(zip(features, X[0]))).shape, (1,))
+
+        estimator = LinearRegression().fit(X, Y)
+        model_registry.save_model(estimator, {'features': features, 'horizons': [1, 2, 3, 4]})
+        model = model_registry.get_model()[0]
+        self.assertEqual(model.n_outputs, 4)
+        np.testing.assert_allclose(model.predict_all(dict(zip(features, X[0]))), estimator.predict(X[:1])[0], rtol=1e-12)
+
+
+class IncrementalTrainingTest(TestCase):
+    """
+    Test Case สำหรับการ train แบบ incremental (OLSState)
+    เพิ่มเฉพาะข้อมูลใหม่แล้วต้องได้ coef เท่ากับ train ใหม่ทั้งหมด
+    """
+
+    def setUp(self):
+        isolated_model_registry(self)
+        self.stations = {
+            station_id: WaterStations.objects.create(station_id=station_id, station_name=station_id)
+            for station_id in predictor.STATIONS_FOR_FEATURES
+        }
+
+    def add_readings(self, start, end, seed):
+        rng = random.Random(seed)
+        base = {'TS2': 115.0, 'TS16': 108.0, 'TS5': 106.0}
+        rows = []
+        for i, (station_id, level) in enumerate(base.items()):
+            t = start + timedelta(minutes=rng.randint(0, 20))
+            while t < end:
+                hours = t.timestamp() / 3600
+                value = level + np.sin(hours / (9 + i)) + 0.3 * np.sin(hours / 2.7) + rng.uniform(-0.05, 0.05)
+                rows.append(WaterLevels(station=self.stations[station_id], water_level=Decimal(f'{value:.2f}'), recorded_at=t))
+                # บางช่วงขาดหายไปหลายชั่วโมง (ต้อง interpolate)
+                t += timedelta(minutes=rng.choice([10, 15, 20])) if rng.random() > 0.01 else timedelta(hours=5)
+        WaterLevels.objects.bulk_create(rows)
+        HourlyWaterLevel.refresh(list(self.stations), start, end)
+
+    def serving(self, version):
+        return next(m['serving'] for m in model_registry.list_versions() if m['version'] == version)
+
+    def test_incremental_matches_full_refit(self):
+        start = datetime(2025, 9, 1, tzinfo=timezone.get_current_timezone())
+        self.add_readings(start, start + timedelta(days=6), seed=1)
+        self.assertIsNotNone(predictor.train_and_save_model())
+
+        self.add_readings(start + timedelta(days=6), start + timedelta(days=9), seed=2)
+        incremental = predictor.train_incremental()
+        self.assertIsNone(predictor.train_incremental())  # ไม่มีข้อมูลใหม่ = ไม่สร้างเวอร์ชันใหม่
+        full = predictor.train_and_save_model()
+
+        inc_meta = next(m for m in model_registry.list_versions() if m['version'] == incremental)
+        full_meta = next(m for m in model_registry.list_versions() if m['version'] == full)
+        self.assertEqual(inc_meta['training'], 'incremental')
+        self.assertEqual((inc_meta['row_count'], inc_meta['train_end']), (full_meta['row_count'], full_meta['train_end']))
+        np.testing.assert_allclose(self.serving(incremental)['coef'], self.serving(full)['coef'], rtol=1e-7, atol=1e-9)
+        np.testing.assert_allclose(self.serving(incremental)['intercept'], self.serving(full)['intercept'], atol=1e-7)
+
+    def test_ill_conditioned_state_falls_back_to_full_training(self):
+        # lag 1-3 ชม. ของข้อมูลจริงเกือบเป็นเส้นตรงเดียวกัน: ยังแก้ได้แม่นยำ แต่ถ้า feature ซ้ำกันจริงต้องไม่แก้จาก XᵀX
+        rng = np.random.default_rng(2)
+        X = rng.normal(110, 1, size=(50, 3))
+        ols = predictor.OLSState(4)
+        ols.update(np.column_stack([X, X[:, 0] + 1e-9 * rng.normal(size=50)]), X.sum(axis=1))
+        with self.assertRaises(np.linalg.LinAlgError):
+            ols.solve()
+
+        start = datetime(2025, 9, 1, tzinfo=timezone.get_current_timezone())
+        self.add_readings(start, start + timedelta(days=6), seed=1)
+        predictor.train_and_save_model()
+        self.add_readings(start + timedelta(days=6), start + timedelta(days=8), seed=2)
+        with mock.patch.object(predictor, 'MAX_NORMAL_EQUATIONS_COND', 1.0):
+            version = predictor.train_incremental()
+        self.assertEqual(model_registry.get_model()[1]['version'], version)
+        self.assertEqual(model_registry.get_model()[1]['training'], 'full')
+
+    def test_one_fit_matches_separate_fit_per_station_and_horizon(self):
+        from sklearn.linear_model import LinearRegression
+
+        start = datetime(2025, 9, 1, tzinfo=timezone.get_current_timezone())
+        self.add_readings(start, start + timedelta(days=5), seed=4)
+        predictor.train_and_save_model()
+        model, metadata = model_registry.get_model()
+        self.assertEqual(metadata['horizons'], predictor.FORECAST_HORIZONS)
+        self.assertEqual(metadata['target_stations'], predictor.TARGET_STATIONS)
+        self.assertEqual(list(metadata['mae_by_station']), predictor.TARGET_STATIONS)
+
+        df = predictor._training_rows(data_loader.load_hourly_frame(predictor.STATIONS_FOR_FEATURES))
+        for i, column in enumerate(predictor._target_columns()):
+            single = LinearRegression().fit(df[predictor.FEATURES_TO_USE], df[column])
+            np.testing.assert_allclose(model.coef[i], single.coef_, rtol=1e-6, atol=1e-8)
+            self.assertAlmostEqual(float(model.intercept[i]), single.intercept_, places=6)
+
+    def test_forecast_returns_whole_trajectory(self):
+        now = timezone.now()
+        self.add_readings(now - timedelta(days=4), now, seed=5)
+        predictor.train_and_save_model()
+        predictor.invalidate_prediction_cache()
+        self.addCleanup(predictor.invalidate_prediction_cache)
+
+        predicted_level, risk_level, risk_text, trajectory = predictor.load_forecast()
+        self.assertEqual([hours for hours, _ in trajectory], predictor.FORECAST_HORIZONS)
+        self.assertEqual(dict(trajectory)[predictor.PREDICT_HOURS], predicted_level)
+        self.assertEqual(predictor.load_and_predict(), (predicted_level, risk_level, risk_text))
+        self.assertIn('+24 ชม.', views.format_forecast_lines(trajectory))
+
+    def test_every_station_is_forecast_with_its_own_thresholds(self):
+        now = timezone.now()
+        self.add_readings(now - timedelta(days=4), now, seed=6)
+        predictor.train_and_save_model()
+        predictor.invalidate_prediction_cache()
+        self.addCleanup(predictor.invalidate_prediction_cache)
+
+        # ข้อมูลดิบอ่านครั้งเดียว และคูณ matrix ครั้งเดียวสำหรับทุกสถานี
+        with mock.patch.object(model_registry.LinearModel, 'predict_all', autospec=True,
+                               side_effect=model_registry.LinearModel.predict_all) as predict_all:
+            forecasts = predictor.load_forecasts()
+        self.assertEqual(predict_all.call_count, 1)
+        self.assertEqual(list(forecasts), predictor.TARGET_STATIONS)
+
+        for station_id, (level, risk_level, risk_text, trajectory) in forecasts.items():
+            self.assertEqual(len(trajectory), len(predictor.FORECAST_HORIZONS))
+            if station_id != predictor.TARGET_STATION:
+                self.assertEqual((risk_level, risk_text), evaluate_flood_risk(level, station_id=station_id))
+        # TS2 ~115 ม. ต่ำกว่าเกณฑ์ของตัวเอง (119) แต่เกินเกณฑ์ของ TS16 (110)
+        self.assertEqual(forecasts['TS2'][1], 0)
+        self.assertIn('M.5', views.format_other_stations(forecasts))
+
+    def test_dashboard_serves_forecast_snapshot_without_predicting(self):
+        now = timezone.now()
+        self.add_readings(now - timedelta(days=4), now - timedelta(minutes=30), seed=8)
+        predictor.train_and_save_model()
+        self.addCleanup(predictor.invalidate_prediction_cache)
+
+        # scrape_data บันทึกข้อมูลใหม่แล้วทำนายเก็บไว้ใน ForecastSnapshot
+        scrape_data.Command(stdout=io.StringIO()).save_data([('TS16', 108.4, now), ('TS2', 115.1, now), ('TS5', 106.2, now)])
+        self.assertEqual(sorted(ForecastSnapshot.objects.values_list('station_id', flat=True)), sorted(predictor.TARGET_STATIONS))
+
+        with mock.patch.object(predictor, '_predict', side_effect=AssertionError('render must not predict')), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ล่วงหน้า 24 ชั่วโมง', response.content.decode())
+        # อ่านแค่ snapshot ค่าล่าสุด + snapshot ผลคาดการณ์ ไม่แตะตารางประวัติ
+        self.assertEqual(len(queries), 2)
+        self.assertFalse([q for q in queries if 'FROM "hourly_water_levels"' in q['sql'] or 'FROM "water_levels"' in q['sql']])
+
+        # snapshot เก่าเกินไป (ingest หยุด) ไม่แสดง
+        ForecastSnapshot.objects.update(computed_at=now - timedelta(hours=3))
+        self.assertEqual(views.get_forecast_charts(), {})
+
+    def test_single_output_version_is_refused(self):
+        from sklearn.linear_model import LinearRegression
+
+        now = timezone.now()
+        self.add_readings(now - timedelta(hours=12), now, seed=7)
+        X = np.eye(len(predictor.FEATURES_TO_USE))
+        # โมเดลรุ่นเก่า (output เดียว) และโมเดลที่ metadata บอกครบแต่ output ไม่ครบ: ต้องไม่ทำนายแค่ชั่วโมงเดียว และไม่ reshape พัง
+        for metadata in [
+            {'features': predictor.FEATURES_TO_USE, 'target_station': 'TS16', 'predict_hours': 6},
+            {'features': predictor.FEATURES_TO_USE, 'target_stations': predictor.TARGET_STATIONS, 'horizons': predictor.FORECAST_HORIZONS},
+        ]:
+            model_registry.save_model(LinearRegression().fit(X, np.full(len(X), 108.0)), metadata)
+            forecasts = predictor._predict()
+            self.assertEqual(list(forecasts), predictor.TARGET_STATIONS)
+            for level, risk_level, risk_text, trajectory in forecasts.values():
+                self.assertIsNone(level)
+                self.assertIn('train_model', risk_text)
+
+    def test_incremental_after_rollback_continues_from_rolled_back_version(self):
+        start = datetime(2025, 9, 1, tzinfo=timezone.get_current_timezone())
+        self.add_readings(start, start + timedelta(days=6), seed=1)
+        v1 = predictor.train_and_save_model()
+
+        # ช่วงใหม่มีค่าผิด (สูงเกิน 3 ม.) -> v2 ผิด แล้ว rollback กลับไป v1 ก่อนแก้ข้อมูล
+        bad_start, bad_end = start + timedelta(days=6), start + timedelta(days=9)
+        self.add_readings(bad_start, bad_end, seed=2)
+        bad_rows = WaterLevels.objects.filter(recorded_at__gte=bad_start)
+        bad_rows.update(water_level=F('water_level') + 3)
+        HourlyWaterLevel.refresh(list(self.stations), bad_start, bad_end)
+        v2 = predictor.train_incremental()
+        model_registry.activate(v1)
+
+        bad_rows.update(water_level=F('water_level') - 3)
+        HourlyWaterLevel.refresh(list(self.stations), bad_start, bad_end)
+        self.add_readings(bad_end, start + timedelta(days=11), seed=3)
+        v3 = predictor.train_incremental()
+        full = predictor.train_and_save_model()
+
+        meta = {m['version']: m for m in model_registry.list_versions()}
+        self.assertEqual([meta[v]['training'] for v in (v1, v2, v3)], ['full', 'incremental', 'incremental'])
+        self.assertEqual(meta[v3]['row_count'], meta[full]['row_count'])
+        # ต่อจากสถานะของ v1 กับข้อมูลที่แก้แล้ว ไม่ใช่สถานะของ v2 ที่มีค่าผิด
+        np.testing.assert_allclose(self.serving(v3)['coef'], self.serving(full)['coef'], rtol=1e-6, atol=1e-8)
+        self.assertGreater(np.abs(np.subtract(self.serving(v2)['intercept'], self.serving(full)['intercept'])).max(), 0.1)
+
+    def test_without_state_falls_back_to_full_training(self):
+        start = datetime(2025, 9, 1, tzinfo=timezone.get_current_timezone())
+        self.add_readings(start, start + timedelta(days=3), seed=3)
+        version = predictor.train_incremental()
+        self.assertEqual(model_registry.get_model()[1]['version'], version)
+        self.assertEqual(model_registry.get_model()[1]['training'], 'full')
+        self.assertIsNotNone(model_registry.load_training_state())
+
+
+class FeatureVectorParityTest(TestCase):
+    """
+    Test Case เทียบ NumPy fast path (_build_feature_vector) กับ pandas path (_prepare_dataframe)
+    ต้องได้ค่า feature ของแถวสุดท้ายเท่ากัน ทั้งกรณีข้อมูลครบ ข้อมูลขาดช่วง และข้อมูลไม่พอ
+    """
+
+    def make_records(self, seed, hours=12, drop_ratio=0.0):
+        rng = random.Random(seed)
+        end = timezone.now().replace(second=0, microsecond=0)
+        base = {'TS2': 115.0, 'TS16': 108.0, 'TS5': 106.0}
+        records = []
+        for station, level in base.items():
+            t = end - timedelta(hours=hours)
+            while t <= end:
+                if rng.random() >= drop_ratio:
+                    records.append((t, station, Decimal(f"{level + rng.uniform(-1, 1):.2f}")))
+                t += timedelta(minutes=rng.choice([5, 10, 15]))
+        rng.shuffle(records)
+        return records
+
+    def pandas_features(self, records):
+        df_raw = pd.DataFrame(records, columns=['recorded_at', 'station__station_id', 'water_level'])
+        df = predictor._prepare_dataframe(df_raw)
+        if df.empty:
+            return None
+        return df[predictor.FEATURES_TO_USE].tail(1).values[0]
+
+    def assert_parity(self, records):
+        expected = self.pandas_features(records)
+        actual = predictor._build_feature_vector(records)
+        if expected is None:
+            self.assertIsNone(actual)
+        else:
+            np.testing.assert_allclose(actual, expected, rtol=0, atol=1e-9)
+
+    def test_full_window(self):
+        for seed in range(5):
+            self.assert_parity(self.make_records(seed))
+
+    def test_window_with_gaps(self):
+        # ข้อมูลหายเป็นช่วง ๆ (ต้อง interpolate ระหว่างชั่วโมง และเติมค่าที่ขอบ)
+        for seed in range(5):
+            self.assert_parity(self.make_records(seed, drop_ratio=0.6))
+
+    def test_station_missing_or_window_too_short(self):
+        records = [r for r in self.make_records(1) if r[1] != 'TS5']
+        self.assertIsNone(predictor._build_feature_vector(records))
+        self.assert_parity(records)
+
+        self.assert_parity(self.make_records(2, hours=2))
+
+
+class HourlyLoaderTest(TestCase):
+    """
+    Test Case สำหรับ data_loader (อ่านทีละหน้าแล้วเฉลี่ยรายชั่วโมงลง NumPy)
+    ต้องได้ตารางเดียวกับ pivot_table + resample('h').mean() ของ pandas ไม่ว่าจะแบ่งก้อนขนาดเท่าไร
+    """
+
+    def setUp(self):
+        rng = random.Random(7)
+        stations = {s: WaterStations.objects.create(station_id=s, station_name=s) for s in ['TS2', 'TS16', 'TS5', 'OTHER']}
+        start = datetime(2025, 9, 1, 0, 7, tzinfo=timezone.get_current_timezone())
+        rows = []
+        for station_id, station in stations.items():
+            t = start + timedelta(minutes=rng.randint(0, 30))
+            while t < start + timedelta(days=2):
+                rows.append(WaterLevels(station=station, water_level=Decimal(f'{rng.uniform(100, 115):.2f}'), recorded_at=t))
+                t += timedelta(minutes=rng.choice([10, 15])) if rng.random() > 0.02 else timedelta(hours=4)
+        WaterLevels.objects.bulk_create(rows)
+        WaterLevels.objects.create(station=stations['TS16'], water_level=None, recorded_at=start + timedelta(days=3))
+
+    def pandas_hourly(self):
+        qs = WaterLevels.objects.filter(station_id__in=predictor.STATIONS_FOR_FEATURES)
+        df_raw = pd.DataFrame(qs.values('recorded_at', 'station__station_id', 'water_level'))
+        df_raw['water_level'] = pd.to_numeric(df_raw['water_level'], errors='coerce')
+        df_raw.dropna(subset=['water_level'], inplace=True)
+        df = df_raw.pivot_table(index='recorded_at', columns='station__station_id', values='water_level')
+        return df.resample('h').mean()[predictor.STATIONS_FOR_FEATURES]
+
+    def test_matches_pandas_resample_for_any_chunk_size(self):
+        expected = self.pandas_hourly()
+        HourlyWaterLevel.rebuild()
+        for source in data_loader.SOURCES:
+            for chunk_size in [1, 37, 100000]:
+                actual = data_loader.load_hourly_frame(predictor.STATIONS_FOR_FEATURES, chunk_size=chunk_size, source=source)
+                pd.testing.assert_frame_equal(actual, expected, check_freq=False, check_names=False, atol=1e-9, rtol=0)
+
+    def test_pages_each_station_separately(self):
+        # หน้าละ 1 สถานีเรียงตามเวลา (ช่วงบน index station+เวลา) ข้ามขอบหน้าแล้วต้องไม่ข้ามหรือนับซ้ำแถวใด
+        t = datetime(2025, 10, 1, 5, 0, tzinfo=datetime_timezone.utc)
+        counts = {'PAGE1': 7, 'PAGE2': 3}
+        for station_id, n in counts.items():
+            station = WaterStations.objects.create(station_id=station_id, station_name=station_id)
+            WaterLevels.objects.bulk_create([
+                WaterLevels(station=station, water_level=level, recorded_at=t + timedelta(minutes=level))
+                for level in range(1, n + 1)
+            ])
+        for chunk_size in [1, 2, 3, 7]:
+            with CaptureQueriesContext(connection) as queries:
+                hours, levels = data_loader.load_hourly_levels(list(counts), chunk_size=chunk_size, source='raw')
+            self.assertEqual(levels.tolist(), [[4.0, 2.0]])
+            # aggregate 1 ครั้ง + หน้าละ 1 query ต่อสถานี (หน้าสุดท้ายที่ไม่เต็มก็จบเลย)
+            self.assertEqual(len(queries), 1 + sum(n // chunk_size + 1 for n in counts.values()))
+            for query in queries[1:]:
+                self.assertNotIn(' IN (', query['sql'])
+
+    def test_time_window_and_empty_result(self):
+        start = datetime(2025, 9, 2, tzinfo=timezone.get_current_timezone())
+        hours, levels = data_loader.load_hourly_levels(['TS16'], start=start, end=start + timedelta(hours=6), source='raw')
+        self.assertEqual(levels.shape, (len(hours), 1))
+        self.assertLessEqual(len(hours), 6)
+        self.assertGreaterEqual(hours[0], np.datetime64(start.astimezone(datetime_timezone.utc).replace(tzinfo=None), 's'))
+
+        hours, levels = data_loader.load_hourly_levels(['NONE'])
+        self.assertEqual((len(hours), levels.shape), (0, (0, 1)))
+
+
+class HourlyFeatureStoreTest(TestCase):
+    """
+    Test Case สำหรับตารางรายชั่วโมง (HourlyWaterLevel)
+    ingest / import ย้อนหลังต้องอัปเดตชั่วโมงที่มีค่าใหม่ให้ตรงกับการคำนวณจากข้อมูลดิบทั้งหมด
+    """
+
+    def setUp(self):
+        for station_id in predictor.STATIONS_FOR_FEATURES:
+            WaterStations.objects.create(station_id=station_id, station_name=station_id)
+
+    def stored(self):
+        return {
+            (h.station_id, h.hour): (h.level_sum, h.reading_count)
+            for h in HourlyWaterLevel.objects.all()
+        }
+
+    def expected(self):
+        return {
+            (g['station_id'], g['hour']): (g['level_sum'], g['reading_count'])
+            for g in HourlyWaterLevel.aggregate(WaterLevels.objects.all())
+        }
+
+    def test_ingest_and_import_keep_hours_in_sync(self):
+        command = scrape_data.Command(stdout=io.StringIO())
+        hour = HourlyWaterLevel.floor_hour(timezone.now()) - timedelta(hours=3)
+        command.save_data([('TS16', 108.10, hour + timedelta(minutes=5)), ('TS2', 115.00, hour + timedelta(minutes=5))])
+        command.save_data([('TS16', 108.30, hour + timedelta(minutes=50))])  # ชั่วโมงเดิม: ต้องรวมค่าใหม่เข้าไป
+        command.save_data([('TS16', 108.60, hour + timedelta(minutes=65))])
+
+        self.assertEqual(HourlyWaterLevel.objects.get(station_id='TS16', hour=hour).water_level, 108.2)
+        self.assertEqual(self.stored(), self.expected())
+
+        importer = import_historical_data.Command()
+        tz = timezone.get_current_timezone()
+        points = importer.parse_graph_data({'data': {'graph_data': [
+            {'datetime': '2025-01-01 07:00', 'value': 108.1},
+            {'datetime': '2025-01-01 07:40', 'value': 108.4},
+            {'datetime': '2025-01-01 08:20', 'value': 108.9},
+        ]}}, tz)
+        importer.write_batch(WaterStations.objects.get(station_id='TS5'), points)
+        self.assertEqual(self.stored(), self.expected())
+        self.assertEqual(HourlyWaterLevel.objects.filter(station_id='TS5').count(), 2)
+
+    def test_rebuild_drops_hours_without_readings(self):
+        station = WaterStations.objects.get(station_id='TS16')
+        start = HourlyWaterLevel.floor_hour(timezone.now()) - timedelta(days=1)
+        WaterLevels.objects.bulk_create([
+            WaterLevels(station=station, water_level=Decimal('108.00') + i, recorded_at=start + timedelta(minutes=30 * i))
+            for i in range(4)
+        ])
+        call_command('rebuild_hourly_levels', stdout=io.StringIO())
+        self.assertEqual(HourlyWaterLevel.objects.count(), 2)
+
+        WaterLevels.objects.filter(recorded_at__gte=start + timedelta(hours=1)).delete()
+        HourlyWaterLevel.rebuild(station_ids=['TS16'])
+        self.assertEqual(self.stored(), self.expected())
+        self.assertEqual(HourlyWaterLevel.objects.count(), 1)
+
+
+    def test_small_windows_cover_every_hour(self):
+        # อ่านผล GROUP BY ทีละช่วงเวลา (ไม่ใช่ .iterator() ทั้งตาราง) ต้องได้ครบทุกชั่วโมง ไม่ซ้ำ ไม่ตกหล่น
+        rng = random.Random(3)
+        start = datetime(2025, 9, 1, 0, 10, tzinfo=datetime_timezone.utc)
+        WaterLevels.objects.bulk_create([
+            WaterLevels(station_id=station_id, water_level=Decimal(f'{rng.uniform(100, 115):.2f}'),
+                        recorded_at=start + timedelta(minutes=20 * i + rng.randint(0, 5)))
+            for station_id in predictor.STATIONS_FOR_FEATURES
+            for i in range(0, 200, rng.choice([1, 1, 7]))
+        ])
+        end = start + timedelta(minutes=20 * 200)
+
+        HourlyWaterLevel.refresh(predictor.STATIONS_FOR_FEATURES, start, end, batch_size=4)
+        self.assertEqual(self.stored(), self.expected())
+
+        HourlyWaterLevel.objects.all().delete()
+        with CaptureQueriesContext(connection) as queries:
+            HourlyWaterLevel.rebuild(batch_size=3)
+        self.assertEqual(self.stored(), self.expected())
+        self.assertFalse([q for q in queries if 'GROUP BY' in q['sql'] and 'recorded_at" <' not in q['sql'] and 'MIN(' not in q['sql']])
+
+
+class HistoricalImportBatchTest(TestCase):
+    """
+    Test Case สำหรับการ import ข้อมูลย้อนหลังแบบ bulk
+    import ซ้ำต้องไม่เกิดข้อมูลซ้ำ และ snapshot ค่าล่าสุดต้องถูกอัปเดต
+    """
+
+    def test_write_batch_is_idempotent(self):
+        station = WaterStations.objects.create(station_id='TS16', station_name='M.7')
+        command = import_historical_data.Command()
+        data = {'data': {'graph_data': [
+            {'datetime': '2025-01-01 07:00', 'value': 108.1},
+            {'datetime': '2025-01-01 07:15:00', 'value': 108.2},
+            {'datetime': '2025-01-01 07:30', 'value': None},
+            {'datetime': '2025-01-01 07:45', 'value': 112.4},
+        ]}}
+        points = command.parse_graph_data(data, timezone.get_current_timezone())
+
+        self.assertEqual(command.write_batch(station, points), 3)
+        self.assertEqual(command.write_batch(station, points), 0)
+        self.assertEqual(WaterLevels.objects.filter(station=station).count(), 3)
+
+        latest = LatestWaterLevel.objects.get(station=station)
+        self.assertEqual(float(latest.water_level), 112.4)
+        self.assertEqual(latest.risk_level, 2)
+
+
+class StubHTTPServer:
+    """
+    HTTP server จำลองสำหรับเทส (รันใน thread แยก บน localhost)
+    handler(method, path, query, body) -> (status, dict ที่จะส่งกลับเป็น JSON) หรือ (status, dict, headers)
+    header ของแต่ละ request เก็บไว้ใน self.headers
+    """
+
+    def __init__(self, handler):
+        self.requests = []
+        self.headers = []
+        stub = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def _respond(self):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                stub.requests.append((self.command, parsed.path, parse_qs(parsed.query), body))
+                stub.headers.append(dict(self.headers))
+                status, payload, *extra = handler(self.command, parsed.path, parse_qs(parsed.query), body)
+                data = json.dumps(payload).encode('utf-8') if status != 304 else b''
+                self.send_response(status)
+                for name, value in (extra[0] if extra else {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ConcurrentHistoricalImportTest(TestCase):
+    """
+    Test Case สำหรับการดึงข้อมูลย้อนหลังหลายเดือนพร้อมกัน (กับ server จำลอง)
+    ต้องลองใหม่เมื่อ server error และรันซ้ำต้องข้ามเดือนที่ import สำเร็จแล้ว
+    """
+
+    def setUp(self):
+        self.failures_left = {'2025-02-01': 1}
+
+        def handler(method, path, query, body):
+            start = query['start_date'][0]
+            if self.failures_left.get(start):
+                self.failures_left[start] -= 1
+                return 500, {'error': 'temporary'}
+            day = start[:8] + '15'
+            return 200, {'data': {'graph_data': [
+                {'datetime': f'{day} 07:00', 'value': 108.1},
+                {'datetime': f'{day} 08:00:00', 'value': 108.3},
+            ]}}
+
+        self.server = StubHTTPServer(handler)
+        self.addCleanup(self.server.close)
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir, ignore_errors=True)
+        self.progress_file = os.path.join(tmp_dir, 'progress.json')
+
+        patcher = mock.patch('pages.thaiwater.time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def run_import(self):
+        call_command(
+            'import_historical_data', station_id='TS16', api_id='2752',
+            start='2025-01-01', end='2025-03-31', workers=3,
+            base_url=self.server.url, progress_file=self.progress_file, stdout=io.StringIO(),
+        )
+
+    def test_retry_and_resume(self):
+        self.run_import()
+        self.assertEqual(WaterLevels.objects.filter(station_id='TS16').count(), 6)
+        self.assertEqual(len(self.server.requests), 4)  # 3 เดือน + ลองใหม่ 1 ครั้ง
+
+        self.run_import()
+        self.assertEqual(len(self.server.requests), 4)  # ไม่มีการดึงซ้ำ
+        self.assertEqual(WaterLevels.objects.filter(station_id='TS16').count(), 6)
+
+    def test_multiple_stations_in_one_run(self):
+        call_command(
+            'import_historical_data', station=['TS2:2751', 'TS5:2760'],
+            start='2025-01-01', end='2025-01-31', workers=2,
+            base_url=self.server.url, progress_file=self.progress_file, stdout=io.StringIO(),
+        )
+        requested = sorted(query['station_id'][0] for _, _, query, _ in self.server.requests)
+        self.assertEqual(requested, ['2751', '2760'])
+        self.assertEqual(WaterLevels.objects.filter(station_id='TS2').count(), 2)
+        self.assertEqual(WaterLevels.objects.filter(station_id='TS5').count(), 2)
+
+    def test_in_flight_chunks_are_bounded(self):
+        started = []
+
+        def fake_fetch(session, api_id, start, end, *args):
+            started.append(start)
+            return {'month': start}
+
+        jobs = [('2752', month, month) for month in range(40)]
+        with mock.patch.object(thaiwater, 'fetch_waterlevel_graph', side_effect=fake_fetch):
+            results = thaiwater.fetch_chunks_concurrently(None, jobs, workers=3)
+            consumed = 0
+            for _job, data, error in results:
+                consumed += 1
+                self.assertIsNone(error)
+                # ก้อนที่ส่งเข้า pool แล้วแต่ยังไม่ถูกนำไปใช้ ต้องไม่เกิน 2 * workers
+                self.assertLessEqual(len(started) - consumed, 2 * 3)
+        self.assertEqual(sorted(started), list(range(40)))
+
+
+class ScrapeSaveDataTest(TestCase):
+    """
+    Test Case สำหรับการบันทึกข้อมูลของ scrape_data
+    จำนวน query ต้องคงที่ไม่ว่าจะมีกี่สถานี และการแจ้งเตือนต้องถูกส่งหลังบันทึกเสร็จ
+    """
+
+    def setUp(self):
+        for station_id in ['TS2', 'TS16', 'TS5']:
+            WaterStations.objects.create(station_id=station_id, station_name=station_id)
+        self.command = scrape_data.Command(stdout=io.StringIO())
+
+    def count_queries(self, readings):
+        with CaptureQueriesContext(connection) as ctx:
+            self.command.save_data(readings)
+        return len(ctx.captured_queries)
+
+    def test_query_count_does_not_grow_with_stations(self):
+        now = timezone.now()
+        one = self.count_queries([('TS16', 108.0, now - timedelta(minutes=15))])
+        three = self.count_queries([('TS2', 115.0, now), ('TS16', 108.1, now), ('TS5', 106.0, now)])
+        self.assertEqual(one, three)
+        self.assertEqual(WaterLevels.objects.count(), 4)
+        self.assertEqual(LatestWaterLevel.objects.count(), 3)
+        self.assertEqual(float(LatestWaterLevel.objects.get(station_id='TS16').water_level), 108.1)
+
+    def test_alerts_are_queued_not_sent_while_saving(self):
+        now = timezone.now()
+        with mock.patch.object(alert_queue, 'send_multicast_batch') as fake_send:
+            alerts = self.command.save_data([('TS16', 112.5, now), ('TS2', 115.0, now), ('UNKNOWN', 1.0, now)])
+            fake_send.assert_not_called()
+
+        self.assertEqual(len(alerts), 1)
+        self.assertIn('TS16', alerts[0])
+        self.assertEqual(WaterLevels.objects.count(), 2)
+        self.assertEqual(list(AlertOutbox.objects.values_list('message', 'status')), [(alerts[0], AlertOutbox.PENDING)])
+
+    def test_row_lost_to_another_process_has_no_side_effects(self):
+        now = timezone.now()
+        WaterLevels.objects.create(station_id='TS16', water_level=112.5, risk_level=2, recorded_at=now)
+        plan_rows = self.command._plan_rows
+        calls = []
+
+        def plan_before_other_process_committed(readings):
+            # รอบแรก: วางแผนตอนที่อีก process ยังไม่ commit แถวเดียวกัน แล้วมา insert ชนทีหลัง
+            calls.append(readings)
+            if len(calls) > 1:
+                return plan_rows(readings)
+            with transaction.atomic():
+                WaterLevels.objects.filter(station_id='TS16').delete()
+                plan = plan_rows(readings)
+                transaction.set_rollback(True)
+            return plan
+
+        with mock.patch.object(self.command, '_plan_rows', side_effect=plan_before_other_process_committed):
+            alerts = self.command.save_data([('TS16', 112.5, now)])
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(alerts, [])
+        self.assertEqual((self.command.counters['stored'], self.command.counters['unchanged']), (0, 1))
+        self.assertFalse(AlertOutbox.objects.exists())
+        self.assertFalse(StationAlertState.objects.exists())
+        self.assertFalse(LatestWaterLevel.objects.exists())
+
+
+class ScrapeChangeDetectionTest(TestCase):
+    """
+    Test Case สำหรับการตรวจจับข้อมูลใหม่ของ scrape_data (กับ server จำลอง)
+    ใช้เวลาที่วัดจาก API, ข้ามค่าที่บันทึกแล้ว และส่ง ETag ของรอบก่อนไปด้วย
+    """
+
+    def setUp(self):
+        for station_id in ['TS2', 'TS16', 'TS5']:
+            WaterStations.objects.create(station_id=station_id, station_name=station_id)
+        self.observed = {'M.7': '2026-01-10 08:00', 'M.5': '2026-01-10 08:00', 'M.11B': '2026-01-10 08:00'}
+        self.etag = '"v1"'
+        self.not_modified = False
+
+        def handler(method, path, query, body):
+            if self.not_modified:
+                return 304, None
+            items = [
+                {'waterlevel_msl': '108.5', 'waterlevel_datetime': observed, 'station': {'tele_station_oldcode': code}}
+                for code, observed in self.observed.items()
+            ]
+            return 200, {'data': items}, {'ETag': self.etag}
+
+        self.server = StubHTTPServer(handler)
+        self.addCleanup(self.server.close)
+
+    def scrape(self):
+        out = io.StringIO()
+        with mock.patch.object(scrape_data, 'refresh_forecasts'):
+            call_command('scrape_data', base_url=self.server.url, stdout=out)
+        return out.getvalue()
+
+    def test_repeated_cycle_without_new_observation_stores_nothing(self):
+        out = self.scrape()
+        self.assertIn('fetched=3 unchanged=0 stored=3', out)
+        self.assertEqual(
+            WaterLevels.objects.get(station_id='TS16').recorded_at,
+            thaiwater.parse_observation_time('2026-01-10 08:00'),
+        )
+
+        # รอบถัดไป: TS16 มีค่าใหม่ สถานีอื่นยังเป็นค่าเดิม
+        self.observed['M.7'] = '2026-01-10 08:15'
+        out = self.scrape()
+        self.assertIn('fetched=3 unchanged=2 stored=1', out)
+        self.assertEqual(WaterLevels.objects.count(), 4)
+        self.assertEqual(self.server.headers[1].get('If-None-Match'), '"v1"')
+
+    def test_not_modified_response_skips_parsing(self):
+        ScraperState.objects.create(source=scrape_data.SCRAPER_STATE_SOURCE, etag='"v1"')
+        self.not_modified = True
+        out = self.scrape()
+        self.assertIn('not modified', out)
+        self.assertEqual(WaterLevels.objects.count(), 0)
+
+
+class IngestCycleLockTest(TestCase):
+    """
+    Test Case สำหรับล็อกรอบการดึงข้อมูล: ทุก process ที่รันในรอบเดียวกัน ต้องมีแค่ process เดียวที่ได้ทำงาน
+    """
+
+    def at(self, hour, minute):
+        return timezone.make_aware(datetime(2026, 1, 10, hour, minute))
+
+    def test_cycle_boundaries(self):
+        self.assertEqual(ingest.current_cycle(self.at(8, 16)), self.at(8, 2))
+        self.assertEqual(ingest.current_cycle(self.at(8, 17)), self.at(8, 17))
+        self.assertEqual(ingest.current_cycle(self.at(8, 0)), self.at(7, 47))
+
+    def test_only_first_claim_per_cycle_wins(self):
+        self.assertTrue(IngestLock.claim('scrape_data', self.at(8, 2), 'web-1'))
+        self.assertFalse(IngestLock.claim('scrape_data', self.at(8, 2), 'web-2'))
+        self.assertFalse(IngestLock.claim('scrape_data', self.at(7, 47), 'late-runner'))
+        self.assertTrue(IngestLock.claim('scrape_data', self.at(8, 17), 'web-2'))
+        self.assertEqual(IngestLock.objects.get(name='scrape_data').owner, 'web-2')
+
+    def test_scrape_once_per_cycle_skips_second_process(self):
+        with mock.patch.object(scrape_data.thaiwater, 'fetch_waterlevel_items', return_value=([], None, None)) as fetch:
+            call_command('scrape_data', once_per_cycle=True, stdout=io.StringIO())
+            out = io.StringIO()
+            call_command('scrape_data', once_per_cycle=True, stdout=out)
+        self.assertEqual(fetch.call_count, 1)
+        self.assertIn('already scraped', out.getvalue())
+
+
+class AdaptivePollingTest(TestCase):
+    """
+    Test Case สำหรับการปรับความถี่ดึงข้อมูลตามสภาพน้ำ
+    หน้าแล้งดึงห่าง, ใกล้ระดับเฝ้าระวังหรือ TS2 ขึ้นเร็วดึงถี่สุด (15 นาที)
+    """
+
+    def test_interval_follows_river_state(self):
+        dry = {'TS2': 112.0, 'TS16': 105.0, 'TS5': 106.0}
+        self.assertEqual(ingest.polling_interval(dry, 0.0)[0], ingest.POLL_IDLE_MINUTES)
+        self.assertEqual(ingest.polling_interval(dict(dry, TS16=108.5), 0.0)[0], ingest.POLL_WATCH_MINUTES)
+        self.assertEqual(ingest.polling_interval(dict(dry, TS16=109.5), 0.0)[0], ingest.POLL_FLOOD_MINUTES)
+        self.assertEqual(ingest.polling_interval(dry, 0.3)[0], ingest.POLL_FLOOD_MINUTES)
+        self.assertEqual(ingest.polling_interval({}, None)[0], ingest.POLL_FLOOD_MINUTES)
+
+    def test_next_run_follows_last_cycle_of_any_process(self):
+        station = WaterStations.objects.create(station_id='TS16', station_name='TS16')
+        LatestWaterLevel.objects.create(station=station, water_level=105.0, recorded_at=timezone.now())
+        now = timezone.make_aware(datetime(2026, 1, 10, 8, 20))
+        IngestLock.claim(ingest.SCRAPE_LOCK_NAME, timezone.make_aware(datetime(2026, 1, 10, 8, 17)), 'other-worker')
+
+        run_date, minutes, _ = ingest.next_run_time(now)
+        self.assertEqual(minutes, ingest.POLL_IDLE_MINUTES)
+        expected = timezone.make_aware(datetime(2026, 1, 10, 9, 17))
+        self.assertTrue(expected <= run_date <= expected + timedelta(seconds=ingest.JITTER_SECONDS))
+
+        # พลาดรอบไปนานแล้ว -> ดึงทันทีครั้งเดียว
+        run_date, _, _ = ingest.next_run_time(now + timedelta(hours=5))
+        self.assertLessEqual(run_date, now + timedelta(hours=5, seconds=ingest.JITTER_SECONDS))
+
+    def test_adaptive_scrape_skips_when_not_due(self):
+        station = WaterStations.objects.create(station_id='TS16', station_name='TS16')
+        LatestWaterLevel.objects.create(station=station, water_level=105.0, recorded_at=timezone.now())
+        ingest.claim_cycle()
+        out = io.StringIO()
+        with mock.patch.object(scrape_data.thaiwater, 'fetch_waterlevel_items') as fetch:
+            call_command('scrape_data', adaptive=True, once_per_cycle=True, stdout=out)
+        fetch.assert_not_called()
+        self.assertIn('Not due', out.getvalue())
+
+    def test_adaptive_scrape_claims_cycle(self):
+        station = WaterStations.objects.create(station_id='TS16', station_name='TS16')
+        LatestWaterLevel.objects.create(station=station, water_level=105.0, recorded_at=timezone.now())
+        with mock.patch.object(scrape_data.thaiwater, 'fetch_waterlevel_items', return_value=([], None, None)) as fetch:
+            call_command('scrape_data', adaptive=True, stdout=io.StringIO())
+            out = io.StringIO()
+            call_command('scrape_data', adaptive=True, stdout=out)
+        # รอบแรกถูกบันทึกใน IngestLock แม้ไม่ได้ส่ง --once_per_cycle รอบถัดไปจึงยังไม่ถึงกำหนด
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(IngestLock.objects.get(name=ingest.SCRAPE_LOCK_NAME).cycle_at, ingest.current_cycle())
+        self.assertIn('Not due', out.getvalue())
+
+    def test_ts2_rise_per_hour(self):
+        station = WaterStations.objects.create(station_id='TS2', station_name='TS2')
+        now = timezone.now()
+        for minutes, level in [(60, 115.0), (30, 115.2), (0, 115.3)]:
+            WaterLevels.objects.create(station=station, water_level=level, recorded_at=now - timedelta(minutes=minutes))
+        self.assertAlmostEqual(ingest.ts2_rise_per_hour(now), 0.3, places=6)
+
+
+class AlertStateMachineTest(TestCase):
+    """
+    Test Case สำหรับ state machine การแจ้งเตือน
+    แจ้งเฉพาะตอนเข้าสู่วิกฤต, ค่าที่แกว่งรอบเกณฑ์ไม่ทำให้แจ้งซ้ำ, และมี cooldown
+    """
+
+    def replay(self, policy, levels, station_id='TS16'):
+        start = timezone.now()
+        state, last_alert_at, entered_at, sent = alert_policy.NORMAL, None, None, []
+        for i, level in enumerate(levels):
+            at = start + timedelta(minutes=15 * i)
+            new_state, alert = policy.step(state, last_alert_at, level, station_id, at, entered_at=entered_at)
+            if new_state != state:
+                state, entered_at = new_state, at
+            if alert:
+                last_alert_at = at
+                sent.append(i)
+        return sent, state
+
+    def test_hysteresis_and_cooldown(self):
+        policy = alert_policy.AlertPolicy('test', margin=0.10, cooldown=timedelta(hours=6))
+        # TS16: crit 112.00 -> แกว่ง 111.95 ยังวิกฤต, ลงถึง 111.85 ค่อยลดสถานะ, กลับขึ้นภายใน 6 ชม. ไม่แจ้งซ้ำ
+        levels = [111.0, 112.0, 112.3, 111.95, 112.1, 111.85, 112.05]
+        self.assertEqual(self.replay(policy, levels), ([1], alert_policy.CRITICAL))
+
+        # พ้น cooldown แล้ว (ผ่านไป 7 ชม.) แจ้งอีกครั้ง
+        levels = [112.0, 111.5] + [111.5] * 28 + [112.2]
+        self.assertEqual(self.replay(policy, levels)[0], [0, 30])
+
+    def test_suppressed_reentry_alerts_when_cooldown_ends(self):
+        policy = alert_policy.AlertPolicy('test', margin=0.10, cooldown=timedelta(hours=6))
+        # แจ้งที่ 0, ลดสถานะ, กลับเข้าวิกฤตที่ 8 (2 ชม. ยังอยู่ใน cooldown) แล้ววิกฤตค้างไปจนพ้น 6 ชม. -> แจ้งที่ 24 ครั้งเดียว
+        levels = [112.0] + [111.5] * 7 + [112.2] * 30
+        self.assertEqual(self.replay(policy, levels), ([0, 24], alert_policy.CRITICAL))
+
+    def test_save_data_alerts_suppressed_reentry_after_cooldown(self):
+        WaterStations.objects.create(station_id='TS16', station_name='TS16')
+        command = scrape_data.Command(stdout=io.StringIO())
+        now = timezone.now()
+        sent = []
+        # ชม. 0 แจ้ง, ชม. 1 ลดสถานะ, ชม. 2 กลับเข้าวิกฤต (ยังอยู่ใน cooldown), ชม. 7 พ้น cooldown แล้วยังวิกฤต -> แจ้ง
+        for hours, level in [(0, 112.5), (1, 111.5), (2, 112.5), (7, 112.5), (8, 112.5)]:
+            if command.save_data([('TS16', level, now + timedelta(hours=hours))]):
+                sent.append(hours)
+        self.assertEqual(sent, [0, 7])
+
+    def test_old_behaviour_alerts_every_critical_reading(self):
+        policy = alert_policy.AlertPolicy('old', every_reading=True)
+        self.assertEqual(self.replay(policy, [111.0, 112.0, 112.3, 111.95, 112.1])[0], [1, 2, 4])
+
+    def test_save_data_alerts_once_per_crest(self):
+        for station_id in ['TS16', 'TS2']:
+            WaterStations.objects.create(station_id=station_id, station_name=station_id)
+        command = scrape_data.Command(stdout=io.StringIO())
+        now = timezone.now()
+        alerts = [
+            command.save_data([('TS16', level, now + timedelta(minutes=15 * i)), ('TS2', 115.0, now + timedelta(minutes=15 * i))])
+            for i, level in enumerate([111.5, 112.5, 112.6, 112.4])
+        ]
+        self.assertEqual([len(a) for a in alerts], [0, 1, 0, 0])
+        self.assertEqual(AlertOutbox.objects.count(), 1)
+        state = StationAlertState.objects.get(station_id='TS16')
+        self.assertEqual((state.state, state.last_alert_at), (alert_policy.CRITICAL, now + timedelta(minutes=15)))
+
+    def test_replay_command(self):
+        station = WaterStations.objects.create(station_id='TS16', station_name='TS16')
+        now = timezone.now()
+        WaterLevels.objects.bulk_create([
+            WaterLevels(station=station, water_level=level, recorded_at=now + timedelta(minutes=15 * i))
+            for i, level in enumerate([111.0, 112.0, 112.3, 111.95, 112.1])
+        ])
+        out = io.StringIO()
+        call_command('replay_alerts', stdout=out)
+        self.assertRegex(out.getvalue(), r'TS16\s+5 \|\s+3 \|\s+2 \|\s+1')
+
+
+class AlertQueueTest(TestCase):
+    """
+    Test Case สำหรับคิวแจ้งเตือน LINE (กับ LINE API จำลอง)
+    ต้องลองใหม่เมื่อโดน 429/5xx ด้วย retry key เดิม และเลิกส่งเมื่อเจอ error ที่ลองใหม่ไม่ได้
+    """
+
+    def setUp(self):
+        Users.objects.create(line_user_id='U1')
+        Users.objects.create(line_user_id='U2')
+        self.responses = []
+
+        def handler(method, path, query, body):
+            status = self.responses.pop(0) if self.responses else 200
+            if status == 429:
+                return 429, {'message': 'rate limited'}, {'Retry-After': '60'}
+            return status, {} if status == 200 else {'message': 'error'}
+
+        self.server = StubHTTPServer(handler)
+        self.addCleanup(self.server.close)
+
+        settings_override = override_settings(LINE_API_HOST=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        line_client.reset_client()
+        self.addCleanup(line_client.reset_client)
+
+    def test_retries_rate_limit_then_sends(self):
+        self.responses = [429, 503]
+        alert = alert_queue.enqueue_alerts(['🚨 ทดสอบ'])[0]
+
+        self.assertEqual(alert_queue.dispatch_pending(), {'sent': 0, 'pending': 1, 'failed': 0})
+        alert.refresh_from_db()
+        self.assertEqual(alert.attempts, 1)
+        self.assertGreater(alert.next_attempt_at, timezone.now() + timedelta(seconds=50))  # ตาม Retry-After
+        self.assertEqual(alert_queue.dispatch_pending(), {'sent': 0, 'pending': 0, 'failed': 0})  # ยังไม่ถึงเวลา
+
+        later = timezone.now() + timedelta(hours=1)
+        self.assertEqual(alert_queue.dispatch_pending(now=later), {'sent': 0, 'pending': 1, 'failed': 0})
+        self.assertEqual(alert_queue.dispatch_pending(now=later + timedelta(hours=1)), {'sent': 1, 'pending': 0, 'failed': 0})
+
+        alert.refresh_from_db()
+        self.assertEqual((alert.status, alert.attempts, alert.recipient_count), (AlertOutbox.SENT, 3, 2))
+        self.assertEqual(len(self.server.requests), 3)
+        # ลองใหม่ด้วย retry key เดิมของชุด
+        self.assertEqual({h.get('X-Line-Retry-Key') for h in self.server.headers}, {str(uuid.uuid5(alert.retry_key, '0'))})
+        self.assertEqual(json.loads(self.server.requests[0][3])['to'], ['U1', 'U2'])
+
+    def test_fan_out_in_batches_of_500_and_retry_only_failed_batch(self):
+        Users.objects.bulk_create([Users(line_user_id=f'U{i:04d}') for i in range(1199)])
+        Users.objects.filter(line_user_id='U0010').update(is_active=0)
+        rate_limited = {'U0700'}
+        server_lock = threading.Lock()
+
+        def handler(method, path, query, body):
+            to = json.loads(body)['to']
+            with server_lock:
+                hit = rate_limited.intersection(to)
+                rate_limited.difference_update(hit)
+            return (429, {}, {'Retry-After': '1'}) if hit else (200, {})
+
+        self.server.close()
+        self.server = StubHTTPServer(handler)
+        self.addCleanup(self.server.close)
+        with override_settings(LINE_API_HOST=self.server.url):
+            line_client.reset_client()
+            alert = alert_queue.enqueue_alerts(['🚨 ทดสอบ'])[0]
+            self.assertEqual(alert_queue.dispatch_pending()['pending'], 1)
+            self.assertEqual(alert_queue.dispatch_pending(now=timezone.now() + timedelta(minutes=1))['sent'], 1)
+
+        batches = list(alert.batches.order_by('batch_index').values_list('recipient_count', 'status', 'attempts'))
+        self.assertEqual(batches, [(500, 'sent', 1), (500, 'sent', 2), (200, 'sent', 1)])
+        sent_to = [json.loads(body)['to'] for _, _, _, body in self.server.requests]
+        self.assertTrue(all(len(to) <= 500 for to in sent_to))
+        self.assertEqual(len(sent_to), 4)  # 3 ชุด + ส่งซ้ำเฉพาะชุดที่โดน 429
+
+        alert.refresh_from_db()
+        self.assertEqual(alert.recipient_count, 1200)
+        self.assertNotIn('U0010', {user for to in sent_to for user in to})
+
+    def test_batch_without_recipients_is_skipped_not_reported_as_200(self):
+        self.responses = [429]
+        alert = alert_queue.enqueue_alerts(['🚨 ทดสอบ'])[0]
+        self.assertEqual(alert_queue.dispatch_pending()['pending'], 1)
+
+        # ผู้รับในชุดยกเลิกหมดก่อนรอบลองใหม่
+        Users.objects.update(is_active=0)
+        self.assertEqual(alert_queue.dispatch_pending(now=timezone.now() + timedelta(minutes=2))['sent'], 1)
+
+        batch = alert.batches.get()
+        self.assertEqual((batch.status, batch.http_status, batch.recipient_count), ('sent', None, 0))
+        self.assertEqual(batch.error, alert_queue.SKIPPED_NOTE)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_client_error_is_not_retried(self):
+        self.responses = [400]
+        alert = alert_queue.enqueue_alerts(['🚨 ทดสอบ'])[0]
+        self.assertEqual(alert_queue.dispatch_pending(), {'sent': 0, 'pending': 0, 'failed': 1})
+        alert.refresh_from_db()
+        self.assertEqual(alert.status, AlertOutbox.FAILED)
+        self.assertIn('400', alert.last_error)
+
+
+class WebhookTest(TestCase):
+    """
+    Test Case สำหรับ webhook ของ LINE
+    ต้องตรวจลายเซ็นแล้วตอบ 200 ทันที โดยประมวลผล event ใน thread pool
+    """
+
+    def post(self, body, signature=None):
+        if signature is None:
+            digest = hmac.new(settings.LINE_CHANNEL_SECRET.encode('utf-8'), body.encode('utf-8'), hashlib.sha256).digest()
+            signature = base64.b64encode(digest).decode('utf-8')
+        return self.client.post(
+            '/webhook/', data=body, content_type='application/json', secure=True, HTTP_X_LINE_SIGNATURE=signature
+        )
+
+    def test_returns_before_slow_event_finishes(self):
+        release = threading.Event()
+        handled = []
+
+        def slow_handle(body, signature):
+            release.wait(5)
+            handled.append(body)
+
+        futures = []
+        submit = views.line_events.submit
+
+        def tracked_submit(*args):
+            futures.append(submit(*args))
+            return futures[-1]
+
+        body = json.dumps({'destination': 'U0', 'events': []})
+        with mock.patch.object(views.handler, 'handle', side_effect=slow_handle), \
+                mock.patch.object(views.line_events, 'submit', side_effect=tracked_submit):
+            response = self.post(body)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(handled, [])  # ยังไม่เสร็จ แต่ตอบ LINE ไปแล้ว
+
+            release.set()
+            futures[0].result(timeout=5)
+        self.assertEqual(handled, [body])
+
+    def test_full_backlog_returns_503(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        futures = []
+        with mock.patch.object(views.line_events, 'MAX_PENDING_EVENTS', 2):
+            for _ in range(2):
+                futures.append(views.line_events.submit(release.wait, 5))
+            self.assertIsNone(views.line_events.submit(release.wait, 5))
+            self.assertEqual(self.post(json.dumps({'destination': 'U0', 'events': []})).status_code, 503)
+
+            release.set()
+            for future in futures:
+                future.result(timeout=5)
+            # งานเสร็จแล้ว คิวว่าง รับงานใหม่ได้อีก
+            self.assertIsNotNone(views.line_events.submit(lambda: None))
+
+    def test_invalid_signature_is_rejected(self):
+        with mock.patch.object(views.line_events, 'submit') as submit:
+            response = self.post('{"events": []}', signature='invalid')
+        self.assertEqual(response.status_code, 403)
+        submit.assert_not_called()
+
+
+class LineClientTest(TestCase):
+    """
+    Test Case สำหรับ LINE ApiClient ที่ใช้ร่วมกันทั้ง process
+    webhook และตัวส่งแจ้งเตือนต้องได้ client ตัวเดียวกัน (ไม่เปิด connection ใหม่ทุกข้อความ)
+    """
+
+    def setUp(self):
+        reply = {'sentMessages': [{'id': '1', 'quoteToken': 'q'}]}
+        self.server = StubHTTPServer(lambda method, path, query, body: (200, reply))
+        self.addCleanup(self.server.close)
+
+        settings_override = override_settings(LINE_API_HOST=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        line_client.reset_client()
+        self.addCleanup(line_client.reset_client)
+
+    def test_one_client_per_process(self):
+        clients = []
+        threads = [threading.Thread(target=lambda: clients.append(line_client.get_api_client())) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len({id(c) for c in clients}), 1)
+        self.assertIs(line_client.get_api_client(), clients[0])
+
+        # process ลูกหลัง fork ต้องได้ client ของตัวเอง
+        with mock.patch('pages.line_client.os.getpid', return_value=-1):
+            self.assertIsNot(line_client.get_api_client(), clients[0])
+
+    def test_replies_go_through_shared_client(self):
+        event = mock.Mock(reply_token='token')
+        event.source.type = 'user'
+        event.source.user_id = 'U1'
+        event.message.text = 'ยกเลิกการแจ้งเตือน'
+
+        with mock.patch('pages.line_client.ApiClient', wraps=line_client.ApiClient) as api_client:
+            views.handle_message(event)
+            views.handle_message(event)
+        self.assertEqual(api_client.call_count, 1)
+        self.assertEqual([path for _, path, _, _ in self.server.requests], ['/v2/bot/message/reply'] * 2)
+
+
+class StreamingPayloadParserTest(TestCase):
+    """
+    Test Case สำหรับ parser แบบ stream ของ payload public/waterlevel
+    ต้องได้ผลเท่ากับการโหลด JSON ทั้งก้อน แม้ก้อนข้อมูลจะถูกตัดกลางตัวอักษรภาษาไทย
+    """
+
+    def make_items(self):
+        items = []
+        for i, code in enumerate(['X.1', 'M.7', 'X.2', 'M.5', 'X.3', 'M.11B', 'X.4']):
+            items.append({
+                'id': i,
+                'waterlevel_msl': f'{100 + i}.25',
+                'station': {'tele_station_oldcode': code, 'tele_station_name': {'th': 'สถานี [ทดสอบ], "มูล"'}},
+            })
+        items.append({'id': 99, 'waterlevel_msl': None, 'station': None})
+        return items
+
+    def chunked(self, payload, size):
+        raw = json.dumps(payload, ensure_ascii=False, indent=1).encode('utf-8')
+        return [raw[i:i + size] for i in range(0, len(raw), size)]
+
+    def test_stream_matches_full_parse(self):
+        codes = {'M.7', 'M.5', 'M.11B'}
+        items = self.make_items()
+        for payload in [{'result': 'OK', 'data': items}, {'data': {'waterlevel_data': items}}, items]:
+            expected = [i for i in thaiwater.extract_waterlevel_items(payload) if thaiwater.station_code_of(i) in codes]
+            for size in [1, 7, 64, 100000]:
+                actual = list(thaiwater.iter_waterlevel_items(self.chunked(payload, size), codes))
+                self.assertEqual(actual, expected)
+        self.assertEqual([i['id'] for i in expected], [1, 3, 5])
+
+    def test_payload_without_items(self):
+        self.assertEqual(list(thaiwater.iter_waterlevel_items(self.chunked({'result': 'FAIL'}, 5))), [])
+
+    def test_nested_data_key_before_items_is_ignored(self):
+        codes = {'M.7', 'M.5', 'M.11B'}
+        items = self.make_items()
+        decoy = [{'id': 'decoy', 'station': {'tele_station_oldcode': 'M.7'}}]
+        payloads = [
+            {'meta': {'data': decoy, 'note': 'key "data": [ in a string'}, 'error': {'waterlevel_data': decoy}, 'data': items},
+            {'data': {'meta': {'data': decoy}, 'waterlevel_data': items}},
+        ]
+        for payload in payloads:
+            for size in [1, 7, 64, 100000]:
+                actual = list(thaiwater.iter_waterlevel_items(self.chunked(payload, size), codes))
+                self.assertEqual([i['id'] for i in actual], [1, 3, 5])
+
+    def test_truncated_payload_raises(self):
+        chunks = self.chunked({'data': self.make_items()}, 50)[:-3]
+        with self.assertRaises(ValueError):
+            list(thaiwater.iter_waterlevel_items(chunks))
+
+
+class BenchmarkQueriesTest(TestCase):
+    """
+    Test Case สำหรับ benchmark_queries (ข้อมูลจำลองถูก rollback ทิ้ง และต้องรายงาน index ที่ใช้)
+    """
+
+    def test_reports_index_usage(self):
+        from pages.management.commands import benchmark_queries
+
+        indexed = WaterLevels.objects.filter(station_id='TS16').order_by('-recorded_at')[:1].explain()
+        self.assertEqual(benchmark_queries.describe_index_usage(indexed), (True, 'wl_station_recorded_idx'))
+        full_scan = WaterLevels.objects.filter(data_source='benchmark').explain()
+        self.assertEqual(benchmark_queries.describe_index_usage(full_scan), (False, 'full table scan'))
+
+    def test_rejects_empty_dataset(self):
+        from django.core.management.base import CommandError
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark_queries', years=0, stdout=io.StringIO())
@@ -0,0 +1,306 @@
+# pages/thaiwater.py
+
+import codecs
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlencode
+
+import requests
+import urllib3
+from django.utils.timezone import get_current_timezone, make_aware
+from requests.adapters import HTTPAdapter
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+# --- Constants ---
+API_BASE_URL = "https://api-v3.thaiwater.net/api/v1/thaiwater30/public"
+REQUEST_TIMEOUT = 30   # วินาที
+MAX_RETRIES = 3        # จำนวนครั้งที่ลองใหม่ต่อ 1 ก้อนข้อมูล
+RETRY_BACKOFF = 2.0    # วินาที (รอ 2, 4, 8 ... ก่อนลองใหม่)
+STREAM_CHUNK_SIZE = 64 * 1024  # ขนาดก้อนที่อ่านจาก response ตอน stream (bytes)
+
+# path ของ list สถานีใน payload: {"data": [...]} หรือ {"data": {"waterlevel_data": [...]}}
+ITEMS_ARRAY_PATHS = {('data',), ('data', 'waterlevel_data')}
+
+
+def create_session(pool_size=4):
+    """
+    สร้าง requests.Session ที่ใช้ connection ร่วมกัน (keep-alive)
+    pool_size ควรเท่ากับจำนวน thread ที่ยิง request พร้อมกัน
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.verify = False
+    return session
+
+
+def month_chunks(start_date, end_date):
+    """
+    แบ่งช่วงวันที่เป็นก้อนรายเดือน
+
+    Returns:
+        list: [(chunk_start, chunk_end), ...] เป็น datetime (ไม่รวมเวลา)
+    """
+    chunks = []
+    current_date = start_date
+    while current_date <= end_date:
+        if current_date.month == 12:
+            next_month = current_date.replace(year=current_date.year + 1, month=1, day=1)
+        else:
+            next_month = current_date.replace(month=current_date.month + 1, day=1)
+
+        chunk_end_date = min(next_month - timedelta(days=1), end_date)
+        chunks.append((current_date, chunk_end_date))
+        current_date = next_month
+    return chunks
+
+
+def fetch_waterlevel_graph(session, api_id, start_date, end_date, base_url=API_BASE_URL,
+                           retries=MAX_RETRIES, backoff=RETRY_BACKOFF):
+    """
+    ดึงข้อมูลระดับน้ำย้อนหลังของ 1 สถานี ในช่วงวันที่ที่กำหนด (ลองใหม่แบบ backoff ถ้าล้มเหลว)
+
+    Returns:
+        dict: JSON response ของ waterlevel_graph
+    """
+    url = f"{base_url}/waterlevel_graph"
+    # ใช้ %20 แทนช่องว่าง (รูปแบบเดียวกับที่ API ใช้)
+    params = urlencode({
+        'station_type': 'tele_waterlevel',
+        'station_id': api_id,
+        'start_date': start_date.strftime('%Y-%m-%d'),
+        'end_date': end_date.strftime('%Y-%m-%d') + ' 23:59',
+    }, quote_via=quote)
+
+    for attempt in range(retries + 1):
+        try:
+            response = session.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError):
+            if attempt == retries:
+                raise
+            time.sleep(backoff * (2 ** attempt))
+
+
+def fetch_chunks_concurrently(session, jobs, workers=4, base_url=API_BASE_URL,
+                              retries=MAX_RETRIES, backoff=RETRY_BACKOFF):
+    """
+    ดึงข้อมูลหลายก้อนพร้อมกัน (จำกัดจำนวน thread ตาม workers)
+    ส่งงานเข้า pool ไม่เกิน 2 * workers ก้อนในแต่ละช่วง แล้วค่อยส่งก้อนถัดไปเมื่อมีก้อนเสร็จ
+    payload ที่โหลดเสร็จแต่ยังไม่ถูกนำไปใช้จึงค้างในหน่วยความจำได้ไม่เกินจำนวนนี้ ไม่ว่าช่วงวันที่จะยาวแค่ไหน
+
+    Args:
+        jobs: iterable ของ (api_id, chunk_start, chunk_end)
+
+    Yields:
+        (job, data, error) ตามลำดับที่โหลดเสร็จ; error เป็น None ถ้าสำเร็จ
+    """
+    jobs = iter(jobs)
+    max_in_flight = 2 * workers
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit(batch):
+            for api_id, start, end in batch:
+                future = executor.submit(fetch_waterlevel_graph, session, api_id, start, end, base_url, retries, backoff)
+                pending[future] = (api_id, start, end)
+
+        pending = {}
+        submit(islice(jobs, max_in_flight))
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = pending.pop(future)
+                try:
+                    result = (job, future.result(), None)
+                except Exception as e:
+                    result = (job, None, e)
+                # ส่งก้อนถัดไปก่อน yield ให้ thread ทำงานต่อระหว่างที่ผู้เรียกบันทึกก้อนนี้
+                submit(islice(jobs, 1))
+                yield result
+
+
+def extract_waterlevel_items(data):
+    """
+    ดึง list ของสถานีออกจาก payload ของ public/waterlevel ที่ parse แล้วทั้งก้อน
+    (API ส่งมาเป็น list ใน 'data', ใน 'data.waterlevel_data' หรือเป็น list ตรง ๆ)
+    """
+    if isinstance(data, list):
+        return data
+    if 'data' in data:
+        if isinstance(data['data'], list):
+            return data['data']
+        if 'waterlevel_data' in data['data']:
+            return data['data']['waterlevel_data']
+    return []
+
+
+def station_code_of(item):
+    """รหัสสถานีแบบเดิม (เช่น M.7) ของ item ใน payload"""
+    return (item.get('station') or {}).get('tele_station_oldcode', '')
+
+
+class _ItemsArrayFinder:
+    """
+    หาจุดเริ่ม list ของสถานีใน payload ที่ยังมาไม่ครบ (สแกนต่อจากตำแหน่งเดิมทุกครั้งที่ buffer ยาวขึ้น)
+    ติดตามระดับ object/array และ key ของแต่ละระดับ จึงจับเฉพาะ key ตาม ITEMS_ARRAY_PATHS
+    ไม่จับ "data": [ ที่ซ้อนอยู่ใน object อื่น (เช่น metadata / error) ที่มาก่อน
+    """
+
+    def __init__(self):
+        self.scan_pos = 0
+        self.stack = []          # [ชนิด ('{' หรือ '['), key ล่าสุดของ object ระดับนั้น]
+        self.in_string = False
+        self.escaped = False
+        self.string_start = None
+        self.last_string = None  # string ที่เพิ่งปิด (จะเป็น key ถ้าตามด้วย ':')
+
+    def find(self, buf):
+        """
+        Returns:
+            int ตำแหน่งถัดจาก '[' ของ list สถานี หรือ None ถ้ายังไม่เจอใน buf
+        """
+        i = self.scan_pos
+        while i < len(buf):
+            ch = buf[i]
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == '\\':
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+                    self.last_string = json.loads(buf[self.string_start:i + 1])
+            elif ch == '"':
+                self.in_string = True
+                self.string_start = i
+            elif ch == ':' and self.stack and self.stack[-1][0] == '{':
+                self.stack[-1][1] = self.last_string
+            elif ch in '{[':
+                path = tuple(key for kind, key in self.stack)
+                if ch == '[' and all(kind == '{' for kind, _ in self.stack) and path in ITEMS_ARRAY_PATHS:
+                    self.scan_pos = i + 1
+                    return i + 1
+                self.stack.append([ch, None])
+            elif ch in '}]' and self.stack:
+                self.stack.pop()
+            i += 1
+        self.scan_pos = i
+        return None
+
+
+def iter_waterlevel_items(chunks, station_codes=None):
+    """
+    อ่าน payload ของ public/waterlevel แบบ stream ทีละ item โดยไม่ต้องโหลด JSON ทั้งก้อน
+    item ที่รหัสสถานีไม่อยู่ใน station_codes จะถูกทิ้งทันที (ไม่เก็บไว้ในหน่วยความจำ)
+
+    Args:
+        chunks: iterable ของ bytes (เช่น response.iter_content())
+        station_codes: รหัสสถานีที่ต้องการ (None = เอาทุกสถานี)
+
+    Yields:
+        dict: item ของแต่ละสถานี
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = None  # ตำแหน่งถัดไปใน list (None = ยังหาจุดเริ่ม list ไม่เจอ)
+    finder = _ItemsArrayFinder()
+
+    def read_more():
+        for chunk in chunks:
+            text = text_decoder.decode(chunk)
+            if text:
+                return text
+        return None
+
+    while True:
+        if pos is None:
+            stripped = buf.lstrip()
+            if stripped.startswith('['):
+                pos = len(buf) - len(stripped) + 1
+            elif stripped:
+                pos = finder.find(buf)
+
+        if pos is not None:
+            # อ่าน item ที่สมบูรณ์ทั้งหมดใน buffer
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos >= len(buf):
+                    break
+                if buf[pos] == ']':
+                    return
+                try:
+                    item, pos = decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    break  # item ยังมาไม่ครบ ต้องอ่านเพิ่ม
+                if station_codes is None or station_code_of(item) in station_codes:
+                    yield item
+
+            buf = buf[pos:]
+            pos = 0
+
+        more = read_more()
+        if more is None:
+            if pos is None:
+                return  # payload ไม่มี list ของสถานี
+            raise ValueError('Unexpected end of ThaiWater waterlevel payload')
+        buf += more
+
+
+def parse_observation_time(value, tz=None):
+    """
+    แปลงเวลาจาก API ('YYYY-MM-DD HH:MM[:SS]' เวลาไทย) เป็น datetime แบบ aware
+
+    Returns:
+        datetime หรือ None ถ้าไม่มีค่า / รูปแบบไม่ถูกต้อง
+    """
+    if not value:
+        return None
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M'):
+        try:
+            return make_aware(datetime.strptime(value, fmt), timezone=tz or get_current_timezone())
+        except ValueError:
+            continue
+    return None
+
+
+def fetch_waterlevel_items(station_codes, base_url=API_BASE_URL, stream=True, etag=None, last_modified=None):
+    """
+    ดึงข้อมูลระดับน้ำล่าสุดทั่วประเทศ (public/waterlevel) แล้วคืนเฉพาะสถานีที่ต้องการ
+    ถ้าส่ง etag/last_modified ของรอบก่อนมา จะขอแบบมีเงื่อนไข (ไม่มีข้อมูลใหม่ = 304 ไม่ต้องโหลด payload)
+
+    Args:
+        station_codes: รหัสสถานีแบบเดิม (เช่น {'M.7', 'M.5'})
+        stream: True = อ่านทีละ item (ใช้หน่วยความจำน้อย), False = โหลด JSON ทั้งก้อนแบบเดิม
+        etag, last_modified: ค่า ETag / Last-Modified จาก response ครั้งก่อน
+
+    Returns:
+        tuple: (items, etag, last_modified) โดย items เป็น None ถ้า server ตอบ 304 Not Modified
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+
+    with requests.get(f"{base_url}/waterlevel", headers=headers, verify=False,
+                      timeout=REQUEST_TIMEOUT, stream=stream) as response:
+        if response.status_code == 304:
+            return None, etag, last_modified
+        response.raise_for_status()
+
+        new_etag = response.headers.get('ETag')
+        new_last_modified = response.headers.get('Last-Modified')
+        if stream:
+            items = list(iter_waterlevel_items(response.iter_content(STREAM_CHUNK_SIZE), station_codes))
+        else:
+            items = [item for item in extract_waterlevel_items(response.json()) if station_code_of(item) in station_codes]
+        return items, new_etag, new_last_modified
@@ -1,21 +1,64 @@
+from datetime import timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.blocking import BlockingScheduler
 from django.core.management import call_command
+from django.utils import timezone
+from . import alert_queue, ingest
 
 def update_water_data():
     try:
         print("⏰ Scheduler: กำลังเริ่มดึงข้อมูลระดับน้ำอัตโนมัติ...")
-        call_command('scrape_data') # เรียก management command scrape_data
+        # once_per_cycle: ถ้ามี process อื่นดึงรอบนี้ไปแล้ว (worker อื่น / GitHub Actions) จะข้ามไป
+        call_command('scrape_data', once_per_cycle=True) # เรียก management command scrape_data
         print("✅ Scheduler: ดึงข้อมูลเสร็จสิ้น")
     except Exception as e:
         print(f"❌ Scheduler Error: {e}")
 
+def scheduled_update(scheduler):
+    """ดึงข้อมูล 1 รอบ แล้วตั้งเวลารอบถัดไปตามสภาพน้ำล่าสุด"""
+    try:
+        update_water_data()
+    finally:
+        schedule_next(scheduler)
+
+def schedule_next(scheduler):
+    # ความถี่ปรับตามสภาพน้ำ (ingest.polling_interval): หน้าแล้งทุก 60 นาที, ปกติ 30, ใกล้เฝ้าระวัง/TS2 ขึ้นเร็ว 15
+    # รอบยังตรงกับนาทีที่ 02, 17, 32, 47 เหมือนเดิม (เผื่อเวลาดีเลย์ให้ต้นทาง 2 นาที)
+    try:
+        run_date, minutes, reason = ingest.next_run_time()
+    except Exception as e:
+        # อ่าน DB ไม่ได้ -> ลองใหม่ในอีก 1 รอบ (ไม่ให้ scheduler หยุดไปเฉย ๆ)
+        run_date, minutes, reason = timezone.now() + timedelta(minutes=ingest.CYCLE_MINUTES), ingest.CYCLE_MINUTES, f'error: {e}'
+
+    # งานแบบ date ต่อกันเป็นสายเดียว (รอบนี้ตั้งรอบหน้า) จึงไม่มีทางรันซ้อนกัน
+    # misfire_grace_time=None: ถ้า process หลับ/ค้างจนเลยเวลา ยังรันครั้งเดียวเมื่อกลับมา (ไม่รันย้อนหลังหลายรอบ)
+    scheduler.add_job(
+        scheduled_update, 'date', run_date=run_date, args=[scheduler],
+        name='scrape_data', coalesce=True, misfire_grace_time=None,
+    )
+    print(f"🗓️ Scheduler: รอบถัดไป {timezone.localtime(run_date).strftime('%H:%M:%S')} (ทุก {minutes} นาที: {reason})")
+
+def retry_alerts():
+    # ส่งแจ้งเตือนที่ค้างในคิว (เช่นโดน rate limit / LINE ล่ม หรือ process ที่ส่งอยู่ตายไปก่อน)
+    try:
+        alert_queue.drain()
+    except Exception as e:
+        print(f"❌ Alert dispatcher error: {e}")
+
+def add_jobs(scheduler):
+    scheduler.add_job(retry_alerts, 'interval', minutes=1, id='retry_alerts', max_instances=1, coalesce=True)
+
+    # คำนวณรอบแรกใน thread ของ scheduler (ไม่ query DB ระหว่าง Django กำลัง start)
+    scheduler.add_job(schedule_next, 'date', args=[scheduler], name='plan_first_scrape')
+
 def start():
+    """รัน scheduler เป็น thread เบื้องหลังใน web process (โหมดเดิม)"""
     scheduler = BackgroundScheduler()
+    add_jobs(scheduler)
+    scheduler.start()
 
-    # รันเจาะจงนาที (Cron Trigger)
-    # เว็บต้นทางอัพเดทข้อมูลทุก 15 นาที (ที่นาที 00, 15, 30, 45)
-    # ตั้งให้ดึงตอนนาทีที่ 02, 17, 32, 47 (เผื่อเวลาดีเลย์ให้ต้นทาง 2 นาที)
-    # หมายเหตุ: ถ้าต้นทางอัพเดทแค่ "รายชั่วโมง" ให้ใช้ minute='2' (คือดึงตอนนาทีที่ 2 ของทุกชั่วโมง)
-    scheduler.add_job(update_water_data, 'cron', minute='2,17,32,47')
-
-    scheduler.start()
\ No newline at end of file
+def run_forever():
+    """รัน scheduler ใน process แยก (python manage.py run_ingest) ทำงานจนกว่าจะถูกหยุด"""
+    scheduler = BlockingScheduler()
+    add_jobs(scheduler)
+    scheduler.start()
@@ -1,45 +1,35 @@
 # pages/utils.py
 
-from django.conf import settings
 from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
     MulticastRequest,
     TextMessage
 )
-from .models import Users
+from .line_client import get_messaging_api
 
-def send_multicast_alert(message_text):
-    """
-    ฟังก์ชันสำหรับส่งข้อความหา User ทุกคนที่มีสถานะ is_active = 1
+# LINE Multicast ส่งได้สูงสุด 500 คนต่อ 1 request
+MULTICAST_MAX_RECIPIENTS = 500
+
+def send_multicast_batch(user_ids, message_text, retry_key=None):
     """
-    # 1. ดึง ID ของ User ที่ Active
-    user_ids = list(Users.objects.filter(is_active=1).values_list('line_user_id', flat=True))
+    ส่งข้อความหา User 1 ชุด (ไม่เกิน MULTICAST_MAX_RECIPIENTS คน)
+    การแบ่งชุด / ส่งพร้อมกัน / ลองใหม่ อยู่ใน alert_queue
 
-    if not user_ids:
-        print("🔕 No active subscribers found.")
-        return
+    Args:
+        retry_key: X-Line-Retry-Key (ส่งซ้ำด้วย key เดิม LINE จะไม่ส่งข้อความซ้ำ)
 
-    # 2. ตั้งค่า Line API Client
-    configuration = Configuration(access_token=settings.LINE_CHANNEL_ACCESS_TOKEN)
+    Raises:
+        ApiException / urllib3 error: ถ้าส่งไม่สำเร็จ (ให้ผู้เรียกตัดสินใจว่าจะลองใหม่หรือไม่)
+    """
+    if len(user_ids) > MULTICAST_MAX_RECIPIENTS:
+        raise ValueError(f'Multicast accepts at most {MULTICAST_MAX_RECIPIENTS} recipients, got {len(user_ids)}')
 
-    try:
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            
-            # 3. ส่งข้อความแบบ Multicast
-            # ต้องส่งเป็น MulticastRequest
-            line_bot_api.multicast(
-                MulticastRequest(
-                    to=user_ids,
-                    messages=[TextMessage(text=message_text)]
-                )
-            )
-            print(f"✅ Sent alert to {len(user_ids)} users.")
-            
-    except Exception as e:
-        print(f"❌ Error sending multicast: {e}")
+    get_messaging_api().multicast(
+        MulticastRequest(
+            to=list(user_ids),
+            messages=[TextMessage(text=message_text)]
+        ),
+        x_line_retry_key=retry_key,
+    )
 
 def get_emergency_flex_message():
     """
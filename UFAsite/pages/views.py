@@ -1,45 +1,113 @@
+from datetime import timedelta
+
 from django.conf import settings
 from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
 from django.shortcuts import render
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-import logging
 from linebot.v3 import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.messaging import (
-    ApiClient,
-    Configuration,
-    MessagingApi,
     ReplyMessageRequest,
     TextMessage,
     QuickReply,
     QuickReplyItem,
-    MessageAction,
-    FlexMessage,
-    FlexContainer
+    MessageAction
 )
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
-from .models import Users, WaterLevels 
-from .risk_calculator import STATION_THRESHOLDS
-from .predictor import load_and_predict
-from pages.utils import get_emergency_flex_message
+from .models import Users, LatestWaterLevel, ForecastSnapshot
+from .predictor import PREDICT_HOURS, TARGET_STATION, load_forecasts
+from pages import line_events, status_cache
+from pages.line_client import get_messaging_api
 
 # แสดงผลหน้าเว็บ
 def home_page_view(request):
     # 1. ดึงข้อมูลล่าสุดของแต่ละสถานี (TS2=M.5, TS16=M.7, TS5=M.11B)
-    data_m5 = WaterLevels.objects.filter(station__station_id='TS2').order_by('-recorded_at').first()
-    data_m7 = WaterLevels.objects.filter(station__station_id='TS16').order_by('-recorded_at').first()
-    data_m11b = WaterLevels.objects.filter(station__station_id='TS5').order_by('-recorded_at').first()
+    # อ่านจาก snapshot ใน query เดียว (รวมชื่อสถานีด้วย select_related)
+    latest = {
+        row.station_id: row
+        for row in LatestWaterLevel.objects.select_related('station').filter(station_id__in=['TS2', 'TS16', 'TS5'])
+    }
+    data_m5 = latest.get('TS2')
+    data_m7 = latest.get('TS16')
+    data_m11b = latest.get('TS5')
 
     context = {
         'm5': data_m5,      # ต้นน้ำ
         'm7': data_m7,      # กลางน้ำ (จุดโฟกัส)
         'm11b': data_m11b,  # ปลายน้ำ
-        'today': timezone.now()
+        'today': timezone.now(),
+        'forecasts': get_forecast_charts(),  # คาดการณ์ของทุกสถานี (key = station_id)
+        'predict_hours': PREDICT_HOURS,
     }
     return render(request, 'home.html', context)
 
 
+# เส้นกราฟคาดการณ์ (SVG ฝั่ง server ไม่ต้องโหลด library กราฟ)
+FORECAST_CHART_WIDTH = 600
+FORECAST_CHART_HEIGHT = 160
+# ชั่วโมงล่วงหน้าที่แสดงเป็นตัวเลข (ทั้งบนเว็บและในแชท)
+FORECAST_KEY_HOURS = [1, 3, 6, 12, 24]
+# ForecastSnapshot ที่เก่ากว่านี้ไม่แสดง (รอบดึงข้อมูลห่างสุด 60 นาที = พลาดได้ 1 รอบ)
+FORECAST_SNAPSHOT_MAX_AGE = timedelta(hours=2)
+
+def get_forecast_charts():
+    """
+    ผลคาดการณ์ทุกสถานีทุกชั่วโมงล่วงหน้า สำหรับหน้าเว็บ
+    อ่านจาก ForecastSnapshot ใน query เดียว (scrape_data ทำนายไว้หลังบันทึกข้อมูลใหม่) render ไม่ทำนายเอง
+
+    Returns:
+        dict: station_id -> ข้อมูลกราฟ (เฉพาะสถานีที่มีผลคาดการณ์ล่าสุด)
+    """
+    snapshots = ForecastSnapshot.objects.filter(computed_at__gte=timezone.now() - FORECAST_SNAPSHOT_MAX_AGE)
+    return {snapshot.station_id: get_forecast_chart(snapshot.as_forecast()) for snapshot in snapshots}
+
+def get_forecast_chart(forecast):
+    """ผลคาดการณ์ 1 สถานี (predicted_level, risk_level, risk_text, trajectory) -> จุดของเส้นกราฟ SVG + ค่าหลัก"""
+    predicted_level, risk_level, risk_text, trajectory = forecast
+
+    levels = [level for _, level in trajectory]
+    low, high = min(levels), max(levels)
+    span = (high - low) or 1.0
+    last_hour = trajectory[-1][0] or 1
+    points = " ".join(
+        f"{hours / last_hour * FORECAST_CHART_WIDTH:.1f},"
+        f"{(high - level) / span * (FORECAST_CHART_HEIGHT - 20) + 10:.1f}"
+        for hours, level in trajectory
+    )
+    return {
+        'level': predicted_level,
+        'points': points,
+        'width': FORECAST_CHART_WIDTH,
+        'height': FORECAST_CHART_HEIGHT,
+        'low': low,
+        'high': high,
+        'key_points': [(hours, level) for hours, level in trajectory if hours in FORECAST_KEY_HOURS],
+        'risk_level': risk_level,
+        'risk_text': risk_text,
+    }
+
+def format_forecast_lines(trajectory):
+    """ข้อความแนวโน้มระดับน้ำรายชั่วโมงสำหรับแชท (เฉพาะชั่วโมงหลัก + จุดสูงสุด)"""
+    lines = [
+        f"   +{hours} ชม.: {level:.2f} ม."
+        for hours, level in trajectory if hours in FORECAST_KEY_HOURS
+    ]
+    peak_hours, peak_level = max(trajectory, key=lambda point: point[1])
+    lines.append(f"🔺 สูงสุด {peak_level:.2f} ม. ในอีก {peak_hours} ชม.")
+    return "\n".join(lines)
+
+def format_other_stations(forecasts):
+    """ข้อความคาดการณ์อีก PREDICT_HOURS ชม. ของสถานีอื่น (เกณฑ์เตือนของแต่ละสถานี) ว่างถ้าไม่มีผล"""
+    lines = [
+        f"   {alias}: {forecasts[station_id][0]:.2f} ม. ({forecasts[station_id][2]})"
+        for alias, station_id in status_cache.STATION_ALIASES
+        if station_id != TARGET_STATION and station_id in forecasts and forecasts[station_id][0] is not None
+    ]
+    if not lines:
+        return ""
+    return f"📍 สถานีอื่นในอีก {PREDICT_HOURS} ชม.:\n" + "\n".join(lines) + "\n------------------------------\n"
+
+
 # ฟังก์ชันส่งตัวเลือก (Helper Function)
 def get_station_selection_message():
     """
@@ -70,65 +138,14 @@ def get_station_selection_message():
 
 def get_latest_water_status(station_code='TS16'):
     try:
-        # กำหนด Mapping ระหว่าง "คำที่กด" กับ "Station ID ใน Database"
-        # M.5 = TS2 (ศรีสะเกษ)
-        # M.7 = TS16 (เมืองอุบล)
-        # M.11B = TS5 (ท้ายแก่งสะพือ)
-        
-        db_station_id = 'TS16' # ค่า Default (เผื่อหาไม่เจอ)
-        
-        if 'M.5' in station_code:
-            db_station_id = 'TS2'
-        elif 'M.7' in station_code:
-            db_station_id = 'TS16'
-        elif 'M.11B' in station_code:
-            db_station_id = 'TS5'
-        
-        # ดึงข้อมูลล่าสุดตาม ID ที่ระบุ
-        latest_data = WaterLevels.objects.filter(
-            station__station_id=db_station_id
-        ).order_by('-recorded_at').first()
-
-        if not latest_data:
-            return f"❌ ขออภัย ยังไม่มีข้อมูลของสถานี {station_code} ในระบบครับ"
-        
-        # 3.ดึงเกณฑ์แจ้งเตือนของสถานีนี้ มาเตรียมไว้
-        # ถ้าหาไม่เจอ ให้ใช้ของ TS16 เป็นค่า Default
-        thresholds = STATION_THRESHOLDS.get(db_station_id, STATION_THRESHOLDS['TS16'])
-        warn_val = thresholds['warn']
-        crit_val = thresholds['crit']
-
-        # แปลงรหัสความเสี่ยง
-        risk_map = {
-            0: "🟢 ปกติ",
-            1: "🟡 เฝ้าระวัง",
-            2: "🔴 วิกฤต"
-        }
-        current_risk = risk_map.get(latest_data.risk_level, "ไม่ระบุ")
-        time_str = timezone.localtime(latest_data.recorded_at).strftime('%d/%m/%Y %H:%M')
-
-        # สร้างข้อความตอบกลับ
-        reply_msg = (
-            f"🌊 รายงานสถานการณ์น้ำ\n📍 {latest_data.station.station_name}\n"
-            f"🕒 ข้อมูล ณ: {time_str}\n"
-            f"------------------------------\n"
-            f"💧 ระดับน้ำ: {latest_data.water_level} ม.(รทก.)\n"
-            f"⚠️ อยู่ในสถานะ: {current_risk}\n"
-            f"------------------------------\n"
-            f"📢 เกณฑ์การแจ้งเตือน:\n"
-            f"🟡 เฝ้าระวัง: > {warn_val} ม.\n"
-            f"🔴 วิกฤต: > {crit_val} ม.\n"
-            f"------------------------------\n"
-            f"ติดตามสถานการณ์อย่างใกล้ชิดนะครับ ☔"
-        )
-        return reply_msg
+        # ข้อความสร้างไว้ล่วงหน้าตอนมีข้อมูลใหม่ (status_cache) ไม่ต้อง query/จัดรูปแบบใหม่ทุกครั้งที่กด
+        return status_cache.get_status_message(station_code)
 
     except Exception as e:
         print(f"Error querying database: {e}")
         return "เกิดข้อผิดพลาดในการดึงข้อมูลชั่วคราวครับ"
 
 # ต่อกับ LINE
-configuration = Configuration(access_token=settings.LINE_CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(channel_secret=settings.LINE_CHANNEL_SECRET)
 
 
@@ -139,25 +156,28 @@ def webhook(request):
     print("✅ Webhook received a request!")
 
     # ตรวจสอบลายเซ็นจาก LINE
-    signature = request.META['HTTP_X_LINE_SIGNATURE']
+    signature = request.META.get('HTTP_X_LINE_SIGNATURE')
+    if not signature:
+        return HttpResponseBadRequest()
     body = request.body.decode('utf-8')
 
     # --- DEBUG POINT 2: พิมพ์ข้อมูลทั้งหมดที่ LINE ส่งมาให้ดู ---
     # สำคัญที่สุดในการ Debug
     print(f"Request body: {body}")
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
+    if not handler.parser.signature_validator.validate(body, signature):
         # --- DEBUG POINT 3: แจ้งเตือนเมื่อลายเซ็นไม่ถูกต้อง ---
         # (สาเหตุมักจะมาจาก Channel Secret ใน settings.py ผิด)
         print("❌ Invalid signature. Please check your channel secret.")
         return HttpResponseForbidden()
-    except Exception as e:
-        # --- DEBUG POINT 4: ดักจับ Error อื่นๆ ทั้งหมดที่อาจเกิดขึ้น ---
-        # (เช่น Error ที่เกิดในฟังก์ชัน handle_message)
-        print(f"❌ An error occurred: {e}")
-        # (อาจจะยังไม่ต้อง return error กลับไปก็ได้ เพื่อให้ LINE ไม่พยายามส่งซ้ำ)
+
+    # ลายเซ็นถูกต้อง -> ส่ง event ไปประมวลผลใน thread pool แล้วตอบ 200 ทันที
+    # (คำขอพยากรณ์ที่ใช้เวลานานจะไม่ทำให้ LINE ส่ง webhook ซ้ำ หรือทำให้ request อื่นต้องรอ)
+    # Error ที่เกิดใน handle_message จะถูก log ใน line_events
+    if line_events.submit(handler.handle, body, signature) is None:
+        # event ค้างเต็มคิวแล้ว: ตอบ 503 ให้ LINE ส่งมาใหม่ภายหลัง (ถ้าเปิด redelivery ไว้) แทนการต่อคิวไม่จำกัด
+        print("⚠️ Webhook backlog is full, rejecting events with 503.")
+        return HttpResponse('Busy', status=503)
 
     return HttpResponse('OK')
 
@@ -168,116 +188,114 @@ def handle_message(event):
     if event.source.type != 'user':
         return
 
-    with ApiClient(configuration) as api_client:
-        line_bot_api = MessagingApi(api_client)
-        user_id = event.source.user_id
-        text = event.message.text.strip()
-        reply_token = event.reply_token
-        
-        reply_text = "" # ตัวแปรสำหรับเก็บข้อความตอบกลับแบบปกติ
-
-        # ---------------------------------------------------
-        # CASE 1: สมัคร/ยกเลิก
-        # ---------------------------------------------------
-        if text == 'รับการแจ้งเตือน':
-            user, created = Users.objects.get_or_create(
-                line_user_id=user_id,
-                defaults={'is_active': True, 'is_admin': False, 'registered_at': timezone.now()}
-            )
-            if created:
-                reply_text = "คุณได้สมัครรับการแจ้งเตือนเรียบร้อยแล้วครับ 😊"
-            else:
-                if not user.is_active:
-                    user.is_active = True
-                    user.subscribed_at = timezone.now()
-                    user.save()
-                    reply_text = "กลับมาสมัครรับการแจ้งเตือนอีกครั้ง ยินดีต้อนรับ 😊"
-                else:
-                    reply_text = "คุณได้สมัครรับการแจ้งเตือนไว้แล้วครับ"
-
-        elif text == 'ยกเลิกการแจ้งเตือน':
-            updated_count = Users.objects.filter(line_user_id=user_id, is_active=True).update(is_active=False)
-            if updated_count > 0:
-                reply_text = "ยกเลิกการรับข้อมูลเรียบร้อยแล้วครับ"
+    # client ตัวเดียวต่อ process (connection pool ร่วมกับตัวส่งแจ้งเตือน)
+    line_bot_api = get_messaging_api()
+    user_id = event.source.user_id
+    text = event.message.text.strip()
+    reply_token = event.reply_token
+    
+    reply_text = "" # ตัวแปรสำหรับเก็บข้อความตอบกลับแบบปกติ
+
+    # ---------------------------------------------------
+    # CASE 1: สมัคร/ยกเลิก
+    # ---------------------------------------------------
+    if text == 'รับการแจ้งเตือน':
+        user, created = Users.objects.get_or_create(
+            line_user_id=user_id,
+            defaults={'is_active': True, 'is_admin': False, 'registered_at': timezone.now()}
+        )
+        if created:
+            reply_text = "คุณได้สมัครรับการแจ้งเตือนเรียบร้อยแล้วครับ 😊"
+        else:
+            if not user.is_active:
+                user.is_active = True
+                user.subscribed_at = timezone.now()
+                user.save()
+                reply_text = "กลับมาสมัครรับการแจ้งเตือนอีกครั้ง ยินดีต้อนรับ 😊"
             else:
-                reply_text = "คุณยังไม่ได้สมัครรับการแจ้งเตือนครับ"
-
-        # ---------------------------------------------------
-        # CASE 2: ขอเมนูเลือกสถานี
-        # ---------------------------------------------------
-        # เช็คคำให้ตรงกับที่ตั้งใน Rich Menu
-        elif text == 'สถานะน้ำ' or text == 'สถานะน้ำปัจจุบัน' or text == 'ดูระดับน้ำ':
-            # เรียกฟังก์ชันสร้างปุ่ม Quick Reply
-            message_obj = get_station_selection_message()
-            
-            # ส่งกลับทันที (เพราะมันเป็น Object ไม่ใช่ Text ธรรมดา)
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=reply_token,
-                    messages=[message_obj]
-                )
+                reply_text = "คุณได้สมัครรับการแจ้งเตือนไว้แล้วครับ"
+
+    elif text == 'ยกเลิกการแจ้งเตือน':
+        updated_count = Users.objects.filter(line_user_id=user_id, is_active=True).update(is_active=False)
+        if updated_count > 0:
+            reply_text = "ยกเลิกการรับข้อมูลเรียบร้อยแล้วครับ"
+        else:
+            reply_text = "คุณยังไม่ได้สมัครรับการแจ้งเตือนครับ"
+
+    # ---------------------------------------------------
+    # CASE 2: ขอเมนูเลือกสถานี
+    # ---------------------------------------------------
+    # เช็คคำให้ตรงกับที่ตั้งใน Rich Menu
+    elif text == 'สถานะน้ำ' or text == 'สถานะน้ำปัจจุบัน' or text == 'ดูระดับน้ำ':
+        # เรียกฟังก์ชันสร้างปุ่ม Quick Reply
+        message_obj = get_station_selection_message()
+        
+        # ส่งกลับทันที (เพราะมันเป็น Object ไม่ใช่ Text ธรรมดา)
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=reply_token,
+                messages=[message_obj]
             )
-            return # จบการทำงานฟังก์ชันนี้เลย ไม่ต้องทำข้างล่างต่อ
-
-        # ---------------------------------------------------
-        # CASE 3: ผู้ใช้กดเลือกสถานี
-        # ---------------------------------------------------
-        elif text.startswith('ดู M.') or text.startswith('ดู เขื่อน'):
-            # เรียกฟังก์ชันดึงข้อมูล พร้อมส่งข้อความที่กดไปตัดเช็ค
-            reply_text = get_latest_water_status(station_code=text)
-
-        # ---------------------------------------------------
-        # CASE 4: คาดการณ์น้ำท่วม
-        # ---------------------------------------------------
-        elif text == 'คาดการณ์ล่วงหน้า':
-            # 1. เรียกฟังก์ชันคาดการณ์
-            predicted_wl, risk_level, risk_text = load_and_predict()
-
-            # 2. ตรวจสอบผลลัพธ์
-            if predicted_wl is not None:
-                # 2.1 ถ้าทำนายสำเร็จ
-                reply_text = (
-                    f"🔮 ผลการคาดการณ์ระดับน้ำที่ M.7 (เมืองอุบลฯ) ในอีก 6 ชั่วโมงข้างหน้า\n"
-                    f"------------------------------\n"
-                    f"💧 ระดับน้ำที่คาดการณ์: {predicted_wl:.2f} ม.(รทก.)\n"
-                    f"⚠️ สถานะ: {risk_text}\n"
-                    f"------------------------------\n"
-                    f"ข้อความนี้เป็นการประมวลผลจากแบบจำลองเชิงคณิตศาสตร์ ควรใช้เพื่อการเฝ้าระวังและเตรียมตัวเท่านั้น"
-                )
-            else:
-                # 2.2 ถ้าทำนายไม่สำเร็จ (เช่น ไม่มีไฟล์โมเดล), risk_text จะมีข้อความ Error มา
-                reply_text = risk_text
-
-        # ---------------------------------------------------
-        # ส่งข้อความตอบกลับ (สำหรับ Case ที่ได้ reply_text)
-        # ---------------------------------------------------
-        if reply_text:
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=reply_token,
-                    messages=[TextMessage(text=reply_text)]
-                )
+        )
+        return # จบการทำงานฟังก์ชันนี้เลย ไม่ต้องทำข้างล่างต่อ
+
+    # ---------------------------------------------------
+    # CASE 3: ผู้ใช้กดเลือกสถานี
+    # ---------------------------------------------------
+    elif text.startswith('ดู M.') or text.startswith('ดู เขื่อน'):
+        # เรียกฟังก์ชันดึงข้อมูล พร้อมส่งข้อความที่กดไปตัดเช็ค
+        reply_text = get_latest_water_status(station_code=text)
+
+    # ---------------------------------------------------
+    # CASE 4: คาดการณ์น้ำท่วม
+    # ---------------------------------------------------
+    elif text == 'คาดการณ์ล่วงหน้า':
+        # 1. เรียกฟังก์ชันคาดการณ์
+        forecasts = load_forecasts()
+        predicted_wl, risk_level, risk_text, trajectory = forecasts[TARGET_STATION]
+
+        # 2. ตรวจสอบผลลัพธ์
+        if predicted_wl is not None:
+            # 2.1 ถ้าทำนายสำเร็จ
+            reply_text = (
+                f"🔮 ผลการคาดการณ์ระดับน้ำที่ M.7 (เมืองอุบลฯ) ในอีก 6 ชั่วโมงข้างหน้า\n"
+                f"------------------------------\n"
+                f"💧 ระดับน้ำที่คาดการณ์: {predicted_wl:.2f} ม.(รทก.)\n"
+                f"⚠️ สถานะ: {risk_text}\n"
+                f"------------------------------\n"
+                f"📈 แนวโน้ม 24 ชม.:\n{format_forecast_lines(trajectory)}\n"
+                f"------------------------------\n"
+                f"{format_other_stations(forecasts)}"
+                f"ข้อความนี้เป็นการประมวลผลจากแบบจำลองเชิงคณิตศาสตร์ ควรใช้เพื่อการเฝ้าระวังและเตรียมตัวเท่านั้น"
             )
+        else:
+            # 2.2 ถ้าทำนายไม่สำเร็จ (เช่น ไม่มีไฟล์โมเดล), risk_text จะมีข้อความ Error มา
+            reply_text = risk_text
 
-        # ---------------------------------------------------
-        # CASE 6: ขอข้อมูลติดต่อฉุกเฉิน
-        # ---------------------------------------------------
-        elif text == 'ข้อมูลติดต่อฉุกเฉิน':
-            
-            # ดึง JSON ของ Flex Message มา
-            flex_json = get_emergency_flex_message()
-            
-            # แปลงเป็น Object ของ Line SDK
-            flex_message = FlexMessage(
-                alt_text="เบอร์โทรฉุกเฉิน", # ข้อความที่จะขึ้นแจ้งเตือน (Notification)
-                contents=FlexContainer.from_dict(flex_json)
+    # ---------------------------------------------------
+    # ส่งข้อความตอบกลับ (สำหรับ Case ที่ได้ reply_text)
+    # ---------------------------------------------------
+    if reply_text:
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=reply_token,
+                messages=[TextMessage(text=reply_text)]
             )
-            
-            # ส่งกลับหา User
-            line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=reply_token,
-                    messages=[flex_message]
-                )
+        )
+
+    # ---------------------------------------------------
+    # CASE 6: ขอข้อมูลติดต่อฉุกเฉิน
+    # ---------------------------------------------------
+    elif text == 'ข้อมูลติดต่อฉุกเฉิน':
+        
+        # Flex Message สร้างไว้ครั้งเดียวต่อ process (เนื้อหาไม่เปลี่ยน)
+        flex_message = status_cache.get_emergency_reply()
+        
+        # ส่งกลับหา User
+        line_bot_api.reply_message(
+            ReplyMessageRequest(
+                reply_token=reply_token,
+                messages=[flex_message]
             )
-            return # จบการทำงาน
\ No newline at end of file
+        )
+        return # จบการทำงาน
\ No newline at end of file